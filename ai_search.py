@@ -3,25 +3,14 @@ AI Chat Search (OpenAI) — перетворює запити природною
 Використовує OpenAI для побудови FTS5 запиту та вибору категорій/нод.
 """
 
-import os
 import json
-import asyncio
 import logging
-from openai import OpenAI
 
-from database import get_all_nodes, get_all_categories, search_workflows
+import async_db as db
+import llm_gateway as llm
 
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
-OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
-
-try:
-    client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-except Exception as e:
-    logger.error(f"Failed to initialize OpenAI client for search: {e}")
-    client = None
-
 SEARCH_SYSTEM_PROMPT = """Ти — AI-помічник для пошуку n8n воркфлоу.
 Твоє завдання: отримати запит користувача та перетворити його на параметри пошуку.
 
@@ -38,52 +27,46 @@ SEARCH_SYSTEM_PROMPT = """Ти — AI-помічник для пошуку n8n 
 
 async def translate_query(user_query: str) -> dict:
     """Translate natural language query to search parameters."""
-    if not OPENAI_API_KEY:
+    if not llm.available():
         return {
             "fts_query": user_query,
             "category": "",
             "node": "",
             "explanation": "AI-пошук не налаштовано. Використовую звичайний пошук."
         }
-    
-    if not client:
-        return {
-            "fts_query": user_query,
-            "category": "",
-            "node": "",
-            "explanation": "OpenAI клієнт не ініціалізовано. Використовую звичайний пошук."
-        }
 
     try:
         # Get context
         logger.info("Retrieving categories and nodes...")
-        categories = get_all_categories()
-        nodes = get_all_nodes()
+        categories = await db.get_all_categories()
+        nodes = await db.get_all_nodes()
         logger.info(f"Context retrieved: {len(categories)} categories, {len(nodes)} nodes.")
         
         # Limit nodes to most common ones
         nodes_list = nodes[:20] 
         cats_list = categories
 
-        logger.info(f"Sending AI Search request to {OPENAI_MODEL}...")
+        logger.info(f"Sending AI Search request to {llm.OPENAI_MODEL}...")
         
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SEARCH_SYSTEM_PROMPT.format(
-                    categories=", ".join(cats_list),
-                    nodes=", ".join(nodes_list)
-                )},
-                {"role": "user", "content": user_query}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2
-        )
+        content, _, _ = await llm.complete("chat", [
+            {"role": "system", "content": SEARCH_SYSTEM_PROMPT.format(
+                categories=", ".join(cats_list),
+                nodes=", ".join(nodes_list)
+            )},
+            {"role": "user", "content": user_query}
+        ], temperature=0.2)
         
-        result = json.loads(response.choices[0].message.content)
+        result = json.loads(content)
         return result
 
+    except llm.LLMUnavailable as e:
+        logger.warning(f"AI Chat Search skipped: {e}")
+        return {
+            "fts_query": user_query,
+            "category": "",
+            "node": "",
+            "explanation": "AI тимчасово недоступний. Використовую звичайний пошук."
+        }
     except Exception as e:
         logger.error(f"AI Chat Search error: {e}")
         error_msg = str(e)
@@ -101,12 +84,12 @@ async def perform_ai_search(query: str, page: int = 1):
     params = await translate_query(query)
     
     # 2. Perform actual search in DB
-    search_results = search_workflows(
+    search_results = await db.search_workflows(
         query=params.get("fts_query", query),
         category=params.get("category", ""),
         node=params.get("node", ""),
         page=page,
-        sort="usefulness"
+        sort="relevance"
     )
     
     # 3. Parse JSON strings in results for frontend
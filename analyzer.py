@@ -2,36 +2,61 @@
 AI Workflow Analyzer (OpenAI) — аналізує n8n воркфлоу через OpenAI API.
 Оцінює: корисність, універсальність, складність, масштабність.
 Генерує: короткий опис українською + теги для пошуку.
+
+Bulk analysis goes through the analysis_queue table (see database.py): imports and
+the admin endpoints only enqueue, and run_worker() — started in the app lifespan of
+every process — claims entries under a lease, retries failures with exponential
+backoff and dead-letters a workflow after ANALYSIS_MAX_ATTEMPTS. Progress therefore
+survives restarts and deploys, and several workers share one backlog.
+
+Each worker keeps up to ANALYSIS_CONCURRENCY requests in flight through the
+shared LLM gateway (llm_gateway.py), paced by an adaptive RPM/TPM token bucket
+(ratelimit.py), and saves finished analyses in batches of up to
+ANALYSIS_FLUSH_SIZE per write transaction. With ANALYSIS_PACK_SIZE > 1 one request
+carries several workflows under a single copy of the instructions, and items the
+model got wrong are retried one by one. Results are also cached under a hash
+of the prompt inputs (analysis_key), so copies of a template synced from other
+repos get the stored analysis without a call.
 """
 
 import os
 import json
+import random
+import hashlib
+import socket
 import asyncio
 import logging
-from openai import OpenAI
+from datetime import datetime, timedelta
+from openai import RateLimitError
 
-from database import update_workflow_ai, get_unanalyzed_workflows, get_workflow
+import async_db as db
+import llm_gateway as llm
+from ratelimit import RateLimiter
 
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
-OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
-
-try:
-    client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-except Exception as e:
-    logger.error(f"Failed to initialize OpenAI client: {e}")
-    client = None
-
-# Global status for tracking progress
-analysis_status = {
-    "status": "idle",  # idle, running
-    "total": 0,
-    "analyzed": 0,
-    "errors": 0,
-    "start_time": None
-}
-analysis_lock = asyncio.Lock()
+ANALYSIS_MAX_ATTEMPTS = int(os.environ.get("ANALYSIS_MAX_ATTEMPTS", "5"))
+ANALYSIS_LEASE_SECONDS = int(os.environ.get("ANALYSIS_LEASE_SECONDS", "300"))
+ANALYSIS_LEASE_RENEW = ANALYSIS_LEASE_SECONDS / 3  # seconds between heartbeats for held entries
+ANALYSIS_RETRY_BASE = float(os.environ.get("ANALYSIS_RETRY_BASE", "30"))  # seconds, doubled per attempt
+ANALYSIS_RETRY_MAX = 6 * 3600
+ANALYSIS_CONCURRENCY = llm.PURPOSES["analysis"]["concurrency"]  # requests in flight per worker
+ANALYSIS_RPM = int(os.environ.get("ANALYSIS_RPM", "500"))  # provider limits for OPENAI_MODEL (0: unlimited)
+ANALYSIS_TPM = int(os.environ.get("ANALYSIS_TPM", "200000"))
+ANALYSIS_RATE_LIMIT_RETRIES = 5  # 429s absorbed per workflow before it counts as a failed attempt
+ANALYSIS_OUTPUT_TOKENS = 700     # expected completion size, for the TPM estimate
+ANALYSIS_TEMPERATURE = 0.3
+ANALYSIS_PACK_SIZE = max(1, int(os.environ.get("ANALYSIS_PACK_SIZE", "1")))  # workflows per request
+ANALYSIS_FLUSH_SIZE = 20         # analyses saved per write transaction
+ANALYSIS_FLUSH_INTERVAL = 2.0    # seconds a finished analysis may wait for its batch
+ANALYSIS_IDLE_POLL = 60          # seconds between queue checks when nothing is due
+ANALYSIS_COPY_EVERY = 50         # analyses between near-duplicate copy passes
+
+# The random part keeps a restarted process (same host and pid, as in a container) from
+# taking its predecessor's leases for its own: claim_analysis() never reclaims those
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(3).hex()}"
+_wakeup = asyncio.Event()
+limiter = RateLimiter(ANALYSIS_RPM, ANALYSIS_TPM)
 
 ANALYSIS_PROMPT = """Ти — експерт з n8n автоматизацій. Проаналізуй цей workflow та дай структуровану відповідь у JSON ДВОМА МОВАМИ (українською та англійською).
 
@@ -81,11 +106,32 @@ Workflow:
 }}"""
 
 
-def _build_prompt(wf: dict) -> str:
-    """Build analysis prompt from workflow data."""
+# Packed mode: the same instructions once for several workflows, answered as a "results"
+# list (JSON mode only allows an object at the top level)
+PACKED_PROMPT = (
+    "Ти — експерт з n8n автоматизацій. Проаналізуй КОЖЕН з {count} workflow нижче та дай структуровану "
+    "відповідь у JSON ДВОМА МОВАМИ (українською та англійською).\n\n{workflows}\n\n"
+    + ANALYSIS_PROMPT[ANALYSIS_PROMPT.index("Оціни від 1 до 10"):ANALYSIS_PROMPT.index("Відповідь має бути")]
+    .replace('якщо поточна "{name}" є невідповідною', "якщо його поточна назва є невідповідною")
+    + "Відповідь має бути СУВОРО JSON-об'єктом {{\"results\": [...]}} з одним елементом на кожен workflow. "
+      "Кожен елемент містить \"id\" — номер workflow зі списку — та решту полів у форматі:\n"
+    + ANALYSIS_PROMPT[ANALYSIS_PROMPT.index("{{\n"):]
+)
+
+PACKED_ITEM = """Workflow {n}:
+- Назва: {name}
+- Опис: {description}
+- Ноди ({node_count}): {nodes}
+- Категорії: {categories}
+- Тип тригера: {trigger_type}"""
+
+_SCORES = ("usefulness", "universality", "complexity", "scalability")
+
+
+def _prompt_fields(wf: dict) -> dict:
     nodes_str = ", ".join(wf.get("nodes", [])[:30])  # Limit to 30 nodes
     cats_str = ", ".join(wf.get("categories", []))
-    return ANALYSIS_PROMPT.format(
+    return dict(
         name=wf.get("name", "Без назви"),
         description=(wf.get("description", "") or "")[:500],
         node_count=wf.get("node_count", 0),
@@ -95,77 +141,24 @@ def _build_prompt(wf: dict) -> str:
     )
 
 
-async def analyze_workflow(wf: dict) -> dict:
-    """Analyze a single workflow using OpenAI API.
-    Returns dict with scores, summary and tags, or None on error.
-    """
-    if not OPENAI_API_KEY:
-        logger.error("OPENAI_API_KEY not set")
-        return None
-    
-    if not client:
-        logger.error("OpenAI client not initialized")
-        return None
+def _build_prompt(wf: dict) -> str:
+    """Build analysis prompt from workflow data."""
+    return ANALYSIS_PROMPT.format(**_prompt_fields(wf))
 
-    try:
-        prompt = _build_prompt(wf)
-        
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that outputs JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.3
-        )
-        
-        raw = response.choices[0].message.content.strip()
-        result = json.loads(raw)
-
-        # Ensure all required keys exist with defaults
-        for key in ["usefulness", "universality", "complexity", "scalability"]:
-            if key not in result:
-                result[key] = 5
-
-        result.setdefault("uk", {})
-        result.setdefault("en", {})
-        result.setdefault("tags", [])
-        result.setdefault("difficulty_level", "intermediate")
-        result.setdefault("suggested_name", wf.get("name", ""))
-
-        # Ensure nested structures exist
-        for lang in ("uk", "en"):
-            result[lang].setdefault("summary", "")
-            result[lang].setdefault("use_cases", [])
-            result[lang].setdefault("target_audience", "")
-            result[lang].setdefault("integrations_summary", "")
-
-        if isinstance(result["tags"], str):
-            result["tags"] = [t.strip() for t in result["tags"].split(",")]
-
-        return result
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON from OpenAI for workflow {wf.get('id')}: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"OpenAI analysis error for workflow {wf.get('id')}: {e}")
-        return None
+def _build_packed_prompt(wfs: list) -> str:
+    """One prompt for several workflows, numbered from 1 in list order."""
+    items = "\n\n".join(PACKED_ITEM.format(n=n, **_prompt_fields(wf)) for n, wf in enumerate(wfs, 1))
+    return PACKED_PROMPT.format(count=len(wfs), workflows=items)
 
 
-async def analyze_and_save(wf_id: int) -> dict:
-    """Analyze a single workflow by ID and save results to DB."""
-    wf = get_workflow(wf_id)
-    if not wf:
-        return {"error": "Workflow not found"}
+# Part of every cache key, so editing the prompt doesn't serve answers to the old one
+_PROMPT_HASH = hashlib.sha256(ANALYSIS_PROMPT.encode()).hexdigest()[:16]
 
-    if not OPENAI_API_KEY:
-        return {"error": "OPENAI_API_KEY not configured"}
 
-    # Parse nodes/categories from JSON strings
-    wf_data = {
+def workflow_data(wf: dict) -> dict:
+    """Prompt input from a workflows row (nodes/categories may still be JSON strings)."""
+    return {
         "id": wf["id"],
         "name": wf["name"],
         "description": wf["description"],
@@ -175,12 +168,166 @@ async def analyze_and_save(wf_id: int) -> dict:
         "trigger_type": wf["trigger_type"],
     }
 
-    result = await analyze_workflow(wf_data)
-    if not result:
-        return {"error": "AI analysis failed"}
 
-    update_workflow_ai(
-        wf_id,
+def analysis_key(wf: dict) -> str:
+    """Analysis cache key: a hash of the prompt inputs (from workflow_data) that make an
+    analysis — normalized node set, categories, trigger type, description — plus the
+    prompt and model. The name is left out: copies of a template differ mostly in name.
+    """
+    description = " ".join((wf.get("description") or "").split())[:500]
+    payload = [
+        llm.OPENAI_MODEL, _PROMPT_HASH,
+        sorted({n.strip().lower() for n in wf.get("nodes") or []}),
+        sorted(wf.get("categories") or []),
+        wf.get("trigger_type") or "",
+        description,
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+
+def _estimate_tokens(prompt: str) -> int:
+    # ~3 characters per token for the mixed Ukrainian/English prompt, plus the answer
+    return len(prompt) // 3 + ANALYSIS_OUTPUT_TOKENS
+
+
+def analysis_messages(wf: dict) -> list:
+    """Chat messages asking the model to analyze a workflow (prompt input from workflow_data)."""
+    return [
+        {"role": "system", "content": "You are a helpful assistant that outputs JSON."},
+        {"role": "user", "content": _build_prompt(wf)}
+    ]
+
+
+def packed_messages(wfs: list) -> list:
+    """Chat messages asking the model to analyze several workflows in one answer."""
+    return [
+        {"role": "system", "content": "You are a helpful assistant that outputs JSON."},
+        {"role": "user", "content": _build_packed_prompt(wfs)}
+    ]
+
+
+async def _complete(messages: list):
+    """One chat completion. Returns (content, total tokens used or None, response headers)."""
+    # wait=True: while the provider is down, hold the work instead of burning queue attempts
+    return await llm.complete("analysis", messages, temperature=ANALYSIS_TEMPERATURE, wait=True)
+
+
+async def _request(messages: list, estimate: int) -> str:
+    """One completion of about `estimate` tokens within the rate limits. Raises on API errors."""
+    for attempt in range(ANALYSIS_RATE_LIMIT_RETRIES + 1):
+        await limiter.acquire(estimate)
+        try:
+            content, used, headers = await _complete(messages)
+            break
+        except RateLimitError as e:
+            limiter.on_rate_limited(e.response.headers)
+            if attempt == ANALYSIS_RATE_LIMIT_RETRIES:
+                raise
+    limiter.settle(estimate, used)
+    limiter.on_success(headers)
+    return content
+
+
+async def _call_model(wf: dict) -> dict:
+    """Ask the model about one workflow, within the rate limits. Raises on API errors and invalid JSON."""
+    messages = analysis_messages(wf)
+    content = await _request(messages, _estimate_tokens(messages[-1]["content"]))
+    return parse_result(content, wf)
+
+
+async def _call_model_packed(wfs: list) -> list:
+    """Ask the model about several workflows in one request.
+
+    Returns one entry per workflow, in order: its result, or the ValueError explaining why
+    that item was unusable (missing, not an object, no scores or summary). Raises on API
+    errors and when the answer as a whole is not the expected JSON.
+    """
+    messages = packed_messages(wfs)
+    estimate = len(messages[-1]["content"]) // 3 + ANALYSIS_OUTPUT_TOKENS * len(wfs)
+    payload = json.loads((await _request(messages, estimate)).strip())
+    items = payload.get("results") if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise ValueError("Expected a \"results\" list")
+
+    by_number = {}
+    for position, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            continue
+        try:
+            number = int(item.pop("id", position))
+        except (TypeError, ValueError):
+            continue
+        by_number.setdefault(number, item)
+
+    results = []
+    for n, wf in enumerate(wfs, 1):
+        item = by_number.get(n)
+        if item is None:
+            results.append(ValueError(f"No result for workflow {n} of {len(wfs)}"))
+            continue
+        missing = [k for k in _SCORES if not isinstance(item.get(k), (int, float))]
+        if missing or not isinstance(item.get("uk"), dict) or not item["uk"].get("summary"):
+            results.append(ValueError(f"Incomplete result for workflow {n}: {', '.join(missing) or 'uk.summary'}"))
+            continue
+        results.append(normalize_result(item, wf))
+    return results
+
+
+def parse_result(content: str, wf: dict) -> dict:
+    """The model's JSON answer with every expected key filled in. Raises ValueError on invalid JSON."""
+    return normalize_result(json.loads(content.strip()), wf)
+
+
+def normalize_result(result, wf: dict) -> dict:
+    """A decoded answer with every expected key filled in. Raises ValueError if it isn't an object."""
+    if not isinstance(result, dict):
+        raise ValueError(f"Expected a JSON object, got {type(result).__name__}")
+
+    # Ensure all required keys exist with defaults
+    for key in _SCORES:
+        if key not in result:
+            result[key] = 5
+
+    result.setdefault("uk", {})
+    result.setdefault("en", {})
+    result.setdefault("tags", [])
+    result.setdefault("difficulty_level", "intermediate")
+    result.setdefault("suggested_name", wf.get("name", ""))
+
+    # Ensure nested structures exist
+    for lang in ("uk", "en"):
+        result[lang].setdefault("summary", "")
+        result[lang].setdefault("use_cases", [])
+        result[lang].setdefault("target_audience", "")
+        result[lang].setdefault("integrations_summary", "")
+
+    if isinstance(result["tags"], str):
+        result["tags"] = [t.strip() for t in result["tags"].split(",")]
+
+    return result
+
+
+async def analyze_workflow(wf: dict) -> dict:
+    """Analyze a single workflow using OpenAI API.
+    Returns dict with scores, summary and tags, or None on error.
+    """
+    if not llm.available():
+        logger.error("OPENAI_API_KEY not set")
+        return None
+
+    try:
+        return await _call_model(wf)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON from OpenAI for workflow {wf.get('id')}: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"OpenAI analysis error for workflow {wf.get('id')}: {e}")
+        return None
+
+
+def ai_fields(result: dict) -> dict:
+    """update_workflow_ai() keyword arguments for a model result."""
+    return dict(
         usefulness=result.get("usefulness", 5),
         universality=result.get("universality", 5),
         complexity=result.get("complexity", 5),
@@ -194,6 +341,22 @@ async def analyze_and_save(wf_id: int) -> dict:
         result_en=result.get("en", {})
     )
 
+
+async def analyze_and_save(wf_id: int) -> dict:
+    """Analyze a single workflow by ID and save results to DB."""
+    wf = await db.get_workflow(wf_id)
+    if not wf:
+        return {"error": "Workflow not found"}
+
+    if not llm.available():
+        return {"error": "OPENAI_API_KEY not configured"}
+
+    result = await analyze_workflow(workflow_data(wf))
+    if not result:
+        return {"error": "AI analysis failed"}
+
+    await db.update_workflow_ai(wf_id, **ai_fields(result))
+
     # Update name if suggested and current name is generic
     suggested_name = result.get("suggested_name")
     current_name = wf.get("name", "")
@@ -203,10 +366,7 @@ async def analyze_and_save(wf_id: int) -> dict:
         is_generic = current_name in generic_names or not current_name
         if is_generic:
             try:
-                from database import get_db
-                conn = get_db()
-                conn.execute("UPDATE workflows SET name = ? WHERE id = ?", (suggested_name, wf_id))
-                conn.commit()
+                await db.rename_workflow(wf_id, suggested_name)
                 logger.info(f"Renamed workflow {wf_id}: '{current_name}' -> '{suggested_name}'")
             except Exception as e:
                 logger.error(f"Failed to rename workflow {wf_id}: {e}")
@@ -218,104 +378,187 @@ async def analyze_and_save(wf_id: int) -> dict:
     }
 
 
-async def analyze_batch(limit: int = 50) -> dict:
-    """Analyze a batch of unanalyzed workflows.
-    Returns summary of results including error details.
+# ==================== Analysis queue worker ====================
+
+async def request_analysis(workflow_ids=None) -> int:
+    """Queue unanalyzed workflows (all, or the given ids) and wake this process's worker.
+    Returns the number of workflows newly queued.
     """
-    global analysis_status
-    if not OPENAI_API_KEY:
-        return {"error": "OPENAI_API_KEY not configured"}
+    queued = await db.enqueue_analysis(workflow_ids)
+    if queued:
+        logger.info(f"Queued {queued} workflows for analysis")
+        _wakeup.set()
+    return queued
 
-    async with analysis_lock:
-        workflows = get_unanalyzed_workflows(limit)
-        if not workflows:
-            analysis_status["status"] = "idle"
-            return {"status": "ok", "message": "All workflows already analyzed", "analyzed": 0}
-
-        from datetime import datetime
-        analysis_status.update({
-            "status": "running",
-            "total": len(workflows),
-            "analyzed": 0,
-            "errors": 0,
-            "start_time": datetime.utcnow().isoformat()
-        })
-
-        analyzed = 0
-        errors = 0
-        error_details = []
 
-        try:
-            for wf in workflows:
-                # Parse nodes/categories
-                wf_data = {
-                    "id": wf["id"],
-                    "name": wf["name"],
-                    "description": wf["description"],
-                    "nodes": json.loads(wf["nodes"]) if isinstance(wf["nodes"], str) else wf["nodes"],
-                    "categories": json.loads(wf["categories"]) if isinstance(wf["categories"], str) else wf["categories"],
-                    "node_count": wf["node_count"],
-                    "trigger_type": wf["trigger_type"],
-                }
-
-                result = await analyze_workflow(wf_data)
-                if result:
-                    update_workflow_ai(
-                        wf["id"],
-                        usefulness=result.get("usefulness", 5),
-                        universality=result.get("universality", 5),
-                        complexity=result.get("complexity", 5),
-                        scalability=result.get("scalability", 5),
-                        summary=result.get("uk", {}).get("summary", ""),
-                        tags=result.get("tags", []),
-                        use_cases=result.get("uk", {}).get("use_cases", []),
-                        target_audience=result.get("uk", {}).get("target_audience", ""),
-                        integrations_summary=result.get("uk", {}).get("integrations_summary", ""),
-                        difficulty_level=result.get("difficulty_level", "intermediate"),
-                        result_en=result.get("en", {})
-                    )
-                    analyzed += 1
-                    analysis_status["analyzed"] = analyzed
-                    logger.info(f"Analyzed {analyzed}/{len(workflows)}: {wf['name'][:50]} → usefulness={result['usefulness']}")
-                else:
-                    # Retry once after a longer pause (likely rate limit)
-                    logger.warning(f"First attempt failed for {wf['id']}: {wf['name'][:50]}, retrying in 10s...")
-                    await asyncio.sleep(10.0)
-                    result = await analyze_workflow(wf_data)
-                    if result:
-                        update_workflow_ai(
-                            wf["id"],
-                            usefulness=result.get("usefulness", 5),
-                            universality=result.get("universality", 5),
-                            complexity=result.get("complexity", 5),
-                            scalability=result.get("scalability", 5),
-                            summary=result.get("uk", {}).get("summary", ""),
-                            tags=result.get("tags", []),
-                            use_cases=result.get("uk", {}).get("use_cases", []),
-                            target_audience=result.get("uk", {}).get("target_audience", ""),
-                            integrations_summary=result.get("uk", {}).get("integrations_summary", ""),
-                            difficulty_level=result.get("difficulty_level", "intermediate"),
-                            result_en=result.get("en", {})
-                        )
-                        analyzed += 1
-                        analysis_status["analyzed"] = analyzed
-                        logger.info(f"Retry OK {analyzed}/{len(workflows)}: {wf['name'][:50]} → usefulness={result['usefulness']}")
-                    else:
-                        errors += 1
-                        analysis_status["errors"] = errors
-                        error_details.append({"id": wf["id"], "name": wf["name"][:60]})
-                        logger.warning(f"Failed to analyze workflow {wf['id']}: {wf['name'][:50]}")
-
-                # Rate limiting: OpenAI gpt-4o-mini usually has higher limits.
-                # Still a small pause is good for stability.
-                await asyncio.sleep(0.5)
-        finally:
-            analysis_status["status"] = "idle"
-
-        return {
-            "status": "ok",
-            "analyzed": analyzed,
-            "errors": errors,
-            "remaining": len(get_unanalyzed_workflows(1)),
-            "error_details": error_details,
-        }
+def next_retry(attempts: int):
+    """When to retry after the given number of failed attempts (None: give up)."""
+    if attempts >= ANALYSIS_MAX_ATTEMPTS:
+        return None
+    delay = min(ANALYSIS_RETRY_MAX, ANALYSIS_RETRY_BASE * 2 ** (attempts - 1))
+    return datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+async def serve_from_cache(workflows: list, owner: str) -> list:
+    """Save cached analyses for the claimed workflows that have one (closing their entries).
+    Returns the rest, each with its "cache_key".
+    """
+    for wf in workflows:
+        wf["cache_key"] = analysis_key(workflow_data(wf))
+    cached = await db.get_cached_analyses([wf["cache_key"] for wf in workflows])
+    hits = [wf for wf in workflows if wf["cache_key"] in cached]
+    if hits:
+        await db.update_workflows_ai_batch([(wf["id"], cached[wf["cache_key"]]) for wf in hits], owner=owner,
+                                           cache={wf["id"]: wf["cache_key"] for wf in hits}, from_cache=True)
+        logger.info(f"Served {len(hits)} analyses from cache")
+    return [wf for wf in workflows if wf["cache_key"] not in cached]
+
+
+async def _process(wf: dict, results: list):
+    """Analyze one claimed workflow; successes wait in `results` for the next batched save."""
+    try:
+        result = await _call_model(workflow_data(wf))
+    except Exception as e:
+        retry_at = next_retry(wf["attempts"])
+        await db.fail_analysis(wf["id"], WORKER_ID, f"{type(e).__name__}: {e}", retry_at)
+        if retry_at:
+            logger.warning(f"Analysis of {wf['id']} failed (attempt {wf['attempts']}), retry at {retry_at:%H:%M:%S}: {e}")
+        else:
+            logger.error(f"Analysis of {wf['id']} failed {wf['attempts']} times, moved to dead letters: {e}")
+        return
+    results.append((wf["id"], ai_fields(result), wf["cache_key"]))
+    logger.info(f"Analyzed {wf['id']}: {wf['name'][:50]} → usefulness={result['usefulness']}")
+
+
+async def _process_pack(wfs: list, results: list):
+    """Analyze several claimed workflows in one request; items it didn't answer properly
+    (or all of them, if the request failed) are retried one request each."""
+    try:
+        outcomes = await _call_model_packed([workflow_data(wf) for wf in wfs])
+    except Exception as e:
+        logger.warning(f"Packed analysis of {len(wfs)} workflows failed, retrying one by one: {e}")
+        outcomes = [e] * len(wfs)
+    retry = [wf for wf, outcome in zip(wfs, outcomes) if isinstance(outcome, Exception)]
+    for wf, outcome in zip(wfs, outcomes):
+        if not isinstance(outcome, Exception):
+            results.append((wf["id"], ai_fields(outcome), wf["cache_key"]))
+    if retry and len(retry) < len(wfs):
+        errors = "; ".join(str(o) for o in outcomes if isinstance(o, Exception))
+        logger.info(f"Retrying {len(retry)} of {len(wfs)} packed workflows one by one: {errors}")
+    await asyncio.gather(*(_process(wf, results) for wf in retry))
+
+
+async def _flush(results: list) -> int:
+    """Save finished analyses and close their queue entries in one transaction."""
+    batch = list(results)
+    if not batch:
+        return 0
+    completed = await db.update_workflows_ai_batch([(wf_id, fields) for wf_id, fields, _ in batch], owner=WORKER_ID,
+                                                   cache={wf_id: key for wf_id, _, key in batch})
+    # Tasks may have appended more while the write ran; only drop what was saved
+    del results[:len(batch)]
+    if completed < len(batch):
+        logger.warning(f"{len(batch) - completed} analysis leases expired before their results were saved")
+    return len(batch)
+
+
+async def _wait_for_work():
+    """Sleep until the next entry is due, new work is queued, or the idle poll interval passes."""
+    timeout = ANALYSIS_IDLE_POLL
+    due = await db.next_analysis_due()
+    if due:
+        wait = (datetime.fromisoformat(due) - datetime.utcnow()).total_seconds()
+        timeout = min(timeout, max(wait, 0.1))
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_worker():
+    """Work through analysis_queue until cancelled, ANALYSIS_CONCURRENCY requests at a time
+    of ANALYSIS_PACK_SIZE workflows each.
+
+    Entries are claimed ahead in chunks (up to twice what is in flight held at once) so the
+    claim write doesn't happen per workflow; finished analyses are saved in batches. Leases of
+    held entries are renewed every ANALYSIS_LEASE_RENEW seconds so slow ones stay ours.
+    On shutdown in-flight calls are cancelled, finished ones saved and every lease handed back.
+    """
+    if not llm.available():
+        logger.warning("OPENAI_API_KEY not set, analysis worker not started")
+        return
+    # Catch up with workflows imported while no worker was running
+    await request_analysis()
+    logger.info(f"Analysis worker {WORKER_ID} started: concurrency {ANALYSIS_CONCURRENCY}, "
+                f"{ANALYSIS_PACK_SIZE} per request, {limiter.stats()}")
+    in_flight, ready, results = set(), [], []
+    packs = {}  # in-flight task -> the workflows it holds
+    since_copy = 0
+    drained = False  # the last claim came back short: don't claim again until idle or woken
+    loop_time = asyncio.get_running_loop().time
+    last_flush = last_renew = loop_time()
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                held = len(ready) + len(in_flight) * ANALYSIS_PACK_SIZE
+                if held <= ANALYSIS_CONCURRENCY * ANALYSIS_PACK_SIZE and not drained:
+                    want = 2 * ANALYSIS_CONCURRENCY * ANALYSIS_PACK_SIZE - held
+                    claimed = await db.claim_analysis(WORKER_ID, limit=want, lease_seconds=ANALYSIS_LEASE_SECONDS,
+                                                      max_attempts=ANALYSIS_MAX_ATTEMPTS)
+                    drained = len(claimed) < want
+                    misses = await serve_from_cache(claimed, WORKER_ID)
+                    since_copy += len(claimed) - len(misses)
+                    ready += misses
+                if (ready or in_flight) and loop_time() - last_renew >= ANALYSIS_LEASE_RENEW:
+                    await db.renew_analysis_leases(WORKER_ID, lease_seconds=ANALYSIS_LEASE_SECONDS)
+                    last_renew = loop_time()
+                while ready and len(in_flight) < ANALYSIS_CONCURRENCY:
+                    pack, ready = ready[:ANALYSIS_PACK_SIZE], ready[ANALYSIS_PACK_SIZE:]
+                    task = _process(pack[0], results) if len(pack) == 1 else _process_pack(pack, results)
+                    task = asyncio.create_task(task)
+                    in_flight.add(task)
+                    packs[task] = pack
+
+                if results and (len(results) >= ANALYSIS_FLUSH_SIZE or not in_flight
+                                or loop_time() - last_flush >= ANALYSIS_FLUSH_INTERVAL):
+                    since_copy += await _flush(results)
+                    last_flush = loop_time()
+                if since_copy >= ANALYSIS_COPY_EVERY or (since_copy and not in_flight):
+                    # Near-duplicates of what was just analyzed take its result instead of an API call
+                    copied = await db.copy_cluster_analysis()
+                    if copied:
+                        logger.info(f"Copied analysis to {copied} near-duplicate workflows")
+                    since_copy = 0
+
+                if not in_flight:
+                    if not drained:
+                        continue
+                    await _wait_for_work()
+                    drained = False
+                    continue
+                done, in_flight = await asyncio.wait(in_flight, timeout=ANALYSIS_FLUSH_INTERVAL,
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                drained = drained and not _wakeup.is_set()
+                for task in done:
+                    pack, e = packs.pop(task), task.exception()
+                    if e:
+                        # Hand the entries back with the usual backoff: claim_analysis() won't
+                        # give this worker its own leases again
+                        logger.error(f"Analysis task failed: {e!r}")
+                        finished = {wf_id for wf_id, _, _ in results}
+                        await db.fail_analyses([(wf["id"], f"{type(e).__name__}: {e}", next_retry(wf["attempts"]))
+                                                for wf in pack if wf["id"] not in finished], WORKER_ID)
+            except Exception:
+                logger.exception("Analysis worker error")
+                await asyncio.sleep(ANALYSIS_IDLE_POLL)
+    except asyncio.CancelledError:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        while results:
+            await _flush(results)
+        released = await db.release_analysis(WORKER_ID)
+        if released:
+            logger.info(f"Released {released} analysis leases on shutdown")
+        raise
@@ -15,15 +15,15 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from authlib.integrations.starlette_client import OAuth
-from database import init_db, search_workflows, get_workflow, delete_workflow, \
-    get_all_nodes, get_all_categories, get_stats, get_github_repos, delete_github_repo, clear_all_workflows, \
-    upsert_user, get_user_usage, increment_user_usage, get_user_by_email, \
-    update_subscription, add_payment_record, get_payment_history, get_user_by_payment_customer, \
-    get_all_workflows_full
-from importer import import_from_json, import_from_url, import_from_directory, \
-    sync_github_repo, sync_all_repos
-from analyzer import analyze_and_save, analyze_batch, analysis_status, analysis_lock
+import async_db as db
+from importer import import_from_json, import_from_url, import_from_directory, import_uploads, \
+    sync_github_repo, sync_all_repos, start_http, close_http
+import analyzer
+import batch_analysis
+import llm_gateway
+from analyzer import analyze_and_save, request_analysis, run_worker
 from ai_search import perform_ai_search
+import jobs
 import hashlib
 import hmac
 import time
@@ -85,13 +85,24 @@ async def periodic_sync():
             logger.error(f"Sync failed: {e}")
 
 
+async def warm_vector_index():
+    """Load or fit the semantic search index in the background so the first query doesn't wait."""
+    try:
+        logger.info(f"Vector index ready: {await db.warm_vector_index()}")
+    except Exception as e:
+        logger.error(f"Vector index warm-up failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    init_db()
+    await db.init_db()
+    await start_http()
+    await llm_gateway.start()
+    await jobs.resume_jobs()
     logger.info("Database initialized")
 
-    stats = get_stats()
+    stats = await db.get_stats()
     if stats["total_workflows"] == 0:
         # Import from local directory first (fast, no network)
         if LOCAL_WORKFLOWS_DIR and os.path.isdir(LOCAL_WORKFLOWS_DIR):
@@ -116,10 +127,22 @@ async def lifespan(app: FastAPI):
 
     # Start background sync
     sync_task = asyncio.create_task(periodic_sync())
+    warm_task = asyncio.create_task(warm_vector_index())
+    analysis_task = asyncio.create_task(run_worker())
+    batch_task = asyncio.create_task(batch_analysis.run_poller())
 
     yield
 
     sync_task.cancel()
+    warm_task.cancel()
+    # The worker hands its leases back to the queue before the DB closes
+    analysis_task.cancel()
+    batch_task.cancel()
+    await asyncio.gather(analysis_task, batch_task, return_exceptions=True)
+    await llm_gateway.close()
+    await jobs.shutdown()
+    await close_http()
+    await db.shutdown()
 
 
 app = FastAPI(title="n8n Hub", lifespan=lifespan)
@@ -159,9 +182,9 @@ async def health():
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    stats = get_stats()
-    nodes = get_all_nodes()
-    categories = get_all_categories()
+    stats = await db.get_stats()
+    nodes = await db.get_all_nodes()
+    categories = await db.get_all_categories()
     return templates.TemplateResponse("index.html", {
         "request": request,
         "stats": stats,
@@ -199,7 +222,7 @@ async def google_auth_callback(request: Request):
         user = token.get('userinfo')
         if user:
             # Upsert user in DB
-            user_id = upsert_user(
+            user_id = await db.upsert_user(
                 email=user['email'],
                 name=user.get('name', user['email'].split('@')[0]),
                 picture=user.get('picture', '')
@@ -226,7 +249,7 @@ async def api_auth_me(request: Request):
     if email:
         try:
             # We always try to upsert to ensure user exists in the current DB file
-            user_id = upsert_user(
+            user_id = await db.upsert_user(
                 email=email,
                 name=user.get('name', email.split('@')[0]),
                 picture=user.get('picture', '')
@@ -240,7 +263,7 @@ async def api_auth_me(request: Request):
             logger.error(f"Failed to sync user session for {email}: {e}")
 
     user_id = user.get("id")
-    usage = get_user_usage(user_id) if user_id else {"ai_chat_count": 0, "sub_status": "inactive"}
+    usage = await db.get_user_usage(user_id) if user_id else {"ai_chat_count": 0, "sub_status": "inactive"}
     
     return JSONResponse({
         "authenticated": True,
@@ -341,13 +364,13 @@ async def wfp_callback(request: Request):
             user_id = None
 
         if status == "Approved" and user_id:
-            update_subscription(
+            await db.update_subscription(
                 user_id=user_id,
                 payment_customer_id=data.get("clientEmail"),
                 payment_sub_id=data.get("orderReference"),
                 status='active'
             )
-            add_payment_record(
+            await db.add_payment_record(
                 user_id=user_id,
                 payment_order_id=order_ref,
                 amount=float(data.get("amount", 0)),
@@ -378,29 +401,46 @@ async def api_payment_history(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Необхідна авторизація")
     
-    history = get_payment_history(user["id"])
+    history = await db.get_payment_history(user["id"])
     return JSONResponse(history)
 
 
 @app.get("/api/search")
 async def api_search(q: str = "", category: str = "", node: str = "", page: int = 1,
-                     sort: str = "recent", min_score: int = 0, lang: str = "uk"):
-    results = search_workflows(query=q, category=category, node=node, page=page,
-                               sort=sort, min_score=min_score)
+                     sort: str = "", min_score: int = 0, lang: str = "uk",
+                     cursor: str = "", count: str = "", facets: bool = False, collapse: bool = False):
+    if count and count not in ("exact", "capped", "none"):
+        raise HTTPException(status_code=400, detail="count must be exact, capped or none")
+    try:
+        results = await db.search_workflows(query=q, category=category, node=node, page=page,
+                                            sort=sort, min_score=min_score,
+                                            cursor=cursor or None, count=count or None,
+                                            facets=facets, collapse=collapse)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return JSONResponse(results)
 
 
 @app.get("/api/workflow/{wf_id}")
 async def api_get_workflow(wf_id: int):
-    wf = get_workflow(wf_id)
+    wf = await db.get_workflow(wf_id)
     if not wf:
         raise HTTPException(status_code=404, detail="Воркфлоу не знайдено")
     return JSONResponse(wf)
 
 
+@app.get("/api/workflow/{wf_id}/similar")
+async def api_similar_workflows(wf_id: int, limit: int = 10):
+    """Workflows with the most in common (node types and AI tags), from the in-memory similarity index."""
+    similar = await db.get_similar_workflows(wf_id, limit=max(1, min(limit, 50)))
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Воркфлоу не знайдено")
+    return JSONResponse({"workflow_id": wf_id, "similar": similar})
+
+
 @app.get("/api/workflow/{wf_id}/json")
 async def api_get_workflow_json(wf_id: int):
-    wf = get_workflow(wf_id)
+    wf = await db.get_workflow(wf_id)
     if not wf:
         raise HTTPException(status_code=404, detail="Воркфлоу не знайдено")
     
@@ -418,25 +458,19 @@ async def api_get_workflow_json(wf_id: int):
 @app.delete("/api/workflow/{wf_id}")
 async def api_delete_workflow(request: Request, wf_id: int):
     require_auth(request, admin_only=True)
-    delete_workflow(wf_id)
+    await db.delete_workflow(wf_id)
     return JSONResponse({"status": "ok"})
 
 
 @app.post("/api/import/url")
-async def api_import_url(request: Request, background_tasks: BackgroundTasks, url: str = Form(...)):
+async def api_import_url(request: Request, url: str = Form(...)):
+    """Queue a URL import; poll /api/import/jobs/{job_id} for progress and the result."""
     require_auth(request, admin_only=True)
-    try:
-        # Import is now fast (no blocking AI)
-        result = await import_from_url(url, analyze=False)
-        if result.get("status") == "ok":
-            # Schedule AI analysis in background
-            background_tasks.add_task(analyze_batch, limit=50)
-        return JSONResponse(result)
-    except ValueError as e:
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
-    except Exception as e:
-        logger.error(f"URL import error: {e}")
-        return JSONResponse({"status": "error", "message": "Внутрішня помилка сервера"}, status_code=500)
+    url = url.strip()
+    if not url:
+        return JSONResponse({"status": "error", "message": "Порожній URL"}, status_code=400)
+    job_id = await jobs.submit("url", {"url": url})
+    return JSONResponse({"status": "queued", "job_id": job_id})
 
 
 @app.post("/api/import/json")
@@ -445,7 +479,7 @@ async def api_import_json(request: Request, background_tasks: BackgroundTasks, j
     try:
         result = await import_from_json(json_text, analyze=False)
         if result.get("status") == "ok":
-            background_tasks.add_task(analyze_batch, limit=50)
+            background_tasks.add_task(request_analysis)
         return JSONResponse(result)
     except ValueError as e:
         return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
@@ -456,57 +490,63 @@ async def api_import_json(request: Request, background_tasks: BackgroundTasks, j
 
 @app.post("/api/import/file")
 async def api_import_file(request: Request, background_tasks: BackgroundTasks, files: list[UploadFile] = File(...)):
+    """Bulk upload: any number of .json files and/or .zip archives in one request."""
     require_auth(request, admin_only=True)
-    results = []
-    for file in files:
-        try:
-            content = await file.read()
-            # use utf-8-sig to handle optional BOM
-            res = await import_from_json(content.decode("utf-8-sig"), source_url=f"upload:{file.filename}", analyze=False)
-            results.append({"name": file.filename, "status": res["status"]})
-        except Exception as e:
-            logger.error(f"Error importing file {file.filename}: {e}")
-            results.append({"name": file.filename, "status": "error", "message": str(e)})
-    
+    try:
+        results = await import_uploads([(f.filename, f.file) for f in files])
+    except Exception as e:
+        logger.error(f"Upload import error: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
     # Schedule background analysis if anything was imported
     if any(r["status"] == "ok" for r in results):
-        background_tasks.add_task(analyze_batch, limit=50)
+        background_tasks.add_task(request_analysis)
         
     return JSONResponse({"status": "ok", "results": results})
 
 
 @app.post("/api/import/local")
-async def api_import_local(request: Request, background_tasks: BackgroundTasks, directory: str = Form(...)):
+async def api_import_local(request: Request, directory: str = Form(...)):
+    """Queue a local directory import; poll /api/import/jobs/{job_id} for progress and the result."""
     require_auth(request, admin_only=True)
-    try:
-        result = await import_from_directory(directory, analyze=False)
-        if result.get("status") == "ok" and result.get("imported", 0) > 0:
-            background_tasks.add_task(analyze_batch, limit=50)
-        return JSONResponse(result)
-    except ValueError as e:
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
-    except Exception as e:
-        logger.error(f"Local import error: {e}")
-        return JSONResponse({"status": "error", "message": "Внутрішня помилка сервера"}, status_code=500)
+    if not os.path.isdir(directory):
+        return JSONResponse({"status": "error", "message": f"Папку не знайдено: {directory}"}, status_code=400)
+    job_id = await jobs.submit("local", {"directory": directory})
+    return JSONResponse({"status": "queued", "job_id": job_id})
+
+
+@app.get("/api/import/jobs")
+async def api_import_jobs(request: Request, limit: int = 20):
+    require_auth(request, admin_only=True)
+    return JSONResponse(await db.get_import_jobs(limit=min(max(limit, 1), 100)))
+
+
+@app.get("/api/import/jobs/{job_id}")
+async def api_import_job(request: Request, job_id: int):
+    require_auth(request, admin_only=True)
+    job = await db.get_import_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(job)
 
 
 @app.get("/api/repos")
 async def api_get_repos(request: Request):
     require_auth(request, admin_only=True)
-    repos = get_github_repos()
+    repos = await db.get_github_repos()
     return JSONResponse(repos)
 
 
 @app.post("/api/repos/sync/{repo_id}")
 async def api_sync_repo(request: Request, background_tasks: BackgroundTasks, repo_id: int):
     require_auth(request, admin_only=True)
-    repos = get_github_repos()
+    repos = await db.get_github_repos()
     repo = next((r for r in repos if r["id"] == repo_id), None)
     if not repo:
         raise HTTPException(status_code=404)
     result = await sync_github_repo(repo["repo_url"])
-    if result.get("status") == "ok" and result.get("imported", 0) > 0:
-        background_tasks.add_task(analyze_batch, limit=50)
+    if result.get("status") == "ok" and (result.get("imported", 0) or result.get("reanalyze", 0)):
+        background_tasks.add_task(request_analysis)
     return JSONResponse(result)
 
 
@@ -515,28 +555,28 @@ async def api_sync_all(request: Request, background_tasks: BackgroundTasks):
     require_auth(request, admin_only=True)
     results = await sync_all_repos()
     # If any repo had new workflows, analyze them
-    if any(r.get("imported", 0) > 0 for r in results if isinstance(r, dict)):
-        background_tasks.add_task(analyze_batch, limit=50)
+    if any(r.get("imported", 0) or r.get("reanalyze", 0) for r in results if isinstance(r, dict)):
+        background_tasks.add_task(request_analysis)
     return JSONResponse(results)
 
 
 @app.delete("/api/repos/{repo_id}")
 async def api_delete_repo(request: Request, repo_id: int):
     require_auth(request, admin_only=True)
-    delete_github_repo(repo_id)
+    await db.delete_github_repo(repo_id)
     return JSONResponse({"status": "ok"})
 
 
 @app.get("/api/filters")
 async def api_get_filters():
-    nodes = get_all_nodes()
-    categories = get_all_categories()
+    nodes = await db.get_all_nodes()
+    categories = await db.get_all_categories()
     return JSONResponse({"nodes": nodes, "categories": categories})
 
 
 @app.get("/api/stats")
 async def api_get_stats():
-    return JSONResponse(get_stats())
+    return JSONResponse(await db.get_stats())
 
 
 # ==================== AI Analysis Routes ====================
@@ -551,19 +591,20 @@ async def api_analyze_workflow(request: Request, wf_id: int):
 
 
 @app.post("/api/analyze/batch")
-async def api_analyze_batch(request: Request, limit: int = 50):
+async def api_analyze_batch(request: Request):
+    """Queue every unanalyzed workflow; the analysis worker picks them up in the background."""
     require_auth(request, admin_only=True)
-    result = await analyze_batch(limit=limit)
-    if "error" in result:
-        return JSONResponse(result, status_code=400)
-    return JSONResponse(result)
+    if not llm_gateway.available():
+        return JSONResponse({"error": "OPENAI_API_KEY not configured"}, status_code=400)
+    queued = await request_analysis()
+    return JSONResponse({"status": "ok", "queued": queued, **await db.get_analysis_queue_status()})
 
 
 @app.post("/api/admin/clear-all")
 async def api_admin_clear_all(request: Request):
     require_auth(request, admin_only=True)
     try:
-        clear_all_workflows()
+        await db.clear_all_workflows()
         return JSONResponse({"status": "ok", "message": "Усі воркфлоу видалено"})
     except Exception as e:
         logger.error(f"Clear all error: {e}")
@@ -574,7 +615,7 @@ async def api_admin_clear_all(request: Request):
 async def api_admin_export(request: Request):
     require_auth(request, admin_only=True)
     try:
-        data = get_all_workflows_full()
+        data = await db.get_all_workflows_full()
         # Parse json_content from string back to object for clean export
         for wf in data:
             jc = wf.get("json_content")
@@ -595,31 +636,86 @@ async def api_admin_export(request: Request):
 
 
 @app.post("/api/admin/analyze-all")
-async def api_admin_analyze_all(request: Request, background_tasks: BackgroundTasks):
+async def api_admin_analyze_all(request: Request):
     require_auth(request, admin_only=True)
+    if not llm_gateway.available():
+        return JSONResponse({"status": "error", "message": "OPENAI_API_KEY не налаштовано"}, status_code=400)
     try:
-        # Run in background to prevent timeout
-        background_tasks.add_task(analyze_batch, limit=1000)
-        return JSONResponse({"status": "ok", "message": "Фоновий аналіз запущено"})
+        queued = await request_analysis()
+        return JSONResponse({"status": "ok", "message": "Фоновий аналіз запущено", "queued": queued})
     except Exception as e:
         logger.error(f"Analyze all error: {e}")
         return JSONResponse({"status": "error", "message": "Внутрішня помилка сервера"}, status_code=500)
+
+
+@app.post("/api/admin/analysis-queue/retry")
+async def api_admin_analysis_retry(request: Request):
+    """Give dead-lettered workflows a fresh set of analysis attempts."""
+    require_auth(request, admin_only=True)
+    return JSONResponse({"status": "ok", "requeued": await db.retry_dead_analysis()})
+
+
+@app.post("/api/admin/analysis-batches")
+async def api_admin_submit_analysis_batch(request: Request, limit: int = batch_analysis.ANALYSIS_BATCH_MAX):
+    """Send queued workflows to the provider's Batch API (cheaper, results within 24h)."""
+    require_auth(request, admin_only=True)
+    provider = batch_analysis.get_provider()
+    if provider.name == "openai" and not llm_gateway.available():
+        return JSONResponse({"status": "error", "message": "OPENAI_API_KEY не налаштовано"}, status_code=400)
+    try:
+        batch = await batch_analysis.submit_batch(limit, provider)
+    except Exception as e:
+        logger.error(f"Analysis batch submit error: {e}")
+        return JSONResponse({"status": "error", "message": "Не вдалося відправити пакет на аналіз"}, status_code=502)
+    return JSONResponse({"status": "ok", "batch": batch})
+
+
+@app.get("/api/admin/analysis-batches")
+async def api_admin_analysis_batches(request: Request):
+    require_auth(request, admin_only=True)
+    return JSONResponse({"batches": await db.get_analysis_batches()})
+
+
+@app.post("/api/admin/analysis-batches/{batch_id}/cancel")
+async def api_admin_cancel_analysis_batch(request: Request, batch_id: int):
+    require_auth(request, admin_only=True)
+    if not await batch_analysis.cancel_batch(batch_id):
+        return JSONResponse({"status": "error", "message": "Пакет не знайдено або він вже завершений"}, status_code=404)
+    return JSONResponse({"status": "ok"})
+
+
 @app.get("/api/admin/analysis-status")
 async def api_admin_analysis_status(request: Request):
     require_auth(request, admin_only=True)
-    
-    # Force 'running' status if lock is held, even if batch is just starting/finishing
-    current_status = analysis_status["status"]
-    if analysis_lock.locked():
-        current_status = "running"
-        
+    # Read from the durable queue, so every process reports the same progress
+    stats = await db.get_stats()
     return JSONResponse({
-        **analysis_status,
-        "status": current_status,
-        "total_unanalyzed": get_stats()["total_workflows"] - get_stats()["analyzed_count"]
+        **await db.get_analysis_queue_status(),
+        "total_unanalyzed": stats["total_workflows"] - stats["analyzed_count"],
+        # This process only
+        "rate_limiter": analyzer.limiter.stats(),
+        "llm": llm_gateway.stats(),
     })
 
 
+@app.get("/api/admin/stats/verify")
+async def api_admin_verify_stats(request: Request):
+    require_auth(request, admin_only=True)
+    return JSONResponse(await db.verify_stats())
+
+
+@app.post("/api/admin/stats/rebuild")
+async def api_admin_rebuild_stats(request: Request):
+    require_auth(request, admin_only=True)
+    return JSONResponse({"status": "ok", "stats": await db.rebuild_stats()})
+
+
+@app.get("/api/admin/cache-stats")
+async def api_admin_cache_stats(request: Request):
+    require_auth(request, admin_only=True)
+    return JSONResponse(db.get_cache_stats())
+
+
 @app.get("/api/admin/users")
 async def api_admin_users(request: Request):
     try:
@@ -632,8 +728,7 @@ async def api_admin_users(request: Request):
         return JSONResponse({"status": "error", "message": f"Auth error: {str(e)}"}, status_code=403)
 
     try:
-        from database import get_admin_users_report
-        users = get_admin_users_report()
+        users = await db.get_admin_users_report()
         return JSONResponse(users)
     except Exception as e:
         logger.error(f"Get admin users error: {e}")
@@ -663,7 +758,7 @@ async def api_chat_search(request: Request, body: dict = None):
         if not user_id:
             raise HTTPException(status_code=401, detail="Некоректна сесія. Будь ласка, увійдіть знову.")
             
-        usage = get_user_usage(user_id)
+        usage = await db.get_user_usage(user_id)
         # Bypass limits for pro subscribers
         if usage["sub_status"] != "active":
             if usage["ai_chat_count"] >= 3:
@@ -681,7 +776,7 @@ async def api_chat_search(request: Request, body: dict = None):
     
     # Increment usage on successful search (only for free users)
     if not is_admin(request) and usage and usage["sub_status"] != "active":
-        increment_user_usage(user_id)
+        await db.increment_user_usage(user_id)
         
     return JSONResponse(result)
 
@@ -691,7 +786,7 @@ async def api_chat_search(request: Request, body: dict = None):
 @app.get("/api/workflow/{wf_id}/import")
 async def api_workflow_import_url(wf_id: int):
     """Returns clean n8n JSON for direct import via 'Import from URL' in n8n."""
-    wf = get_workflow(wf_id)
+    wf = await db.get_workflow(wf_id)
     if not wf:
         raise HTTPException(status_code=404, detail="Воркфлоу не знайдено")
     return Response(
@@ -0,0 +1,118 @@
+"""
+Async facade over database.py.
+
+Every function here has the same signature as its counterpart in database.py
+but runs on a dedicated, sized thread pool, so slow FTS queries or bulk
+inserts never block the asyncio event loop.
+"""
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+# Readers can use every pooled connection at once; a few extra threads wait on the writer queue.
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", str(database.DB_READ_POOL_SIZE + 4)))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking callable on the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _async(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+async def shutdown():
+    """Stop the executor (pending calls are allowed to finish) and close connections.
+    The wait happens in a thread, so the event loop keeps serving while calls drain."""
+    await asyncio.to_thread(_shutdown)
+
+
+def _shutdown():
+    _executor.shutdown(wait=True)
+    database.close_db()
+
+
+init_db = _async(database.init_db)
+
+# Workflows
+search_workflows = _async(database.search_workflows)
+get_workflow = _async(database.get_workflow)
+get_similar_workflows = _async(database.get_similar_workflows)
+warm_vector_index = _async(database.warm_vector_index)
+get_all_workflows_full = _async(database.get_all_workflows_full)
+get_all_nodes = _async(database.get_all_nodes)
+get_all_categories = _async(database.get_all_categories)
+get_stats = _async(database.get_stats)
+verify_stats = _async(database.verify_stats)
+rebuild_stats = _async(database.rebuild_stats)
+get_unanalyzed_workflows = _async(database.get_unanalyzed_workflows)
+copy_cluster_analysis = _async(database.copy_cluster_analysis)
+get_cache_stats = database.get_cache_stats  # in-memory only, no I/O
+insert_workflow = _async(database.insert_workflow)
+insert_workflows_batch = _async(database.insert_workflows_batch)
+upsert_workflows_batch = _async(database.upsert_workflows_batch)
+get_json_hashes = _async(database.get_json_hashes)
+get_source_urls = _async(database.get_source_urls)
+delete_workflows_by_source = _async(database.delete_workflows_by_source)
+import_hub_records = _async(database.import_hub_records)
+update_workflow_ai = _async(database.update_workflow_ai)
+update_workflows_ai_batch = _async(database.update_workflows_ai_batch)
+rename_workflow = _async(database.rename_workflow)
+delete_workflow = _async(database.delete_workflow)
+clear_all_workflows = _async(database.clear_all_workflows)
+
+# GitHub repos
+add_github_repo = _async(database.add_github_repo)
+get_github_repos = _async(database.get_github_repos)
+get_github_repo = _async(database.get_github_repo)
+update_repo_sync = _async(database.update_repo_sync)
+get_repo_manifest = _async(database.get_repo_manifest)
+update_repo_manifest = _async(database.update_repo_manifest)
+delete_github_repo = _async(database.delete_github_repo)
+
+# Import jobs
+create_import_job = _async(database.create_import_job)
+update_import_job = _async(database.update_import_job)
+get_import_job = _async(database.get_import_job)
+get_import_jobs = _async(database.get_import_jobs)
+
+# Analysis queue
+enqueue_analysis = _async(database.enqueue_analysis)
+claim_analysis = _async(database.claim_analysis)
+fail_analysis = _async(database.fail_analysis)
+fail_analyses = _async(database.fail_analyses)
+renew_analysis_leases = _async(database.renew_analysis_leases)
+release_analysis = _async(database.release_analysis)
+retry_dead_analysis = _async(database.retry_dead_analysis)
+next_analysis_due = _async(database.next_analysis_due)
+get_analysis_queue_status = _async(database.get_analysis_queue_status)
+get_leased_workflows = _async(database.get_leased_workflows)
+get_cached_analyses = _async(database.get_cached_analyses)
+
+# Analysis batches
+create_analysis_batch = _async(database.create_analysis_batch)
+update_analysis_batch = _async(database.update_analysis_batch)
+get_analysis_batches = _async(database.get_analysis_batches)
+get_analysis_batch = _async(database.get_analysis_batch)
+
+# Users & payments
+upsert_user = _async(database.upsert_user)
+get_user_by_email = _async(database.get_user_by_email)
+get_user_usage = _async(database.get_user_usage)
+increment_user_usage = _async(database.increment_user_usage)
+update_subscription = _async(database.update_subscription)
+add_payment_record = _async(database.add_payment_record)
+get_payment_history = _async(database.get_payment_history)
+get_user_by_payment_customer = _async(database.get_user_by_payment_customer)
+get_admin_users_report = _async(database.get_admin_users_report)
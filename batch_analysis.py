@@ -0,0 +1,305 @@
+"""
+Batch-API mode for catalog-wide AI analysis.
+
+submit_batch() leases up to ANALYSIS_BATCH_MAX queued workflows as "batch:<id>"
+(so the interactive worker skips them), writes one chat-completion request per
+workflow to a JSONL file — the same prompt the worker sends — and hands it to a
+batch provider. run_poller(), started in the app lifespan, checks submitted
+batches every ANALYSIS_BATCH_POLL seconds; once the provider is done, every
+result is applied in one write transaction and failed or missing lines go back
+to the queue with the usual backoff. The Batch API costs half as much and has
+its own rate limits, in exchange for up to 24 hours of latency.
+
+Providers: "openai" (Files + Batches API) and "local", a file-based stand-in
+that keeps each batch in a directory and takes its output from a `respond`
+callable or from an output.jsonl dropped next to the input — so the whole flow
+runs offline.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from datetime import datetime
+
+import async_db as db
+import database
+import llm_gateway as llm
+from analyzer import (ANALYSIS_MAX_ATTEMPTS, ANALYSIS_TEMPERATURE, analysis_messages, workflow_data,
+                      analysis_key, parse_result, ai_fields, next_retry, request_analysis, serve_from_cache)
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_BATCH_PROVIDER = os.environ.get("ANALYSIS_BATCH_PROVIDER", "openai")  # openai | local
+ANALYSIS_BATCH_DIR = os.environ.get("ANALYSIS_BATCH_DIR", database.DB_PATH + ".batches")
+ANALYSIS_BATCH_MAX = int(os.environ.get("ANALYSIS_BATCH_MAX", "50000"))  # requests per batch (OpenAI limit)
+ANALYSIS_BATCH_POLL = float(os.environ.get("ANALYSIS_BATCH_POLL", "60"))  # seconds between status checks
+ANALYSIS_BATCH_LEASE = 26 * 3600  # the 24h completion window plus time to poll and apply
+
+ENDPOINT = "/v1/chat/completions"
+FINAL_STATES = {"completed", "failed", "expired", "cancelled"}  # provider states with nothing more to come
+
+
+class OpenAIBatchProvider:
+    """The OpenAI Batch API, through the shared gateway client."""
+    name = "openai"
+
+    async def submit(self, path):
+        client = llm.client()
+        with open(path, "rb") as f:
+            uploaded = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h")
+        return batch.id
+
+    async def poll(self, remote_id):
+        batch = await llm.client().batches.retrieve(remote_id)
+        counts = batch.request_counts
+        return {"state": batch.status,
+                "completed": counts.completed if counts else 0,
+                "failed": counts.failed if counts else 0}
+
+    async def results(self, remote_id):
+        client = llm.client()
+        batch = await client.batches.retrieve(remote_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                lines += [json.loads(line) for line in content.text.splitlines() if line.strip()]
+        return lines
+
+    async def cancel(self, remote_id):
+        await llm.client().batches.cancel(remote_id)
+
+
+class LocalBatchProvider:
+    """File-based stand-in for the Batch API: <directory>/<remote id>/{input,output}.jsonl.
+
+    With `respond` (request body -> answer content; raising fails that line) a batch
+    completes once `delay` seconds have passed. Without it, a batch stays in progress
+    until an OpenAI-format output.jsonl appears in its directory.
+    """
+    name = "local"
+
+    def __init__(self, directory, respond=None, delay=0.0):
+        self.directory, self.respond, self.delay = directory, respond, delay
+
+    def _path(self, remote_id, name):
+        return os.path.join(self.directory, remote_id, name)
+
+    async def submit(self, path):
+        remote_id = f"local_{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.directory, remote_id))
+        shutil.copyfile(path, self._path(remote_id, "input.jsonl"))
+        with open(self._path(remote_id, "submitted"), "w") as f:
+            f.write(str(time.time()))
+        return remote_id
+
+    async def poll(self, remote_id):
+        output = self._path(remote_id, "output.jsonl")
+        if os.path.exists(self._path(remote_id, "cancelled")):
+            state = "cancelled"
+        elif not os.path.exists(output):
+            with open(self._path(remote_id, "submitted")) as f:
+                submitted = float(f.read())
+            if self.respond is None or time.time() - submitted < self.delay:
+                return {"state": "in_progress", "completed": 0, "failed": 0}
+            await asyncio.to_thread(self._run, remote_id)
+            state = "completed"
+        else:
+            state = "completed"
+        lines = await self.results(remote_id)
+        failed = sum(1 for line in lines if line.get("error"))
+        return {"state": state, "completed": len(lines) - failed, "failed": failed}
+
+    async def results(self, remote_id):
+        output = self._path(remote_id, "output.jsonl")
+        if not os.path.exists(output):
+            return []
+        with open(output, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    async def cancel(self, remote_id):
+        open(self._path(remote_id, "cancelled"), "w").close()
+
+    def _run(self, remote_id):
+        with open(self._path(remote_id, "input.jsonl"), encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        tmp = self._path(remote_id, "output.jsonl.tmp")
+        with open(tmp, "w", encoding="utf-8") as out:
+            for req in requests:
+                line = {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": req["custom_id"],
+                        "response": None, "error": None}
+                try:
+                    content = self.respond(req["body"])
+                    line["response"] = {"status_code": 200, "body": {
+                        "object": "chat.completion", "model": req["body"].get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}]}}
+                except Exception as e:
+                    line["error"] = {"code": type(e).__name__, "message": str(e)}
+                out.write(json.dumps(line, ensure_ascii=False) + "\n")
+        os.replace(tmp, self._path(remote_id, "output.jsonl"))
+
+
+_providers = {}
+
+
+def get_provider(name=None):
+    """The provider registered under `name` (default: ANALYSIS_BATCH_PROVIDER)."""
+    name = name or ANALYSIS_BATCH_PROVIDER
+    if name not in _providers:
+        if name == "openai":
+            _providers[name] = OpenAIBatchProvider()
+        elif name == "local":
+            _providers[name] = LocalBatchProvider(os.path.join(ANALYSIS_BATCH_DIR, "local"))
+        else:
+            raise ValueError(f"Unknown batch provider: {name}")
+    return _providers[name]
+
+
+def set_provider(provider):
+    """Register a provider instance under its name (e.g. a LocalBatchProvider with a responder)."""
+    _providers[provider.name] = provider
+
+
+def _owner(batch_id):
+    return f"batch:{batch_id}"
+
+
+def _write_requests(batch_id, workflows):
+    os.makedirs(ANALYSIS_BATCH_DIR, exist_ok=True)
+    path = os.path.join(ANALYSIS_BATCH_DIR, f"batch-{batch_id}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for wf in workflows:
+            body = llm.chat_body(analysis_messages(workflow_data(wf)), ANALYSIS_TEMPERATURE)
+            f.write(json.dumps({"custom_id": f"wf-{wf['id']}", "method": "POST", "url": ENDPOINT, "body": body},
+                               ensure_ascii=False) + "\n")
+    return path
+
+
+async def submit_batch(limit=ANALYSIS_BATCH_MAX, provider=None) -> dict:
+    """Lease up to `limit` queued workflows and submit the ones the analysis cache can't answer
+    as one batch. Returns the batch row.
+    """
+    provider = provider or get_provider()
+    await request_analysis()
+    batch_id = await db.create_analysis_batch(provider.name)
+    owner = _owner(batch_id)
+    now = datetime.utcnow().isoformat()
+    try:
+        claimed = await db.claim_analysis(owner, limit=min(limit, ANALYSIS_BATCH_MAX),
+                                          lease_seconds=ANALYSIS_BATCH_LEASE, max_attempts=ANALYSIS_MAX_ATTEMPTS)
+        workflows = await serve_from_cache(claimed, owner)
+        cached = len(claimed) - len(workflows)
+        if not workflows:
+            await db.update_analysis_batch(batch_id, state="applied", applied=cached, finished_at=now)
+        else:
+            path = await asyncio.to_thread(_write_requests, batch_id, workflows)
+            try:
+                remote_id = await provider.submit(path)
+            finally:
+                os.remove(path)
+            await db.update_analysis_batch(batch_id, state="submitted", remote_id=remote_id,
+                                           total=len(workflows), applied=cached, submitted_at=now)
+            logger.info(f"Submitted analysis batch {batch_id} ({remote_id}): {len(workflows)} workflows")
+    except Exception as e:
+        await db.release_analysis(owner)
+        await db.update_analysis_batch(batch_id, state="failed", error=f"{type(e).__name__}: {e}",
+                                       finished_at=datetime.utcnow().isoformat())
+        raise
+    return await db.get_analysis_batch(batch_id)
+
+
+def _line_content(line):
+    """Answer content of one output line; raises ValueError for failed requests."""
+    if line.get("error"):
+        error = line["error"]
+        raise ValueError(error.get("message", error) if isinstance(error, dict) else error)
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        body = response.get("body") or {}
+        raise ValueError(f"HTTP {response.get('status_code')}: {(body.get('error') or {}).get('message', '')}")
+    return response["body"]["choices"][0]["message"]["content"]
+
+
+async def _apply(batch, provider):
+    """Save every result of a finished batch in one transaction and requeue what failed."""
+    owner = _owner(batch["id"])
+    lines = await provider.results(batch["remote_id"])
+    # Only entries still leased by this batch: ones whose lease ran out belong to someone else now
+    held = {wf["id"]: wf for wf in await db.get_leased_workflows(owner)}
+    items, failures, keys = [], [], {}
+    for line in lines:
+        try:
+            wf_id = int(str(line.get("custom_id", "")).removeprefix("wf-"))
+        except ValueError:
+            continue
+        wf = held.pop(wf_id, None)
+        if wf is None:
+            continue
+        try:
+            items.append((wf_id, ai_fields(parse_result(_line_content(line), wf))))
+            keys[wf_id] = analysis_key(workflow_data(wf))
+        except Exception as e:
+            failures.append((wf_id, f"{type(e).__name__}: {e}", next_retry(wf["attempts"])))
+    for wf_id, wf in held.items():
+        failures.append((wf_id, "Missing from batch output", next_retry(wf["attempts"])))
+
+    applied = await db.update_workflows_ai_batch(items, owner=owner, cache=keys) if items else 0
+    if failures:
+        await db.fail_analyses(failures, owner)
+    # applied already counts the workflows served from the analysis cache at submit time
+    await db.update_analysis_batch(batch["id"], state="applied", applied=batch["applied"] + applied,
+                                   failed=len(failures), finished_at=datetime.utcnow().isoformat())
+    if applied:
+        await db.copy_cluster_analysis()
+    logger.info(f"Applied analysis batch {batch['id']}: {applied} saved, {len(failures)} requeued")
+    return applied
+
+
+async def poll_batches():
+    """Refresh every submitted batch and apply the ones the provider has finished."""
+    for batch in await db.get_analysis_batches(limit=100, states=("submitted",)):
+        try:
+            provider = get_provider(batch["provider"])
+            status = await provider.poll(batch["remote_id"])
+        except Exception as e:
+            logger.warning(f"Polling analysis batch {batch['id']} failed: {e}")
+            continue
+        await db.update_analysis_batch(batch["id"], provider_state=status["state"],
+                                       completed=status["completed"], failed=status["failed"])
+        # The state switch makes sure only one process applies a batch
+        if status["state"] in FINAL_STATES and \
+                await db.update_analysis_batch(batch["id"], expect_state="submitted", state="applying"):
+            try:
+                await _apply(batch, provider)
+            except Exception as e:
+                logger.exception(f"Applying analysis batch {batch['id']} failed")
+                await db.update_analysis_batch(batch["id"], state="submitted", error=f"{type(e).__name__}: {e}")
+
+
+async def cancel_batch(batch_id) -> bool:
+    """Ask the provider to cancel a submitted batch; results so far are applied once it stops."""
+    batch = await db.get_analysis_batch(batch_id)
+    if not batch or batch["state"] != "submitted":
+        return False
+    await get_provider(batch["provider"]).cancel(batch["remote_id"])
+    return True
+
+
+async def run_poller():
+    """Poll submitted batches until cancelled."""
+    # A process stopped mid-apply leaves its batch in 'applying'; applying again is safe
+    # because results only land for entries the batch still holds
+    for batch in await db.get_analysis_batches(limit=100, states=("applying",)):
+        await db.update_analysis_batch(batch["id"], expect_state="applying", state="submitted")
+    while True:
+        try:
+            await poll_batches()
+        except Exception:
+            logger.exception("Analysis batch poller error")
+        await asyncio.sleep(ANALYSIS_BATCH_POLL)
@@ -0,0 +1,147 @@
+"""
+Benchmark for the analysis worker against a simulated LLM provider.
+
+The fake provider answers after a random latency (lognormal around --latency),
+enforces its requests-per-minute limit over one-second windows, as OpenAI does —
+answering 429 with retry-after once it's exceeded — and sends
+x-ratelimit-remaining-* headers (unless a scenario turns them off). Each scenario
+drains the same analysis queue and reports throughput, 429s and the number of
+write transactions used to save the results.
+
+    python benchmarks/bench_analysis.py [--workflows 400] [--latency 0.05] [--provider-rpm 3000]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import deque
+from pathlib import Path
+
+import httpx
+from openai import RateLimitError
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+
+import database  # noqa: E402
+import analyzer  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+from ratelimit import RateLimiter  # noqa: E402
+
+ANSWER = json.dumps({"usefulness": 7, "universality": 6, "complexity": 4, "scalability": 5,
+                     "suggested_name": "", "difficulty_level": "intermediate", "tags": ["bench"],
+                     "uk": {"summary": "Тест", "use_cases": []}, "en": {"summary": "Test", "use_cases": []}})
+
+
+class FakeProvider:
+    def __init__(self, rpm, latency, rng, headers=True):
+        self.per_second, self.latency, self.rng, self.headers = max(1, rpm // 60), latency, rng, headers
+        self.window = deque()
+        self.calls = self.rejected = 0
+
+    async def complete(self, messages):
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 1:
+            self.window.popleft()
+        if len(self.window) >= self.per_second:
+            self.rejected += 1
+            wait = 1 - (now - self.window[0])
+            response = httpx.Response(429, headers={"retry-after-ms": str(int(wait * 1000))},
+                                      request=httpx.Request("POST", "https://fake/v1/chat/completions"))
+            raise RateLimitError("Rate limit reached", response=response, body=None)
+        self.window.append(now)
+        self.calls += 1
+        await asyncio.sleep(self.rng.lognormvariate(0, 0.4) * self.latency)
+        headers = {"x-ratelimit-remaining-requests": str(self.per_second - len(self.window)),
+                   "x-ratelimit-reset-requests": f"{1 - (now - self.window[0]):.2f}s"} if self.headers else {}
+        return ANSWER, len(messages[-1]["content"]) // 3 + 200, headers
+
+
+def reset_analysis(conn):
+    conn.execute(f"UPDATE workflows SET {database._AI_RESET}")
+    conn.execute("DELETE FROM analysis_queue")
+    conn.execute("DELETE FROM analysis_cache")
+    conn.commit()
+
+
+async def drain(provider, concurrency, rpm):
+    analyzer._complete = provider.complete
+    analyzer.ANALYSIS_CONCURRENCY = concurrency
+    analyzer.limiter = RateLimiter(rpm, 0)
+    worker = asyncio.create_task(analyzer.run_worker())
+    t0 = time.perf_counter()
+    while True:
+        await asyncio.sleep(0.05)
+        status = database.get_analysis_queue_status()
+        if status["status"] == "idle" and status["queue"]["done"]:
+            break
+    elapsed = time.perf_counter() - t0
+    worker.cancel()
+    await asyncio.gather(worker, return_exceptions=True)
+    return elapsed, status, analyzer.limiter.stats()
+
+
+async def run_scenarios(args, rng, writes):
+    scenarios = [
+        ("sequential (concurrency 1)", 1, args.provider_rpm, True),
+        ("concurrency 8", 8, args.provider_rpm, True),
+        ("concurrency 32", 32, args.provider_rpm, True),
+        ("concurrency 32, RPM set 2x too high", 32, args.provider_rpm * 2, True),
+        ("same, no rate-limit headers", 32, args.provider_rpm * 2, False),
+    ]
+    for label, concurrency, rpm, headers in scenarios:
+        database._writer.submit(reset_analysis)
+        writes[0] = 0
+        provider = FakeProvider(args.provider_rpm, args.latency, rng, headers)
+        elapsed, status, limiter = await drain(provider, concurrency, rpm)
+        analyzed = status["queue"]["done"]
+        print(f"{label:<36} {elapsed:6.2f}s  {analyzed / elapsed:7.1f} workflows/s  "
+              f"429s={provider.rejected:<4} save transactions={writes[0]:<4} dead={status['queue']['dead']}  "
+              f"limiter={limiter}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=400)
+    ap.add_argument("--latency", type=float, default=0.05, help="median provider latency, seconds")
+    ap.add_argument("--provider-rpm", type=int, default=3000)
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    database.init_db()
+    batch = []
+    for i in range(args.workflows):
+        data = {"name": f"bench {i}", "nodes": [{"name": f"n{j}", "type": f"n8n-nodes-base.node{(i + j) % 50}",
+                                                 "parameters": {"i": i, "j": j}} for j in range(4)],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        wf["description"] = f"bench workflow {i}"  # distinct prompt inputs: no analysis cache hits
+        batch.append(wf)
+    database.insert_workflows_batch(batch)
+
+    writes = [0]
+    save = database.update_workflows_ai_batch
+
+    def counting_save(*a, **kw):
+        writes[0] += 1
+        return save(*a, **kw)
+    analyzer.db.update_workflows_ai_batch = lambda *a, **kw: analyzer.db.run(counting_save, *a, **kw)
+
+    print(f"{args.workflows} workflows, provider: {args.provider_rpm} RPM, median latency {args.latency * 1000:.0f}ms")
+    asyncio.run(run_scenarios(args, rng, writes))
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Event-loop latency benchmark for the FastAPI app.
+
+Fires /api/search requests in a tight loop and reports p50/p99 latency, first
+on an idle server and then while an /api/import/local job imports a generated
+directory of workflows. Both run in-process on one event loop (ASGI transport),
+so any blocking call on the loop shows up directly in the search latencies.
+The search cache is off (CACHE_SEARCH_SIZE=0) unless set in the environment.
+
+    python benchmarks/bench_api_latency.py [--workflows 4000] [--clients 4]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+# The query set is small and repeats: with the search cache on, everything after the first
+# round would be a cache hit. Off by default so the numbers measure SQLite.
+os.environ.setdefault("CACHE_SEARCH_SIZE", "0")
+os.environ["LOCAL_WORKFLOWS_DIR"] = ""
+os.environ.setdefault("ADMIN_USER", "admin")
+os.environ.setdefault("ADMIN_PASS", "changeme")
+
+import httpx  # noqa: E402
+
+import async_db as db  # noqa: E402
+from app import app  # noqa: E402
+
+QUERIES = ["", "seo", "google sheets", "ai agent", "report", "serp analysis"]
+
+
+def make_workflow_dir(count):
+    samples = [f.read_text(encoding="utf-8") for f in sorted((ROOT / "data" / "workflows").glob("*.json"))]
+    out_dir = Path(_tmp) / "workflows"
+    out_dir.mkdir()
+    for i in range(count):
+        data = json.loads(samples[i % len(samples)])
+        if isinstance(data, list):
+            data = data[0]
+        data["name"] = f"{data.get('name', 'wf')} #{i}"
+        (out_dir / f"wf_{i:05d}.json").write_text(json.dumps(data), encoding="utf-8")
+    return out_dir
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def search_clients(client, n_clients, stop):
+    latencies = []
+
+    async def loop(idx):
+        i = idx
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            r = await client.get("/api/search", params={"q": QUERIES[i % len(QUERIES)]})
+            r.raise_for_status()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            i += 1
+
+    await asyncio.gather(*(loop(i) for i in range(n_clients)))
+    return latencies
+
+
+def report(label, latencies):
+    print(f"{label:<16} requests={len(latencies):>6}  p50={percentile(latencies, 50):7.2f}ms  "
+          f"p99={percentile(latencies, 99):7.2f}ms  max={max(latencies or [0]):7.2f}ms")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=4000)
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--idle-seconds", type=float, default=3.0)
+    args = ap.parse_args()
+
+    await db.init_db()
+    wf_dir = make_workflow_dir(args.workflows)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        r = await client.post("/api/login", data={"username": os.environ["ADMIN_USER"],
+                                                  "password": os.environ["ADMIN_PASS"]})
+        r.raise_for_status()
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(search_clients(client, args.clients, stop))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        report("idle", await task)
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(search_clients(client, args.clients, stop))
+        t0 = time.perf_counter()
+        r = await client.post("/api/import/local", data={"directory": str(wf_dir)})
+        job_id = r.json()["job_id"]
+        while (job := (await client.get(f"/api/import/jobs/{job_id}")).json())["state"] not in ("done", "failed"):
+            await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        report("during import", await task)
+        print(f"import job {job_id}: {job['state']} {job['result']} stages={job['timings']} in {elapsed:.2f}s")
+
+    await db.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+"""
+Offline check and benchmark for Batch-API analysis (batch_analysis.py).
+
+Runs the whole batch flow against LocalBatchProvider, so no API key or network
+is needed: queued workflows are submitted as one batch whose responder fails a
+--fail share of the lines (a request error for some, unparseable JSON for
+others), the batch is polled and applied, and the script checks that
+
+  - the batch row counts what was saved and what was requeued,
+  - failed entries are back to pending with one attempt used and a backoff,
+  - the queue ends with the rest done and nothing left running,
+  - applying the same batch again changes nothing,
+  - a second batch, once the backoff has passed, finishes the queue.
+
+It reports the submit and apply times of each batch.
+
+    python benchmarks/bench_batch.py [--workflows 2000] [--fail 0.02]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+
+import database  # noqa: E402
+import async_db as db  # noqa: E402
+import batch_analysis  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+
+_NAME = re.compile(r"bench workflow (\d+)")
+
+ANSWER = {
+    "usefulness": 7, "universality": 6, "complexity": 4, "scalability": 6,
+    "suggested_name": "Automated workflow", "difficulty_level": "intermediate",
+    "tags": ["automation", "sync"],
+    "uk": {"summary": "Воркфлоу синхронізує записи між сервісами та сповіщає команду.",
+           "use_cases": ["Синхронізація лідів"], "target_audience": "Малий бізнес",
+           "integrations_summary": "CRM і Slack"},
+    "en": {"summary": "The workflow syncs records between services and notifies the team.",
+           "use_cases": ["Syncing leads"], "target_audience": "Small businesses",
+           "integrations_summary": "A CRM and Slack"},
+}
+
+
+def responder(failing):
+    """Answer every request; the workflows in `failing` (number -> kind) get a request error
+    or broken JSON instead."""
+    def respond(body):
+        n = int(_NAME.search(body["messages"][-1]["content"]).group(1))
+        if failing.get(n) == "error":
+            raise RuntimeError("server_error")
+        if failing.get(n) == "json":
+            return '{"usefulness": 7, "summary": '
+        return json.dumps(ANSWER, ensure_ascii=False)
+    return respond
+
+
+def queue_rows(conn):
+    return [dict(r) for r in conn.execute(
+        "SELECT workflow_id, state, attempts, next_attempt_at, lease_owner, last_error FROM analysis_queue")]
+
+
+def make_due(conn):
+    conn.execute("UPDATE analysis_queue SET next_attempt_at = ? WHERE state = 'pending'",
+                 (datetime.utcnow().isoformat(),))
+    conn.commit()
+
+
+async def run_batch(provider, limit):
+    t0 = time.perf_counter()
+    batch = await batch_analysis.submit_batch(limit=limit, provider=provider)
+    submitted = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    await batch_analysis.poll_batches()
+    applied = time.perf_counter() - t0
+    return await db.get_analysis_batch(batch["id"]), submitted, applied
+
+
+def report(label, batch, submitted, applied):
+    print(f"{label:<14} {batch['total']:>7} {batch['applied']:>8} {batch['failed']:>7} "
+          f"{submitted:9.2f}s {applied:9.2f}s  {batch['state']}")
+
+
+async def run(args, ids):
+    index = {int(_NAME.search(name).group(1)): wf_id for wf_id, name in ids}
+    step = max(1, round(1 / args.fail)) if args.fail else 0
+    failing = {n: ("error", "json")[n // step % 2] for n in index if step and n % step == step - 1}
+    expected_ok = len(index) - len(failing)
+
+    print(f"{'':<14} {'lines':>7} {'applied':>8} {'failed':>7} {'submit':>10} {'apply':>10}  state")
+    provider = batch_analysis.LocalBatchProvider(os.path.join(_tmp, "local"), respond=responder(failing))
+    batch_analysis.set_provider(provider)
+    started = datetime.utcnow().isoformat()
+    batch, submitted, applied = await run_batch(provider, len(index))
+    report("first batch", batch, submitted, applied)
+
+    assert batch["state"] == "applied", batch
+    assert batch["total"] == len(index), batch
+    assert batch["applied"] == expected_ok, (batch["applied"], expected_ok)
+    assert batch["failed"] == len(failing), (batch["failed"], len(failing))
+
+    rows = {r["workflow_id"]: r for r in database._writer.submit(queue_rows)}
+    failed_ids = {index[n] for n in failing}
+    for wf_id, row in rows.items():
+        if wf_id in failed_ids:
+            # Requeued with the usual backoff: one attempt used, due again in the future
+            assert row["state"] == "pending" and row["attempts"] == 1, row
+            assert row["next_attempt_at"] > started and row["last_error"] and not row["lease_owner"], row
+        else:
+            assert row["state"] == "done" and not row["lease_owner"], row
+    status = await db.get_analysis_queue_status()
+    assert status["queue"]["done"] == expected_ok and status["queue"]["pending"] == len(failing), status["queue"]
+    assert status["queue"]["running"] == 0 and status["queue"]["dead"] == 0, status["queue"]
+    assert (await db.get_stats())["analyzed_count"] == expected_ok
+    errors = sorted({r["last_error"][:40] for r in rows.values() if r["state"] == "pending"})
+    print(f"requeued:      {len(failing)} ({'; '.join(errors) or 'none'}), retry from "
+          f"{min((r['next_attempt_at'] for r in rows.values() if r['state'] == 'pending'), default='-')}")
+
+    # Applying the same batch again (e.g. after a crash mid-apply) must not save or requeue anything
+    await db.update_analysis_batch(batch["id"], state="submitted")
+    await batch_analysis.poll_batches()
+    again = await db.get_analysis_batch(batch["id"])
+    assert again["applied"] == batch["applied"] and again["failed"] == 0, again
+    assert {r["workflow_id"]: r for r in database._writer.submit(queue_rows)} == rows
+    print("re-apply:      no-op")
+
+    # Once the backoff has passed, the next batch picks the requeued workflows up
+    database._writer.submit(make_due)
+    provider = batch_analysis.LocalBatchProvider(os.path.join(_tmp, "local2"), respond=responder({}))
+    batch_analysis.set_provider(provider)
+    batch, submitted, applied = await run_batch(provider, len(index))
+    report("retry batch", batch, submitted, applied)
+    assert batch["total"] == len(failing) and batch["applied"] == len(failing), batch
+    status = await db.get_analysis_queue_status()
+    assert status["status"] == "idle" and status["queue"]["done"] == len(index), status["queue"]
+    attempts = {r["workflow_id"]: r["attempts"] for r in database._writer.submit(queue_rows)}
+    assert all(attempts[wf_id] == 2 for wf_id in failed_ids), attempts
+    print(f"queue:         {status['queue']['done']} done, nothing pending, running or dead")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=2000)
+    ap.add_argument("--fail", type=float, default=0.02, help="share of batch lines that fail")
+    args = ap.parse_args()
+
+    database.init_db()
+    batch = []
+    for i in range(args.workflows):
+        # Distinct node types, so no two workflows share a cluster or a cached analysis
+        data = {"name": f"bench workflow {i}",
+                "nodes": [{"name": f"n{j}", "type": f"n8n-nodes-base.bench{i}x{j}", "parameters": {"i": i}}
+                          for j in range(3)],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        batch.append(wf)
+    database.insert_workflows_batch(batch)
+    ids = database._writer.submit(lambda conn: [tuple(r) for r in conn.execute("SELECT id, name FROM workflows")])
+
+    print(f"{args.workflows} workflows, {args.fail:.0%} of batch lines failing")
+    asyncio.run(run(args, ids))
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Concurrency benchmark for the SQLite connection layer.
+
+Measures /api/search-style query latency from several reader threads while a
+bulk import (default 4000 workflows) runs through the serialized writer. The
+search cache is off (CACHE_SEARCH_SIZE=0) unless set in the environment.
+
+    python benchmarks/bench_db_concurrency.py [--workflows 4000] [--readers 4]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+# The query set is small and repeats: with the search cache on, everything after the first
+# round would be a cache hit. Off by default so the numbers measure SQLite.
+os.environ.setdefault("CACHE_SEARCH_SIZE", "0")
+
+import database  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+
+QUERIES = ["", "seo", "google sheets", "ai agent", "report", "serp analysis"]
+
+
+def make_workflows(count):
+    """Generate `count` distinct workflows by renaming the bundled samples."""
+    samples = [f.read_text(encoding="utf-8") for f in sorted((ROOT / "data" / "workflows").glob("*.json"))]
+    out = []
+    for i in range(count):
+        data = json.loads(samples[i % len(samples)])
+        if isinstance(data, list):
+            data = data[0]
+        data["name"] = f"{data.get('name', 'wf')} #{i}"
+        parsed = parse_workflow_json(json.dumps(data))
+        parsed["source_url"] = f"bench://{i}"
+        out.append(parsed)
+    return out
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_readers(n_readers, stop, latencies):
+    def loop(idx):
+        i = idx
+        while not stop.is_set():
+            q = QUERIES[i % len(QUERIES)]
+            t0 = time.perf_counter()
+            database.search_workflows(query=q, page=1)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            i += 1
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(n_readers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def report(label, latencies, elapsed):
+    print(f"{label:<22} queries={len(latencies):>6}  qps={len(latencies) / elapsed:>8.1f}  "
+          f"p50={percentile(latencies, 50):6.2f}ms  p99={percentile(latencies, 99):7.2f}ms  "
+          f"max={max(latencies or [0]):7.2f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=4000)
+    ap.add_argument("--readers", type=int, default=4)
+    ap.add_argument("--batch", type=int, default=500)
+    args = ap.parse_args()
+
+    database.init_db()
+    database.insert_workflows_batch(make_workflows(200))
+    workload = make_workflows(args.workflows + 200)[200:]
+
+    # Baseline: readers only
+    stop = threading.Event()
+    lat = []
+    t0 = time.perf_counter()
+    threads = run_readers(args.readers, stop, lat)
+    time.sleep(2)
+    stop.set()
+    for t in threads:
+        t.join()
+    report("idle", lat, time.perf_counter() - t0)
+
+    # Readers during a bulk import
+    stop = threading.Event()
+    lat = []
+    t0 = time.perf_counter()
+    threads = run_readers(args.readers, stop, lat)
+    imported = 0
+    for i in range(0, len(workload), args.batch):
+        new, _ = database.insert_workflows_batch(workload[i:i + args.batch])
+        imported += new
+    import_time = time.perf_counter() - t0
+    stop.set()
+    for t in threads:
+        t.join()
+    report("during import", lat, time.perf_counter() - t0)
+    print(f"import: {imported} workflows in {import_time:.2f}s ({imported / import_time:.0f}/s)")
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
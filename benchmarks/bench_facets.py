@@ -0,0 +1,134 @@
+"""
+Benchmark for search facet counts (facets.py) and a check that they, and the
+search cache, follow writes made by other processes.
+
+Generates workflows with random node types (Zipf-like, as in bench_similar.py),
+then reports the bitmap index build time and the latency of searches with
+facets=True, unfiltered and filtered by node. The search cache is cleared before
+each timed call, so every call counts facets instead of hitting the cache.
+
+Then a second process inserts workflows with a node type nobody else has. This
+process's data generation doesn't move, so both the cached search result and the
+facet counts have to pick the write up from the change log.
+
+    python benchmarks/bench_facets.py [--workflows 20000] [--queries 200]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ.setdefault("FACET_MAX_STALENESS", "0")
+
+import database  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+
+NODE_TYPES = [f"n8n-nodes-base.node{i}" for i in range(400)]
+FOREIGN_NODE = "otherProcess"  # facet value of n8n-nodes-base.otherProcess
+
+# Run in the second process: insert `count` workflows that all use the FOREIGN_NODE type
+_OTHER_PROCESS = f"""
+import sys, json
+sys.path.insert(0, {str(ROOT)!r})
+import database
+from importer import parse_workflow_json
+database.init_db()
+count = int(sys.argv[1])
+batch = []
+for i in range(count):
+    wf = parse_workflow_json(json.dumps({{"name": f"other process #{{i}}", "connections": {{}},
+        "nodes": [{{"name": "n", "type": "n8n-nodes-base." + {FOREIGN_NODE!r}, "parameters": {{"i": i}}}}]}}))
+    wf["source_url"] = f"other://{{i}}"
+    batch.append(wf)
+database.insert_workflows_batch(batch)
+database.close_db()
+"""
+
+
+def _zipf_pick(rng, items, k):
+    picked = set()
+    while len(picked) < k:
+        picked.add(items[min(len(items) - 1, int(rng.paretovariate(1.1)) - 1)])
+    return picked
+
+
+def make_workflows(count, rng):
+    out = []
+    for i in range(count):
+        types = _zipf_pick(rng, NODE_TYPES, rng.randint(3, 12))
+        data = {"name": f"bench #{i}",
+                "nodes": [{"name": f"n{j}", "type": t, "parameters": {"i": i, "j": j}}
+                          for j, t in enumerate(types)],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        out.append(wf)
+    return out
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def node_count(result, node):
+    return next((f["count"] for f in result["facets"]["node"] if f["value"] == node), 0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--foreign", type=int, default=25, help="workflows inserted by the second process")
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    database.init_db()
+    database.insert_workflows_batch(make_workflows(args.workflows, rng))
+
+    t0 = time.perf_counter()
+    before = database.search_workflows(facets=True)
+    print(f"facet index build ({args.workflows} workflows): {(time.perf_counter() - t0) * 1000:8.1f}ms")
+
+    nodes = [f["value"] for f in before["facets"]["node"][:50]]
+    for label, filters in (("unfiltered", [{}]), ("node filter", [{"node": n} for n in nodes])):
+        latencies = []
+        for i in range(args.queries):
+            database._search_cache.clear()
+            t0 = time.perf_counter()
+            database.search_workflows(facets=True, **filters[i % len(filters)])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        print(f"search + facets, {label:<12} p50={percentile(latencies, 50):7.2f}ms  "
+              f"p99={percentile(latencies, 99):7.2f}ms")
+
+    before = database.search_workflows(facets=True)
+    hits = database.get_cache_stats()["search"]["hits"]
+    assert database.search_workflows(facets=True) is before and database.get_cache_stats()["search"]["hits"] > hits
+
+    generation = database.data_generation()
+    subprocess.run([sys.executable, "-c", _OTHER_PROCESS, str(args.foreign)], check=True,
+                   env=os.environ, stdout=subprocess.DEVNULL)
+    after = database.search_workflows(facets=True)
+    assert database.data_generation() == generation, "the write should come from the other process only"
+    assert node_count(before, FOREIGN_NODE) == 0
+    assert node_count(after, FOREIGN_NODE) == args.foreign, after["facets"]["node"][-5:]
+    assert after["total"] == before["total"] + args.foreign, (before["total"], after["total"])
+    print(f"write from another process: {FOREIGN_NODE} {node_count(before, FOREIGN_NODE)} -> "
+          f"{node_count(after, FOREIGN_NODE)}, total {before['total']} -> {after['total']}")
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
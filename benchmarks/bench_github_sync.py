@@ -0,0 +1,249 @@
+"""
+GitHub sync benchmark against a local fake GitHub (API, raw and archive endpoints).
+
+Imports a generated repo once, then measures: a sync with no new commits, an
+incremental sync after editing a few files, and a forced full re-import of the
+same commit, reporting wall time, requests and bytes downloaded for each.
+With --repos > 1 it also compares sync_all_repos run one repo at a time
+against SYNC_CONCURRENCY repos at once.
+
+    python benchmarks/bench_github_sync.py [--files 3000] [--changed 20]
+        [--repos 6] [--latency 30] [--rate-limit 0]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+
+
+def git_blob_sha(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class FakeRepo:
+    """In-memory repo `o/<name>` on branch main; every commit() moves the head."""
+
+    def __init__(self, name, files):
+        self.name = name
+        self.files = dict(files)
+        self.commit()
+
+    def commit(self):
+        h = hashlib.sha1()
+        for path in sorted(self.files):
+            h.update(path.encode() + b"\0" + self.files[path])
+        self.head = h.hexdigest()
+        self.tree = [{"path": p, "type": "blob", "sha": git_blob_sha(d)} for p, d in self.files.items()]
+
+    def archive(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(f"{self.name}-{self.head}/", "")
+            for path, data in self.files.items():
+                zf.writestr(f"{self.name}-{self.head}/{path}", data)
+            zf.comment = self.head.encode()
+        return buf.getvalue()
+
+    def edit(self, count, tag):
+        for p in sorted(self.files)[:count]:
+            data = json.loads(self.files[p])
+            data["name"] = data["name"].split(" [", 1)[0] + f" [{tag}]"
+            self.files[p] = json.dumps(data, indent=2).encode()
+        self.commit()
+
+
+class FakeGitHub:
+    """Request counters, per-request latency and an optional API rate-limit window."""
+
+    def __init__(self, latency=0.0, rate_limit=0, window=2.0):
+        self.repos = {}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset_counters()
+        self.window_start = time.time()
+        self.used = 0
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.limited = 0
+
+    def take_api_call(self):
+        """Returns (allowed, remaining, reset_epoch)."""
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window:
+                self.window_start, self.used = now, 0
+            reset = int(self.window_start + self.window) + 1
+            if self.rate_limit and self.used >= self.rate_limit:
+                self.limited += 1
+                return False, 0, reset
+            self.used += 1
+            return True, max(0, self.rate_limit - self.used), reset
+
+    def route(self, path):
+        parts = path.strip("/").split("/")
+        if parts[0] == "repos" and len(parts) >= 3:
+            repo = self.repos.get(parts[2])
+            rest = parts[3:]
+            if repo is None:
+                return None
+            if not rest:
+                return "api", {"default_branch": "main"}
+            if rest == ["branches", "main"]:
+                return "api", {"name": "main", "commit": {"sha": repo.head}}
+            if rest[:2] == ["git", "trees"] and rest[2:] == [repo.head]:
+                return "api", {"sha": repo.head, "tree": repo.tree, "truncated": False}
+            return None
+        repo = self.repos.get(parts[1]) if len(parts) > 2 else None
+        if repo is None:
+            return None
+        rest = "/".join(parts[2:])
+        if rest in (f"archive/{repo.head}.zip", "archive/refs/heads/main.zip"):
+            return "web", repo.archive()
+        if rest.startswith(repo.head + "/") and rest[len(repo.head) + 1:] in repo.files:
+            return "raw", repo.files[rest[len(repo.head) + 1:]]
+        return None
+
+    def handler(self):
+        gh = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body, headers=None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                with gh.lock:
+                    gh.requests += 1
+                    gh.bytes_sent += len(body)
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, str(v))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(gh.latency)
+                found = gh.route(urlparse(self.path).path)
+                if found is None:
+                    return self.send(404, {"message": "Not Found"})
+                kind, body = found
+                if kind != "api" or not gh.rate_limit:
+                    return self.send(200, body)
+                allowed, remaining, reset = gh.take_api_call()
+                headers = {"X-RateLimit-Limit": gh.rate_limit, "X-RateLimit-Remaining": remaining,
+                           "X-RateLimit-Reset": reset}
+                if not allowed:
+                    return self.send(403, {"message": "API rate limit exceeded"}, headers)
+                self.send(200, body, headers)
+
+        return Handler
+
+
+def make_files(count, salt=""):
+    samples = [f.read_text(encoding="utf-8") for f in sorted((ROOT / "data" / "workflows").glob("*.json"))]
+    files = {}
+    for i in range(count):
+        data = json.loads(samples[i % len(samples)])
+        if isinstance(data, list):
+            data = data[0]
+        data["name"] = f"{data.get('name', 'wf')} #{salt}{i}"
+        files[f"workflows/{i // 500:03d}/wf_{i:05d}.json"] = json.dumps(data, indent=2).encode()
+    return files
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=3000)
+    ap.add_argument("--changed", type=int, default=20)
+    ap.add_argument("--repos", type=int, default=6, help="repos for the sync_all_repos comparison")
+    ap.add_argument("--latency", type=float, default=30, help="simulated ms per request")
+    ap.add_argument("--rate-limit", type=int, default=0, help="API calls per 2s window (0 = unlimited)")
+    args = ap.parse_args()
+
+    gh = FakeGitHub(latency=args.latency / 1000, rate_limit=args.rate_limit)
+    repo = gh.repos["r"] = FakeRepo("r", make_files(args.files))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), gh.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update(GITHUB_API_URL=base, GITHUB_RAW_URL=base, GITHUB_WEB_URL=base)
+
+    import async_db as db
+    import importer
+
+    await db.init_db()
+    await importer.start_http()
+
+    async def measure(label, coro):
+        gh.reset_counters()
+        t0 = time.perf_counter()
+        result = await coro
+        elapsed = time.perf_counter() - t0
+        results = result if isinstance(result, list) else [result]
+        total = {k: sum(r.get(k) or 0 for r in results) for k in ("imported", "updated", "removed", "total_files")}
+        print(f"{label:<22} {elapsed * 1000:9.1f}ms  requests={gh.requests:>5}  "
+              f"downloaded={gh.bytes_sent / 1024:9.1f}KB  limited={gh.limited:>3}  "
+              f"mode={','.join(sorted({str(r.get('mode')) for r in results}))}  "
+              f"added={total['imported']}  updated={total['updated']}  removed={total['removed']}  "
+              f"files={total['total_files']}")
+        return result
+
+    await measure("initial import", importer.import_from_url("https://github.com/o/r"))
+    await measure("unchanged", importer.sync_github_repo("https://github.com/o/r"))
+
+    # Rename a few workflows, add a node to one, delete one file and add one
+    repo.edit(args.changed, "edited")
+    paths = sorted(repo.files)
+    data = json.loads(repo.files[paths[-1]])
+    data["nodes"].append({"name": "Extra", "type": "n8n-nodes-base.slack", "parameters": {}})
+    repo.files[paths[-1]] = json.dumps(data, indent=2).encode()
+    repo.files["workflows/new.json"] = repo.files.pop(paths[-2])
+    repo.commit()
+    await measure("incremental", importer.sync_github_repo("https://github.com/o/r"))
+    await measure("full re-import", importer.sync_github_repo("https://github.com/o/r", full=True))
+    stored = (await db.get_stats())["total_workflows"]
+    print(f"workflows stored: {stored} (files in repo: {len(repo.files)})")
+
+    if args.repos > 1:
+        per_repo = max(50, args.files // args.repos)
+        for n in range(1, args.repos):
+            gh.repos[f"r{n}"] = FakeRepo(f"r{n}", make_files(per_repo, salt=f"r{n}-"))
+        await measure(f"import {args.repos - 1} more repos", asyncio.gather(*(
+            importer.import_from_url(f"https://github.com/o/r{n}") for n in range(1, args.repos))))
+
+        concurrency = importer.SYNC_CONCURRENCY
+        for label, limit, tag in (("sync_all sequential", 1, "s1"), (f"sync_all x{concurrency}", concurrency, "s2")):
+            for fake in gh.repos.values():
+                fake.edit(args.changed, tag)
+            importer.SYNC_CONCURRENCY = limit
+            await measure(label, importer.sync_all_repos())
+
+    await importer.close_http()
+    server.shutdown()
+    await db.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
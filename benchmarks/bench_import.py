@@ -0,0 +1,66 @@
+"""
+Directory import benchmark: serial parsing vs the process-pool path.
+
+Generates N distinct workflow files from the bundled samples and imports them
+with import_from_directory(workers=1) and then with the parallel path, clearing
+the DB between runs. A final run re-imports the same directory, where every file
+is already stored and should be dropped by its hash before parsing.
+
+    python benchmarks/bench_import.py [--workflows 5000] [--workers 0]
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+
+import async_db as db  # noqa: E402
+import importer  # noqa: E402
+
+
+def make_workflow_dir(count):
+    samples = [f.read_text(encoding="utf-8") for f in sorted((ROOT / "data" / "workflows").glob("*.json"))]
+    out_dir = Path(_tmp) / "workflows"
+    out_dir.mkdir()
+    for i in range(count):
+        data = json.loads(samples[i % len(samples)])
+        if isinstance(data, list):
+            data = data[0]
+        data["name"] = f"{data.get('name', 'wf')} #{i}"
+        (out_dir / f"wf_{i:05d}.json").write_text(json.dumps(data), encoding="utf-8")
+    return out_dir
+
+
+def report(label, result):
+    print(f"{label:<10} workers={result['workers']:>2}  imported={result['imported']:>6}  "
+          f"skipped_early={result['skipped_early']:>6}  elapsed={result['elapsed_sec']:7.2f}s  files/s={result['files_per_sec']:>8}")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=5000)
+    ap.add_argument("--workers", type=int, default=0, help="0 = IMPORT_WORKERS / cpu_count")
+    args = ap.parse_args()
+
+    await db.init_db()
+    wf_dir = make_workflow_dir(args.workflows)
+
+    report("serial", await importer.import_from_directory(str(wf_dir), workers=1))
+    await db.clear_all_workflows()
+    report("parallel", await importer.import_from_directory(str(wf_dir), workers=args.workers or None))
+    report("re-import", await importer.import_from_directory(str(wf_dir), workers=args.workers or None))
+
+    await db.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Benchmark for packed analysis requests (ANALYSIS_PACK_SIZE) against the single-item path.
+
+The simulated provider takes a fixed time to first token plus time per generated
+token (both scaled by --time-scale so a run takes seconds), answers every workflow
+found in the prompt and leaves out a --drop share of packed items, which the
+worker then retries one by one. Tokens are counted as ~3 characters each on both
+the prompt and the answer. Each scenario drains the same queue, with the
+analysis cache cleared, and reports workflows/minute (in unscaled time) and
+tokens per workflow.
+
+    python benchmarks/bench_packing.py [--workflows 240] [--rpm 0] [--drop 0.03]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+
+import database  # noqa: E402
+import analyzer  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+from ratelimit import RateLimiter  # noqa: E402
+
+TTFT = 0.5             # seconds to first token
+OUTPUT_TOKENS_PER_S = 80
+_ITEM = re.compile(r"^Workflow (\d+):$", re.M)
+
+
+def answer(n, rng):
+    """A full-size bilingual analysis, like the ones the real prompt produces."""
+    return {
+        "usefulness": rng.randint(3, 9), "universality": rng.randint(3, 9),
+        "complexity": rng.randint(2, 8), "scalability": rng.randint(3, 9),
+        "suggested_name": f"Automated workflow {n}", "difficulty_level": "intermediate",
+        "tags": ["automation", "crm", "notifications", "sync"],
+        "uk": {"summary": "Воркфлоу автоматично збирає нові записи, збагачує їх даними та надсилає "
+                          "сповіщення команді, щоб нічого не загубилося між сервісами.",
+               "use_cases": ["Синхронізація лідів між CRM і таблицями", "Щоденні звіти для відділу продажів"],
+               "target_audience": "Малий бізнес і маркетингові команди",
+               "integrations_summary": "Поєднує CRM, Google Sheets і Slack"},
+        "en": {"summary": "The workflow collects new records, enriches them and notifies the team "
+                          "so nothing gets lost between services.",
+               "use_cases": ["Syncing leads between a CRM and spreadsheets", "Daily reports for the sales team"],
+               "target_audience": "Small businesses and marketing teams",
+               "integrations_summary": "Connects a CRM, Google Sheets and Slack"},
+    }
+
+
+class FakeProvider:
+    def __init__(self, rng, scale, drop):
+        self.rng, self.scale, self.drop = rng, scale, drop
+        self.calls = self.prompt_tokens = self.completion_tokens = 0
+
+    async def complete(self, messages):
+        prompt = messages[-1]["content"]
+        numbers = [int(n) for n in _ITEM.findall(prompt)]
+        if numbers:
+            items = [{"id": n, **answer(n, self.rng)} for n in numbers if self.rng.random() >= self.drop]
+            content = json.dumps({"results": items}, ensure_ascii=False)
+        else:
+            content = json.dumps(answer(0, self.rng), ensure_ascii=False)
+        prompt_tokens, completion_tokens = len(prompt) // 3, len(content) // 3
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        await asyncio.sleep((TTFT + completion_tokens / OUTPUT_TOKENS_PER_S) * self.scale)
+        return content, prompt_tokens + completion_tokens, {}
+
+
+def reset_analysis(conn):
+    conn.execute(f"UPDATE workflows SET {database._AI_RESET}")
+    conn.execute("DELETE FROM analysis_queue")
+    conn.execute("DELETE FROM analysis_cache")
+    conn.commit()
+
+
+async def drain(provider, pack_size, concurrency, rpm):
+    analyzer._complete = provider.complete
+    analyzer.ANALYSIS_PACK_SIZE = pack_size
+    analyzer.ANALYSIS_CONCURRENCY = concurrency
+    analyzer.limiter = RateLimiter(rpm, 0)
+    worker = asyncio.create_task(analyzer.run_worker())
+    t0 = time.perf_counter()
+    while True:
+        await asyncio.sleep(0.02)
+        status = database.get_analysis_queue_status()
+        if status["status"] == "idle" and status["queue"]["done"]:
+            break
+    elapsed = time.perf_counter() - t0
+    worker.cancel()
+    await asyncio.gather(worker, return_exceptions=True)
+    return elapsed, status
+
+
+async def run_scenarios(args):
+    scenarios = [("single", 1, args.concurrency)] + \
+                [(f"packed K={k}", k, args.concurrency) for k in (3, 5, 10)]
+    print(f"{'':<14} {'wf/min':>8} {'tokens/wf':>10} {'prompt/wf':>10} {'answer/wf':>10} "
+          f"{'requests':>9} {'done':>5} {'dead':>5}")
+    for label, pack_size, concurrency in scenarios:
+        database._writer.submit(reset_analysis)
+        provider = FakeProvider(random.Random(7), args.time_scale, args.drop)
+        elapsed, status = await drain(provider, pack_size, concurrency, args.rpm)
+        done = status["queue"]["done"]
+        per_minute = done / (elapsed / args.time_scale) * 60
+        print(f"{label:<14} {per_minute:8.0f} {(provider.prompt_tokens + provider.completion_tokens) / done:10.0f} "
+              f"{provider.prompt_tokens / done:10.0f} {provider.completion_tokens / done:10.0f} "
+              f"{provider.calls:9} {done:5} {status['queue']['dead']:5}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=240)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rpm", type=int, default=0, help="requests per minute in unscaled time (0: unlimited)")
+    ap.add_argument("--drop", type=float, default=0.03, help="share of packed items the model leaves out")
+    ap.add_argument("--time-scale", type=float, default=0.02)
+    args = ap.parse_args()
+    args.rpm = int(args.rpm / args.time_scale)
+
+    database.init_db()
+    rng = random.Random(42)
+    batch = []
+    for i in range(args.workflows):
+        data = {"name": f"bench {i}",
+                "nodes": [{"name": f"n{j}", "type": f"n8n-nodes-base.node{rng.randrange(60)}",
+                           "parameters": {"i": i, "j": j}} for j in range(rng.randint(3, 12))],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        wf["description"] = f"Benchmark workflow {i}: syncs records between services and notifies the team."
+        batch.append(wf)
+    database.insert_workflows_batch(batch)
+
+    limit = f"{args.rpm * args.time_scale:.0f} RPM" if args.rpm else "no RPM limit"
+    print(f"{args.workflows} workflows, concurrency {args.concurrency}, {limit}, "
+          f"{args.drop:.0%} of packed items dropped, time scale {args.time_scale}")
+    asyncio.run(run_scenarios(args))
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark for semantic search (sort=semantic) against FTS relevance.
+
+Generates workflows whose AI summaries mix two topics, each described with a
+random few of that topic's words ("stripe", "invoice", "billing"... or "slack",
+"alert", "notify"...). A query uses other words of two topics; the relevant
+workflows are the ones about both. Reports precision@20 for both modes, the share
+of relevant workflows sharing no word with the query that each mode returns at
+all (the paraphrase case FTS can't match), query latency, the vector index fit
+and reload times, and the cost of folding in new summaries.
+
+    python benchmarks/bench_semantic.py [--workflows 20000] [--queries 100]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+
+import database  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+from vectors import VectorIndex  # noqa: E402
+
+TOPICS = {
+    "payments": "stripe invoice billing payment paid charge refund subscription checkout receipt paypal revenue",
+    "alerts": "slack alert notify notification message channel telegram ping team warning discord announce",
+    "seo": "keyword serp ranking backlinks seo audit search console traffic competitor metadata crawl",
+    "crm": "hubspot lead contact deal pipeline salesforce prospect enrichment customer account crm",
+    "ai": "openai gpt llm agent chatbot embeddings prompt assistant summarize classify completion rag",
+    "sheets": "google sheets spreadsheet row append table airtable column export csv report",
+    "email": "gmail inbox email reply outlook newsletter mailbox smtp thread label draft",
+    "social": "twitter linkedin instagram post schedule publish facebook content tiktok social",
+}
+NOISE = "automatically daily every new when then from into with using data workflow process update".split()
+WORDS = {t: words.split() for t, words in TOPICS.items()}
+
+
+def make_summary(rng, topics):
+    words = [w for t in topics for w in rng.sample(WORDS[t], 3)] + rng.sample(NOISE, 3)
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=100)
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    database.init_db()
+    batch, docs = [], []
+    for i in range(args.workflows):
+        data = {"name": f"flow {i}", "nodes": [{"name": "n", "type": "n8n-nodes-base.set", "parameters": {"i": i}}],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        batch.append(wf)
+        topics = rng.sample(sorted(TOPICS), 2)
+        docs.append((set(topics), make_summary(rng, topics)))
+    ids = database.insert_workflows_batch(batch, return_ids=True)
+    for wf_id, (topics, summary) in zip(ids, docs):
+        database.update_workflow_ai(wf_id, 5, 5, 5, 5, summary, sorted(topics))
+    by_id = dict(zip(ids, docs))
+
+    t0 = time.perf_counter()
+    stats = database.warm_vector_index()
+    print(f"vector index fit ({args.workflows} workflows): {time.perf_counter() - t0:6.2f}s  {stats}")
+
+    t0 = time.perf_counter()
+    reloaded = VectorIndex(database.VECTOR_INDEX_DIR)
+    with database._readers.connection() as conn:
+        reloaded._load(conn)
+    print(f"vector index reload (mmap):            {(time.perf_counter() - t0) * 1000:6.1f}ms")
+
+    results = {"semantic": ([], [], []), "relevance": ([], [], [])}
+    for n in range(args.queries):
+        topics = rng.sample(sorted(TOPICS), 2)
+        query_words = [w for t in topics for w in rng.sample(WORDS[t], 2)]
+        relevant = {wf_id for wf_id, (t, _) in by_id.items() if t == set(topics)}
+        unmatched = {wf_id for wf_id in relevant if not set(by_id[wf_id][1].split()) & set(query_words)}
+        for sort, (precision, paraphrase, latency) in results.items():
+            t0 = time.perf_counter()
+            # Straight to the uncached search: every query is timed end to end
+            found = database._search_workflows(" ".join(query_words), sort=sort, per_page=20, count="none")
+            latency.append((time.perf_counter() - t0) * 1000)
+            precision.append(len({wf["id"] for wf in found["workflows"]} & relevant) / 20)
+            # Everything the mode returns, not just a page
+            everything = database._search_workflows(" ".join(query_words), sort=sort, per_page=100000, count="none")
+            paraphrase.append(len({wf["id"] for wf in everything["workflows"]} & unmatched) / max(1, len(unmatched)))
+    for sort, (precision, paraphrase, latency) in results.items():
+        print(f"{sort:<10} precision@20={sum(precision) / len(precision):.3f}  "
+              f"no-shared-word recall={sum(paraphrase) / len(paraphrase):.3f}  "
+              f"p50={percentile(latency, 50):6.2f}ms  p99={percentile(latency, 99):6.2f}ms")
+
+    # Fold-in: new summaries are searchable on the next query, without a refit
+    changed = rng.sample(ids, 200)
+    for wf_id in changed:
+        database.update_workflow_ai(wf_id, 5, 5, 5, 5, "stripe refund announce discord", ["payments"])
+    t0 = time.perf_counter()
+    found = database.search_workflows("stripe refund announce discord", sort="semantic", per_page=500)
+    print(f"fold-in of 200 new summaries + query:  {(time.perf_counter() - t0) * 1000:6.1f}ms  "
+          f"found {len(set(changed) & {wf['id'] for wf in found['workflows']})}/200  "
+          f"{database._vector_index.stats()}")
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
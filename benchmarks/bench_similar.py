@@ -0,0 +1,129 @@
+"""
+Benchmark for /api/workflow/{id}/similar.
+
+Generates workflows with random node types (Zipf-like: a few nodes are in most
+workflows, most are rare) and AI tags, then reports the similarity index build
+time, per-query latency, recall@k against a brute-force scan of every workflow,
+and the cost of catching up after an incremental insert and delete.
+
+    python benchmarks/bench_similar.py [--workflows 20000] [--queries 300] [--k 10]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+
+import database  # noqa: E402
+from importer import parse_workflow_json  # noqa: E402
+
+NODE_TYPES = [f"n8n-nodes-base.node{i}" for i in range(400)]
+TAGS = [f"tag{i}" for i in range(150)]
+
+
+def _zipf_pick(rng, items, k):
+    picked = set()
+    while len(picked) < k:
+        picked.add(items[min(len(items) - 1, int(rng.paretovariate(1.1)) - 1)])
+    return picked
+
+
+def make_workflows(count, rng):
+    out = []
+    for i in range(count):
+        types = _zipf_pick(rng, NODE_TYPES, rng.randint(3, 12))
+        data = {"name": f"bench #{i}",
+                # Distinct parameters keep the synthetic workflows out of each other's near-duplicate clusters
+                "nodes": [{"name": f"n{j}", "type": t, "parameters": {"url": f"https://x/{i}/{j}", "i": i, "j": j}}
+                          for j, t in enumerate(types)],
+                "connections": {}}
+        wf = parse_workflow_json(json.dumps(data))
+        wf["source_url"] = f"bench://{i}"
+        out.append(wf)
+    return out
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def brute_force(index, wf_id, k):
+    """Exact top-k by scoring every workflow in the index (what the index avoids doing)."""
+    query = set(index.features[wf_id])
+    w = index._weight
+    q_total = sum(w(f) for f in query)
+    scores = []
+    for other, feats in index.features.items():
+        if other == wf_id:
+            continue
+        inter = sum(w(f) for f in query.intersection(feats))
+        if inter:
+            scores.append((inter / (q_total + sum(w(f) for f in feats) - inter), other))
+    scores.sort(reverse=True)
+    return scores[:k]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workflows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    database.init_db()
+    ids = database.insert_workflows_batch(make_workflows(args.workflows, rng), return_ids=True)
+    for wf_id in ids[::2]:
+        database.update_workflow_ai(wf_id, 5, 5, 5, 5, "", sorted(_zipf_pick(rng, TAGS, rng.randint(2, 6))))
+
+    index = database._similarity_index
+    t0 = time.perf_counter()
+    database.get_similar_workflows(ids[0], limit=args.k)
+    print(f"index build ({args.workflows} workflows):  {(time.perf_counter() - t0) * 1000:8.1f}ms  "
+          f"{index.stats()}")
+
+    sample = rng.sample(ids, min(args.queries, len(ids)))
+    latencies, brute, recall = [], [], []
+    for wf_id in sample:
+        t0 = time.perf_counter()
+        found = index.similar(wf_id, args.k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        exact = brute_force(index, wf_id, args.k)
+        brute.append((time.perf_counter() - t0) * 1000)
+        if exact:
+            # Ties at the k-th score make any of them a correct answer (scores are rounded to 4 places)
+            cutoff = exact[-1][0] - 1e-4
+            recall.append(sum(score >= cutoff for _, score, _ in found) / len(exact))
+    print(f"index query     p50={percentile(latencies, 50):7.2f}ms  p99={percentile(latencies, 99):7.2f}ms")
+    print(f"brute force     p50={percentile(brute, 50):7.2f}ms  p99={percentile(brute, 99):7.2f}ms")
+    print(f"recall@{args.k}       {sum(recall) / len(recall):.3f}")
+
+    t0 = time.perf_counter()
+    api = [database.get_similar_workflows(wf_id, limit=args.k) for wf_id in sample[:100]]
+    print(f"get_similar_workflows (index + row fetch): {(time.perf_counter() - t0) * 10:.2f}ms/request, "
+          f"{sum(map(len, api)) / len(api):.1f} results")
+
+    new_ids = database.insert_workflows_batch(make_workflows(100, random.Random(7)), return_ids=True)
+    database.delete_workflow(ids[1])
+    t0 = time.perf_counter()
+    database.get_similar_workflows(ids[0], limit=args.k)
+    print(f"incremental refresh (+100, -1):  {(time.perf_counter() - t0) * 1000:6.2f}ms  {index.stats()}")
+    assert ids[1] not in index.features and all(i in index.features for i in new_ids if i)
+
+    database.close_db()
+
+
+if __name__ == "__main__":
+    main()
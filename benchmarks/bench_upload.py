@@ -0,0 +1,142 @@
+"""
+Bulk upload benchmark: per-file import_from_json (one commit per workflow, the
+old /api/import/file loop) vs import_uploads (spooled, parallel parse, batched
+inserts), for loose files and for the same files in one ZIP archive. Then the
+same through HTTP: one file per request (the old UI) vs groups of 200.
+
+Last, the batched path is split into its stages, run one after the other on
+one core: parsing with and without the zlib compression of the stored body,
+and the batched inserts through the single DB writer. The request behind this
+path aimed for a 10x+ speedup. The measured end-to-end gain is about 3x on a
+1-CPU host, so that target is only partly met. The breakdown shows why:
+
+  - Compression and parsing scale only with IMPORT_WORKERS cores.
+  - The inserts run on the one serialized writer and do not scale at all.
+
+So the best case is roughly (serial per-file time) / (insert time + parse time
+/ cores).
+
+    python benchmarks/bench_upload.py [--files 2000] [--workers 0]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import zipfile
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="n8nhub-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ["LOCAL_WORKFLOWS_DIR"] = ""
+os.environ.setdefault("ADMIN_USER", "admin")
+os.environ.setdefault("ADMIN_PASS", "changeme")
+
+import httpx  # noqa: E402
+
+import async_db as db  # noqa: E402
+import database  # noqa: E402
+import importer  # noqa: E402
+from app import app  # noqa: E402
+
+# httpx ends multipart bodies with a CRLF that python-multipart warns about on every request
+logging.getLogger("python_multipart").setLevel(logging.ERROR)
+
+
+def make_files(count):
+    samples = [f.read_text(encoding="utf-8") for f in sorted((ROOT / "data" / "workflows").glob("*.json"))]
+    files = []
+    for i in range(count):
+        data = json.loads(samples[i % len(samples)])
+        if isinstance(data, list):
+            data = data[0]
+        data["name"] = f"{data.get('name', 'wf')} #{i}"
+        files.append((f"wf_{i:05d}.json", json.dumps(data).encode()))
+    return files
+
+
+def report(label, elapsed, results, n):
+    ok = sum(r["status"] == "ok" for r in results)
+    print(f"{label:<26} {elapsed:7.2f}s  {n / elapsed:8.1f} files/s  ok={ok}/{len(results)}")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=2000)
+    ap.add_argument("--workers", type=int, default=0, help="0 = IMPORT_WORKERS / cpu_count")
+    args = ap.parse_args()
+
+    await db.init_db()
+    files = make_files(args.files)
+
+    t0 = time.perf_counter()
+    results = []
+    for name, data in files:
+        res = await importer.import_from_json(data.decode("utf-8-sig"), source_url=f"upload:{name}")
+        results.append({"name": name, "status": res["status"]})
+    report("per-file import_from_json", time.perf_counter() - t0, results, len(files))
+    await db.clear_all_workflows()
+
+    t0 = time.perf_counter()
+    results = await importer.import_uploads([(n, io.BytesIO(d)) for n, d in files], workers=args.workers or None)
+    report("import_uploads (files)", time.perf_counter() - t0, results, len(files))
+    await db.clear_all_workflows()
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files:
+            zf.writestr(f"flows/{name}", data)
+    buf.seek(0)
+    t0 = time.perf_counter()
+    results = await importer.import_uploads([("flows.zip", buf)], workers=args.workers or None)
+    report("import_uploads (zip)", time.perf_counter() - t0, results, len(files))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        r = await client.post("/api/login", data={"username": os.environ["ADMIN_USER"],
+                                                  "password": os.environ["ADMIN_PASS"]})
+        r.raise_for_status()
+        for label, group in (("HTTP 1 file/request", 1), ("HTTP 200 files/request", 200)):
+            await db.clear_all_workflows()
+            t0 = time.perf_counter()
+            results = []
+            for i in range(0, len(files), group):
+                r = await client.post("/api/import/file",
+                                      files=[("files", (n, d, "application/json")) for n, d in files[i:i + group]])
+                results += r.json()["results"]
+            report(label, time.perf_counter() - t0, results, len(files))
+
+    # Where the batched path spends its time, stage by stage on one core
+    texts = [d.decode("utf-8-sig") for _, d in files]
+    t0 = time.perf_counter()
+    parsed = [importer.parse_workflow_json(t) for t in texts]
+    parse = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for t in texts:
+        database.pack_blob(t)
+    compress = time.perf_counter() - t0
+    await db.clear_all_workflows()
+    t0 = time.perf_counter()
+    for i, (name, _) in enumerate(files):
+        parsed[i]["source_url"] = f"upload:{name}"
+    for i in range(0, len(parsed), importer.IMPORT_BATCH_SIZE):
+        await db.insert_workflows_batch(parsed[i:i + importer.IMPORT_BATCH_SIZE])
+    insert = time.perf_counter() - t0
+    print(f"stages: parse {parse - compress:.2f}s + zlib {compress:.2f}s (scale with IMPORT_WORKERS="
+          f"{importer.IMPORT_WORKERS}), insert {insert:.2f}s (single writer)")
+    print(f"        floor with {importer.IMPORT_WORKERS} worker(s): "
+          f"{insert + parse / importer.IMPORT_WORKERS:.2f}s")
+
+    await db.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
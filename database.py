@@ -1,30 +1,223 @@
 import sqlite3
 import json
 import os
+import zlib
+import base64
+import hashlib
+import queue
+import atexit
+import functools
 import threading
-from datetime import datetime
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from cache import TTLCache
+from facets import FacetIndex
+from similarity import SimilarityIndex
+from vectors import VectorIndex
+from fingerprint import NEAR_DUP_THRESHOLD, fingerprint_json, lsh_buckets, similarity
 
 DB_PATH = os.path.abspath(os.environ.get("DB_PATH", "./workflows.db"))
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", DB_PATH + ".vectors")
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT = 30  # seconds
 print(f"[DB] Using database at: {DB_PATH}")
 
-_local = threading.local()
 
+def _connect(read_only=False):
+    """Open a new connection with the standard pragmas applied."""
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    if not read_only:
+        # WAL lets readers keep working while the writer holds a transaction open
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class ReaderPool:
+    """Bounded pool of read-only connections, reused across threads."""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        _writer.start()  # make sure the schema/WAL exist before the first read
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _connect(read_only=True)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SerializedWriter:
+    """Single thread that owns the only read-write connection.
+    Every mutating call is queued and executed in order on that thread,
+    so writers never contend for the SQLite lock among themselves.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(conn, *args, **kwargs) on the writer thread and return its result."""
+        if threading.current_thread() is self._thread:
+            # Nested write from inside another write: run inline, same transaction
+            return fn(self._conn, *args, **kwargs)
+        self.start()
+        fut = Future()
+        self._queue.put((fut, fn, args, kwargs))
+        return fut.result()
+
+    def _run(self):
+        self._conn = _connect()
+        self._ready.set()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fut, fn, args, kwargs = item
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(self._conn, *args, **kwargs)
+                if self._conn.in_transaction:
+                    self._conn.commit()
+            except BaseException as e:
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+                fut.set_exception(e)
+            else:
+                fut.set_result(result)
+        self._conn.close()
+        self._conn = None
+
+    def stop(self):
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join()
+
+
+_writer = SerializedWriter()
+_readers = ReaderPool(DB_READ_POOL_SIZE)
+
+
+def _reads(fn):
+    """Run the wrapped function with a pooled read-only connection as first argument."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _readers.connection() as conn:
+            return fn(conn, *args, **kwargs)
+    return wrapper
+
+
+def _writes(fn):
+    """Run the wrapped function on the writer thread with the write connection as first argument."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return _writer.submit(fn, *args, **kwargs)
+    return wrapper
+
+
+# Cached reads are keyed on the data generation, which every workflow write in this process
+# bumps, and on the change log position (_change_seq), which inserts, deletes, renames and new
+# analyses move in any process. Other writes made by another process (e.g. a description-only
+# upsert) show up once the entry's CACHE_TTL runs out.
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "60"))
+_search_cache = TTLCache(int(os.environ.get("CACHE_SEARCH_SIZE", "512")), CACHE_TTL)
+_workflow_cache = TTLCache(int(os.environ.get("CACHE_WORKFLOW_SIZE", "1024")), CACHE_TTL)
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def data_generation():
+    return _generation
+
+
+def _bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    _search_cache.clear()
+    _workflow_cache.clear()
+
+
+def _invalidates(fn):
+    """Bump the data generation once the wrapped write has finished (committed or not)."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _bump_generation()
+    return wrapper
+
+
+def get_cache_stats():
+    return {
+        "generation": _generation,
+        "search": _search_cache.stats(),
+        "workflow": _workflow_cache.stats(),
+    }
+
+
+def close_db():
+    """Stop the writer thread and close all pooled connections."""
+    _writer.stop()
+    _readers.close()
 
-def get_db():
-    """Get a thread-local database connection (reused per thread)."""
-    if not hasattr(_local, "conn") or _local.conn is None:
-        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=DELETE")
-        conn.execute("PRAGMA foreign_keys=ON")
-        conn.execute("PRAGMA synchronous=NORMAL")
-        _local.conn = conn
-    return _local.conn
 
+atexit.register(close_db)
 
-def init_db():
-    conn = get_db()
+
+@_writes
+def init_db(conn):
     
     # 1. Essential Tables
     statements = [
@@ -39,6 +232,7 @@ def init_db():
             source_url TEXT DEFAULT '',
             source_repo TEXT DEFAULT '',
             json_content TEXT NOT NULL,
+            blob_hash TEXT DEFAULT '',
             json_hash TEXT UNIQUE NOT NULL,
             added_at TEXT NOT NULL,
             updated_at TEXT NOT NULL,
@@ -63,7 +257,9 @@ def init_db():
             repo_url TEXT UNIQUE NOT NULL,
             last_synced TEXT,
             workflow_count INTEGER DEFAULT 0,
-            enabled INTEGER DEFAULT 1
+            enabled INTEGER DEFAULT 1,
+            branch TEXT DEFAULT '',
+            last_commit_sha TEXT DEFAULT ''
         )""",
         """CREATE TABLE IF NOT EXISTS workflow_nodes (
             workflow_id INTEGER NOT NULL,
@@ -114,7 +310,9 @@ def init_db():
     # 2. Indices
     statements += [
         "CREATE INDEX IF NOT EXISTS idx_wn_name ON workflow_nodes(node_name)",
-        "CREATE INDEX IF NOT EXISTS idx_wc_name ON workflow_categories(category_name)"
+        "CREATE INDEX IF NOT EXISTS idx_wc_name ON workflow_categories(category_name)",
+        "CREATE INDEX IF NOT EXISTS idx_wf_source_url ON workflows(source_url)",
+        "CREATE INDEX IF NOT EXISTS idx_wf_source_repo ON workflows(source_repo)"
     ]
     
     # 3. FTS & Triggers
@@ -141,7 +339,10 @@ def init_db():
                 old.ai_summary, old.ai_tags, old.ai_use_cases, old.ai_target_audience, old.ai_integrations_summary,
                 old.ai_summary_en, old.ai_use_cases_en, old.ai_target_audience_en, old.ai_integrations_summary_en);
         END""",
-        """CREATE TRIGGER IF NOT EXISTS workflows_au AFTER UPDATE ON workflows BEGIN
+        """CREATE TRIGGER IF NOT EXISTS workflows_au AFTER UPDATE OF name, description, nodes, categories,
+            ai_summary, ai_tags, ai_use_cases, ai_target_audience, ai_integrations_summary,
+            ai_summary_en, ai_use_cases_en, ai_target_audience_en, ai_integrations_summary_en
+            ON workflows BEGIN
             INSERT INTO workflows_fts(workflows_fts, rowid, name, description, nodes, categories, 
                 ai_summary, ai_tags, ai_use_cases, ai_target_audience, ai_integrations_summary,
                 ai_summary_en, ai_use_cases_en, ai_target_audience_en, ai_integrations_summary_en)
@@ -166,42 +367,51 @@ def init_db():
     conn.commit()
     print("[DB] Schema verification complete")
     
-    _migrate_ai_columns()
-    _migrate_lookup_tables()
-    _migrate_user_tables()
-
-
-def _migrate_ai_columns():
+    _migrate_ai_columns(conn)
+    _migrate_lookup_tables(conn)
+    _migrate_user_tables(conn)
+    _migrate_stats(conn)
+    _migrate_blobs(conn)
+    _migrate_github_sync(conn)
+    _migrate_import_jobs(conn)
+    _migrate_clusters(conn)
+    _migrate_similarity(conn)
+    _migrate_analysis_queue(conn)
+    _migrate_analysis_batches(conn)
+    _migrate_analysis_cache(conn)
+
+
+AI_COLUMNS = {
+    "ai_usefulness": "INTEGER DEFAULT 0",
+    "ai_universality": "INTEGER DEFAULT 0",
+    "ai_complexity": "INTEGER DEFAULT 0",
+    "ai_scalability": "INTEGER DEFAULT 0",
+    "ai_summary": "TEXT DEFAULT ''",
+    "ai_tags": "TEXT DEFAULT '[]'",
+    "ai_use_cases": "TEXT DEFAULT '[]'",
+    "ai_target_audience": "TEXT DEFAULT ''",
+    "ai_integrations_summary": "TEXT DEFAULT ''",
+    "ai_summary_en": "TEXT DEFAULT ''",
+    "ai_use_cases_en": "TEXT DEFAULT '[]'",
+    "ai_target_audience_en": "TEXT DEFAULT ''",
+    "ai_integrations_summary_en": "TEXT DEFAULT ''",
+    "ai_difficulty_level": "TEXT DEFAULT ''",
+    "ai_analyzed_at": "TEXT DEFAULT ''",
+}
+
+
+def _migrate_ai_columns(conn):
     """Add AI analysis columns to existing workflows table if missing."""
-    conn = get_db()
     cursor = conn.execute("PRAGMA table_info(workflows)")
     columns = {row[1] for row in cursor.fetchall()}
-    ai_columns = {
-        "ai_usefulness": "INTEGER DEFAULT 0",
-        "ai_universality": "INTEGER DEFAULT 0",
-        "ai_complexity": "INTEGER DEFAULT 0",
-        "ai_scalability": "INTEGER DEFAULT 0",
-        "ai_summary": "TEXT DEFAULT ''",
-        "ai_tags": "TEXT DEFAULT '[]'",
-        "ai_use_cases": "TEXT DEFAULT '[]'",
-        "ai_target_audience": "TEXT DEFAULT ''",
-        "ai_integrations_summary": "TEXT DEFAULT ''",
-        "ai_summary_en": "TEXT DEFAULT ''",
-        "ai_use_cases_en": "TEXT DEFAULT '[]'",
-        "ai_target_audience_en": "TEXT DEFAULT ''",
-        "ai_integrations_summary_en": "TEXT DEFAULT ''",
-        "ai_difficulty_level": "TEXT DEFAULT ''",
-        "ai_analyzed_at": "TEXT DEFAULT ''",
-    }
-    for col, col_type in ai_columns.items():
+    for col, col_type in AI_COLUMNS.items():
         if col not in columns:
             conn.execute(f"ALTER TABLE workflows ADD COLUMN {col} {col_type}")
     conn.commit()
 
 
-def _migrate_lookup_tables():
+def _migrate_lookup_tables(conn):
     """Populate lookup tables from existing workflow data if empty."""
-    conn = get_db()
     node_count = conn.execute("SELECT COUNT(*) FROM workflow_nodes").fetchone()[0]
     if node_count > 0:
         return
@@ -218,80 +428,632 @@ def _migrate_lookup_tables():
     conn.commit()
 
 
-def insert_workflow(name, description, nodes, categories, node_count,
-                    trigger_type, source_url, source_repo, json_content, json_hash):
-    conn = get_db()
-    now = datetime.utcnow().isoformat()
-    try:
-        cursor = conn.execute("""
-            INSERT INTO workflows (name, description, nodes, categories, node_count,
-                trigger_type, source_url, source_repo, json_content, json_hash, added_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (name, description, json.dumps(nodes), json.dumps(categories),
-              node_count, trigger_type, source_url, source_repo, json_content, json_hash, now, now))
-        wf_id = cursor.lastrowid
-
-        nodes_list = nodes if isinstance(nodes, list) else json.loads(nodes)
-        for node in nodes_list:
-            conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node))
-        cats_list = categories if isinstance(categories, list) else json.loads(categories)
-        for cat in cats_list:
-            conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat))
+def _migrate_github_sync(conn):
+    """Add incremental-sync state to github_repos and the per-file manifest table."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(github_repos)").fetchall()}
+    for col in ("branch", "last_commit_sha"):
+        if col not in columns:
+            conn.execute(f"ALTER TABLE github_repos ADD COLUMN {col} TEXT DEFAULT ''")
+    # path -> git blob sha of every JSON file seen at last_commit_sha
+    conn.execute("""CREATE TABLE IF NOT EXISTS github_repo_files (
+        repo_url TEXT NOT NULL,
+        path TEXT NOT NULL,
+        blob_sha TEXT NOT NULL,
+        PRIMARY KEY (repo_url, path)
+    ) WITHOUT ROWID""")
+    conn.commit()
+
+# ==================== Materialized stats ====================
+# get_stats() reads one row from workflow_stats; triggers keep it current on every
+# insert/update/delete, and node_usage tracks per-node workflow counts for unique_nodes.
+
+_ANALYZED = ("(CASE WHEN {r}.ai_analyzed_at != '' AND {r}.ai_analyzed_at IS NOT NULL AND {r}.ai_usefulness > 0 "
+             "AND {r}.ai_summary_en != '' AND {r}.ai_summary_en IS NOT NULL THEN 1 ELSE 0 END)")
+_SCORED = "(CASE WHEN {r}.ai_analyzed_at != '' AND {r}.ai_usefulness > 0 THEN 1 ELSE 0 END)"
+# w is the oldest unanalyzed member of its cluster that analysis hasn't given up on: a
+# dead-lettered member passes the cluster on to the next one instead of holding it back
+_CLUSTER_HEAD = f"""NOT EXISTS (SELECT 1 FROM workflows s WHERE s.cluster_id = w.cluster_id AND s.id < w.id
+                          AND {_ANALYZED.format(r="s")} = 0
+                          AND NOT EXISTS (SELECT 1 FROM analysis_queue dq
+                                          WHERE dq.workflow_id = s.id AND dq.state = 'dead'))"""
+
+
+def _stats_delta(r, sign):
+    a, s = _ANALYZED.format(r=r), _SCORED.format(r=r)
+    return (f"analyzed_count = analyzed_count {sign} {a}, "
+            f"usefulness_sum = usefulness_sum {sign} {s} * {r}.ai_usefulness, "
+            f"usefulness_n = usefulness_n {sign} {s}")
+
+
+def _migrate_stats(conn):
+    """Create the stats tables/triggers and seed them if missing."""
+    statements = [
+        """CREATE TABLE IF NOT EXISTS workflow_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_workflows INTEGER DEFAULT 0,
+            total_repos INTEGER DEFAULT 0,
+            unique_nodes INTEGER DEFAULT 0,
+            analyzed_count INTEGER DEFAULT 0,
+            usefulness_sum INTEGER DEFAULT 0,
+            usefulness_n INTEGER DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS node_usage (
+            node_name TEXT PRIMARY KEY,
+            workflow_count INTEGER NOT NULL DEFAULT 0
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_wf_ai AFTER INSERT ON workflows BEGIN
+            UPDATE workflow_stats SET total_workflows = total_workflows + 1, {_stats_delta("new", "+")} WHERE id = 1;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_wf_ad AFTER DELETE ON workflows BEGIN
+            UPDATE workflow_stats SET total_workflows = total_workflows - 1, {_stats_delta("old", "-")} WHERE id = 1;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_wf_au AFTER UPDATE OF ai_analyzed_at, ai_usefulness, ai_summary_en
+            ON workflows BEGIN
+            UPDATE workflow_stats SET {_stats_delta("old", "-")} WHERE id = 1;
+            UPDATE workflow_stats SET {_stats_delta("new", "+")} WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_repo_ai AFTER INSERT ON github_repos BEGIN
+            UPDATE workflow_stats SET total_repos = total_repos + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_repo_ad AFTER DELETE ON github_repos BEGIN
+            UPDATE workflow_stats SET total_repos = total_repos - 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_wn_ai AFTER INSERT ON workflow_nodes BEGIN
+            INSERT OR IGNORE INTO node_usage (node_name, workflow_count) VALUES (new.node_name, 0);
+            UPDATE node_usage SET workflow_count = workflow_count + 1 WHERE node_name = new.node_name;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_wn_ad AFTER DELETE ON workflow_nodes BEGIN
+            UPDATE node_usage SET workflow_count = workflow_count - 1 WHERE node_name = old.node_name;
+            DELETE FROM node_usage WHERE node_name = old.node_name AND workflow_count <= 0;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_nu_ai AFTER INSERT ON node_usage BEGIN
+            UPDATE workflow_stats SET unique_nodes = unique_nodes + 1 WHERE id = 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stats_nu_ad AFTER DELETE ON node_usage BEGIN
+            UPDATE workflow_stats SET unique_nodes = unique_nodes - 1 WHERE id = 1;
+        END""",
+    ]
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+    if not conn.execute("SELECT 1 FROM workflow_stats WHERE id = 1").fetchone():
+        rebuild_stats()
+
+
+def _compute_stats(conn):
+    """Recompute every counter from scratch (full scans)."""
+    row = conn.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM({_ANALYZED.format(r="w")}), 0),
+               COALESCE(SUM({_SCORED.format(r="w")} * w.ai_usefulness), 0),
+               COALESCE(SUM({_SCORED.format(r="w")}), 0)
+        FROM workflows w
+    """).fetchone()
+    return {
+        "total_workflows": row[0],
+        "total_repos": conn.execute("SELECT COUNT(*) FROM github_repos").fetchone()[0],
+        "unique_nodes": conn.execute("SELECT COUNT(DISTINCT node_name) FROM workflow_nodes").fetchone()[0],
+        "analyzed_count": row[1],
+        "usefulness_sum": row[2],
+        "usefulness_n": row[3],
+    }
+
+
+@_writes
+def rebuild_stats(conn):
+    """Recompute workflow_stats and node_usage from the base tables."""
+    conn.execute("DELETE FROM node_usage")
+    conn.execute("""
+        INSERT INTO node_usage (node_name, workflow_count)
+        SELECT node_name, COUNT(*) FROM workflow_nodes GROUP BY node_name
+    """)
+    s = _compute_stats(conn)
+    conn.execute("""
+        INSERT OR REPLACE INTO workflow_stats (id, total_workflows, total_repos, unique_nodes,
+            analyzed_count, usefulness_sum, usefulness_n)
+        VALUES (1, ?, ?, ?, ?, ?, ?)
+    """, (s["total_workflows"], s["total_repos"], s["unique_nodes"],
+          s["analyzed_count"], s["usefulness_sum"], s["usefulness_n"]))
+    conn.commit()
+    print(f"[DB] Stats rebuilt: {s}")
+    return s
+
+
+@_reads
+def verify_stats(conn):
+    """Compare the materialized counters with a full recomputation."""
+    row = conn.execute("SELECT * FROM workflow_stats WHERE id = 1").fetchone()
+    stored = {k: row[k] for k in row.keys() if k != "id"} if row else {}
+    actual = _compute_stats(conn)
+    return {"ok": stored == actual, "stored": stored, "actual": actual}
+
+# ==================== Workflow bodies ====================
+# Full n8n JSON is stored once per content hash, zlib-compressed, in workflow_blobs.
+# workflows.blob_hash references it and workflows.json_content stays '' so metadata
+# scans never page the bodies in. Blobs are dropped when their last reference goes.
+
+def pack_blob(json_str):
+    """Return (sha256 hex, zlib-compressed bytes, uncompressed size) for a workflow body."""
+    data = (json_str or "").encode("utf-8")
+    return hashlib.sha256(data).hexdigest(), zlib.compress(data, 6), len(data)
 
+
+def _store_blob(conn, blob_hash, blob, size):
+    conn.execute("INSERT OR IGNORE INTO workflow_blobs (hash, data, size) VALUES (?, ?, ?)",
+                 (blob_hash, blob, size))
+
+
+def _migrate_blobs(conn):
+    """Create the blob table and move inline json_content of existing rows into it."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(workflows)").fetchall()}
+    if "blob_hash" not in columns:
+        conn.execute("ALTER TABLE workflows ADD COLUMN blob_hash TEXT DEFAULT ''")
+    statements = [
+        """CREATE TABLE IF NOT EXISTS workflow_blobs (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_wf_blob ON workflows(blob_hash)",
+        """CREATE TRIGGER IF NOT EXISTS blobs_wf_ad AFTER DELETE ON workflows
+            WHEN old.blob_hash != '' AND NOT EXISTS (SELECT 1 FROM workflows WHERE blob_hash = old.blob_hash)
+        BEGIN
+            DELETE FROM workflow_blobs WHERE hash = old.blob_hash;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS blobs_wf_au AFTER UPDATE OF blob_hash ON workflows
+            WHEN old.blob_hash != '' AND old.blob_hash != new.blob_hash
+                AND NOT EXISTS (SELECT 1 FROM workflows WHERE blob_hash = old.blob_hash)
+        BEGIN
+            DELETE FROM workflow_blobs WHERE hash = old.blob_hash;
+        END""",
+    ]
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+    # Only touch the FTS index when indexed columns change (the old trigger fired on any UPDATE)
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'workflows_au'").fetchone()
+    if row and "UPDATE OF" not in row[0]:
+        conn.execute("DROP TRIGGER workflows_au")
+        conn.execute(row[0].replace("AFTER UPDATE ON workflows",
+                                    f"AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON workflows", 1))
         conn.commit()
-        return wf_id
-    except sqlite3.IntegrityError:
+
+    moved = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, json_content FROM workflows
+            WHERE blob_hash = '' OR blob_hash IS NULL LIMIT 500
+        """).fetchall()
+        if not rows:
+            break
+        for r in rows:
+            blob_hash, blob, size = pack_blob(r["json_content"])
+            _store_blob(conn, blob_hash, blob, size)
+            conn.execute("UPDATE workflows SET blob_hash = ?, json_content = '' WHERE id = ?", (blob_hash, r["id"]))
+        conn.commit()
+        moved += len(rows)
+    if moved:
+        print(f"[DB] Moved {moved} workflow bodies into workflow_blobs, compacting database...")
+        conn.execute("VACUUM")
+
+
+# ==================== Near-duplicate clusters ====================
+# workflows.structure_hash is the canonical structural hash (fingerprint.py) and
+# workflows.cluster_id the id of the cluster's representative (its oldest member,
+# so cluster_id = id for singletons). MinHash signatures live in workflow_minhash
+# and their LSH band buckets in workflow_lsh, which is the candidate index.
+
+CLUSTER_CANDIDATE_LIMIT = 200  # signatures compared per new workflow
+
+
+def _migrate_clusters(conn):
+    """Add fingerprint columns and tables, then fingerprint and cluster existing rows."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(workflows)").fetchall()}
+    if "structure_hash" not in columns:
+        conn.execute("ALTER TABLE workflows ADD COLUMN structure_hash TEXT DEFAULT ''")
+    if "cluster_id" not in columns:
+        conn.execute("ALTER TABLE workflows ADD COLUMN cluster_id INTEGER")
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_wf_structure ON workflows(structure_hash)",
+        "CREATE INDEX IF NOT EXISTS idx_wf_cluster ON workflows(cluster_id)",
+        """CREATE TABLE IF NOT EXISTS workflow_minhash (
+            workflow_id INTEGER PRIMARY KEY REFERENCES workflows(id) ON DELETE CASCADE,
+            signature BLOB NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS workflow_lsh (
+            bucket INTEGER NOT NULL,
+            workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+            PRIMARY KEY (bucket, workflow_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_lsh_workflow ON workflow_lsh(workflow_id)",
+        # Deleting a representative hands the cluster to its next-oldest member
+        """CREATE TRIGGER IF NOT EXISTS clusters_wf_ad AFTER DELETE ON workflows WHEN old.cluster_id = old.id BEGIN
+            UPDATE workflows SET cluster_id = (SELECT MIN(id) FROM workflows WHERE cluster_id = old.id)
+            WHERE cluster_id = old.id;
+        END""",
+    ]
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+    done = 0
+    while True:
+        rows = conn.execute("""
+            SELECT w.id, w.json_hash, w.json_content, b.data FROM workflows w
+            LEFT JOIN workflow_blobs b ON b.hash = w.blob_hash
+            WHERE w.structure_hash = '' OR w.structure_hash IS NULL ORDER BY w.id LIMIT 500
+        """).fetchall()
+        if not rows:
+            break
+        if not done:
+            print("[DB] Fingerprinting workflows for near-duplicate clustering...")
+        for r in rows:
+            body = zlib.decompress(r["data"]).decode("utf-8") if r["data"] is not None else r["json_content"]
+            structure_hash, signature = fingerprint_json(body)
+            _assign_cluster(conn, r["id"], structure_hash or r["json_hash"], signature)
+        conn.commit()
+        done += len(rows)
+    if done:
+        print(f"[DB] Fingerprinted {done} workflows")
+
+
+def _assign_cluster(conn, wf_id, structure_hash, signature):
+    """Store a workflow's fingerprint and put it in the cluster of its closest near-duplicate
+    (an exact structure_hash match first, then the most similar LSH candidate at or above
+    NEAR_DUP_THRESHOLD), or in a cluster of its own.
+    """
+    cluster = None
+    row = conn.execute("SELECT cluster_id FROM workflows WHERE structure_hash = ? AND id != ? "
+                       "AND cluster_id IS NOT NULL ORDER BY id LIMIT 1", (structure_hash, wf_id)).fetchone()
+    if row:
+        cluster = row[0]
+
+    buckets = lsh_buckets(signature)
+    if cluster is None and buckets:
+        candidates = conn.execute(f"""
+            SELECT w.cluster_id, m.signature FROM workflow_minhash m JOIN workflows w ON w.id = m.workflow_id
+            WHERE m.workflow_id IN (SELECT workflow_id FROM workflow_lsh WHERE bucket IN ({", ".join("?" * len(buckets))}))
+              AND m.workflow_id != ? AND w.cluster_id IS NOT NULL
+            LIMIT ?
+        """, buckets + [wf_id, CLUSTER_CANDIDATE_LIMIT]).fetchall()
+        best = NEAR_DUP_THRESHOLD
+        for cand_cluster, cand_sig in candidates:
+            score = similarity(signature, cand_sig)
+            if score >= best:
+                cluster, best = cand_cluster, score
+
+    old = conn.execute("SELECT cluster_id FROM workflows WHERE id = ?", (wf_id,)).fetchone()[0]
+    if old == wf_id and cluster not in (None, wf_id):
+        # A representative moving to another cluster hands its old cluster to the next-oldest member
+        conn.execute("""UPDATE workflows SET cluster_id = (SELECT MIN(id) FROM workflows WHERE cluster_id = ? AND id != ?)
+                        WHERE cluster_id = ? AND id != ?""", (wf_id, wf_id, wf_id, wf_id))
+    conn.execute("UPDATE workflows SET structure_hash = ?, cluster_id = ? WHERE id = ?",
+                 (structure_hash, cluster or wf_id, wf_id))
+
+    conn.execute("DELETE FROM workflow_lsh WHERE workflow_id = ?", (wf_id,))
+    if signature:
+        conn.execute("INSERT OR REPLACE INTO workflow_minhash (workflow_id, signature) VALUES (?, ?)",
+                     (wf_id, signature))
+        conn.executemany("INSERT OR IGNORE INTO workflow_lsh (bucket, workflow_id) VALUES (?, ?)",
+                         [(b, wf_id) for b in buckets])
+    else:
+        conn.execute("DELETE FROM workflow_minhash WHERE workflow_id = ?", (wf_id,))
+
+
+def _fingerprint_of(wf):
+    """(structure_hash, signature) of a parsed workflow, computed from json_content if the parser didn't."""
+    if wf.get("structure_hash"):
+        return wf["structure_hash"], wf.get("minhash") or b""
+    structure_hash, signature = fingerprint_json(wf.get("json_content", ""))
+    return structure_hash or wf["json_hash"], signature
+
+
+@_invalidates
+@_writes
+def copy_cluster_analysis(conn):
+    """Give unanalyzed workflows the AI analysis of an analyzed member of their cluster,
+    preferring an exact structural match. Returns the number of workflows filled in.
+    """
+    cols = [c for c in AI_COLUMNS if c != "ai_analyzed_at"]
+    now = datetime.utcnow().isoformat()
+    copied = 0
+    # Two passes because SQLite can't order the source subquery by the outer row
+    for match in ("s.structure_hash = w.structure_hash", "s.cluster_id = w.cluster_id"):
+        source = f"{match} AND s.id != w.id AND {_ANALYZED.format(r='s')} = 1"
+        copied += conn.execute(f"""
+            UPDATE workflows AS w SET ({", ".join(cols)}) = (
+                SELECT {", ".join("s." + c for c in cols)} FROM workflows s
+                WHERE {source} ORDER BY s.id LIMIT 1
+            ), ai_analyzed_at = ?
+            WHERE {_ANALYZED.format(r="w")} = 0 AND w.cluster_id IS NOT NULL
+              AND EXISTS (SELECT 1 FROM workflows s WHERE {source})
+        """, (now,)).rowcount
+    conn.commit()
+    return copied
+
+
+
+# ==================== Similar workflows ====================
+# similarity.SimilarityIndex keeps an in-memory inverted index over node types and
+# AI tags, vectors.VectorIndex the semantic search vectors. workflow_changes is
+# their change log: one row per workflow, re-stamped with the next seq whenever
+# the workflow is inserted, deleted or gets a new name, nodes, tags or summary, so
+# each index only reloads the rows changed since its last refresh.
+
+# Columns the similarity and vector indexes are built from
+_LOGGED_COLUMNS = ("name", "nodes", "ai_tags", "ai_summary", "ai_summary_en")
+
+
+def _migrate_similarity(conn):
+    """Create the change log the similarity and vector indexes catch up from."""
+    # DELETE + INSERT rather than INSERT OR REPLACE: a trigger inherits the conflict policy of the
+    # statement that fired it, so under UPDATE OR IGNORE the REPLACE would silently do nothing.
+    # AUTOINCREMENT keeps seq growing even when the newest row is the one deleted.
+    log = "DELETE FROM workflow_changes WHERE workflow_id = {r}.id; " \
+          "INSERT INTO workflow_changes (workflow_id) VALUES ({r}.id)"
+    statements = [
+        """CREATE TABLE IF NOT EXISTS workflow_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            workflow_id INTEGER NOT NULL UNIQUE
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS changes_wf_ai AFTER INSERT ON workflows BEGIN
+            {log.format(r="new")};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS changes_wf_ad AFTER DELETE ON workflows BEGIN
+            {log.format(r="old")};
+        END""",
+        # Recreated so databases from before the vector index also log name/summary changes
+        "DROP TRIGGER IF EXISTS changes_wf_au",
+        f"""CREATE TRIGGER changes_wf_au AFTER UPDATE OF {", ".join(_LOGGED_COLUMNS)} ON workflows
+            WHEN {" OR ".join(f"old.{c} IS NOT new.{c}" for c in _LOGGED_COLUMNS)} BEGIN
+            {log.format(r="new")};
+        END""",
+    ]
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+
+def _change_seq(conn):
+    """Position of the change log. Unlike _generation it also moves on writes made by other
+    processes, so the indexes below use it to decide when to catch up."""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM workflow_changes").fetchone()[0]
+
+
+@_reads
+def _current_change_seq(conn):
+    return _change_seq(conn)
+
+
+_similarity_index = SimilarityIndex()
+SIMILAR_CANDIDATES = 3  # index results fetched per requested one, to leave room for collapsing clusters
+
+
+@_reads
+def get_similar_workflows(conn, wf_id, limit=10):
+    """Top `limit` workflows sharing the most (IDF-weighted) node types and AI tags with wf_id,
+    one per near-duplicate cluster and excluding wf_id's own cluster. None if wf_id doesn't exist.
+    """
+    row = conn.execute("SELECT cluster_id FROM workflows WHERE id = ?", (wf_id,)).fetchone()
+    if not row:
+        return None
+    _similarity_index.ensure_fresh(conn, _change_seq(conn))
+    ranked = _similarity_index.similar(wf_id, limit * SIMILAR_CANDIDATES)
+    if not ranked:
+        return []
+    rows = {r["id"]: r for r in conn.execute(f"""
+        SELECT id, name, description, nodes, categories, node_count, trigger_type, source_repo,
+               cluster_id, ai_usefulness, ai_summary, ai_summary_en, ai_tags, ai_difficulty_level
+        FROM workflows WHERE id IN ({", ".join("?" * len(ranked))})
+    """, [r[0] for r in ranked])}
+
+    result, seen = [], {row[0] or wf_id}
+    for other, score, shared in ranked:
+        r = rows.get(other)
+        if r is None or (r["cluster_id"] or other) in seen:
+            continue
+        seen.add(r["cluster_id"] or other)
+        wf = _parse_json_fields(dict(r))
+        wf["similarity"] = score
+        wf["shared"] = shared
+        result.append(wf)
+        if len(result) >= limit:
+            break
+    return result
+
+
+# Columns the AI prompt is built from; a change here invalidates the analysis
+_STRUCTURE_FIELDS = ("nodes", "categories", "node_count", "trigger_type")
+_AI_RESET = ", ".join(f"{col} = {spec.split(' DEFAULT ', 1)[1]}" for col, spec in AI_COLUMNS.items())
+
+
+def _insert_parsed(conn, wf, now):
+    """Insert one parsed workflow. Returns its id, or None if the json_hash already exists."""
+    blob_hash, blob, size = wf.get("blob") or pack_blob(wf["json_content"])
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO workflows (name, description, nodes, categories, node_count,
+            trigger_type, source_url, source_repo, json_content, blob_hash, json_hash, added_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, '', ?, ?, ?, ?)
+    """, (wf["name"], wf["description"],
+          json.dumps(wf["nodes"]), json.dumps(wf["categories"]),
+          wf["node_count"], wf["trigger_type"],
+          wf.get("source_url", ""), wf.get("source_repo", ""),
+          blob_hash, wf["json_hash"], now, now))
+    if not cursor.rowcount:
+        return None
+    wf_id = cursor.lastrowid
+    _store_blob(conn, blob_hash, blob, size)
+    _set_lookup_rows(conn, wf_id, wf["nodes"], wf["categories"])
+    _assign_cluster(conn, wf_id, *_fingerprint_of(wf))
+    return wf_id
+
+
+def _set_lookup_rows(conn, wf_id, nodes, categories, replace=False):
+    if replace:
+        conn.execute("DELETE FROM workflow_nodes WHERE workflow_id = ?", (wf_id,))
+        conn.execute("DELETE FROM workflow_categories WHERE workflow_id = ?", (wf_id,))
+    for node in nodes:
+        conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node))
+    for cat in categories:
+        conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat))
+
+
+@_invalidates
+@_writes
+def insert_workflow(conn, name, description, nodes, categories, node_count,
+                    trigger_type, source_url, source_repo, json_content, json_hash,
+                    structure_hash="", minhash=b""):
+    now = datetime.utcnow().isoformat()
+    blob_hash, blob, size = pack_blob(json_content)
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO workflows (name, description, nodes, categories, node_count,
+            trigger_type, source_url, source_repo, json_content, blob_hash, json_hash, added_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, '', ?, ?, ?, ?)
+    """, (name, description, json.dumps(nodes), json.dumps(categories),
+          node_count, trigger_type, source_url, source_repo, blob_hash, json_hash, now, now))
+    if not cursor.rowcount:
+        # Duplicate json_hash
         conn.rollback()
         return None
+    wf_id = cursor.lastrowid
+    _store_blob(conn, blob_hash, blob, size)
+
+    nodes_list = nodes if isinstance(nodes, list) else json.loads(nodes)
+    for node in nodes_list:
+        conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node))
+    cats_list = categories if isinstance(categories, list) else json.loads(categories)
+    for cat in cats_list:
+        conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat))
+    _assign_cluster(conn, wf_id, *_fingerprint_of({"structure_hash": structure_hash, "minhash": minhash,
+                                                   "json_content": json_content, "json_hash": json_hash}))
+
+    conn.commit()
+    return wf_id
 
 
-def insert_workflows_batch(workflows_data):
+@_invalidates
+@_writes
+def insert_workflows_batch(conn, workflows_data, return_ids=False):
     """Insert multiple workflows in a single transaction.
-    workflows_data: list of dicts from parse_workflow_json + source_url/source_repo.
-    Returns (imported_count, duplicate_count).
+    workflows_data: list of dicts from parse_workflow_json + source_url/source_repo
+    (an optional "blob" from pack_blob() skips compressing on the writer thread).
+    Returns (imported_count, duplicate_count), or with return_ids=True the new id
+    of each workflow in order (None for duplicates).
     """
-    conn = get_db()
     now = datetime.utcnow().isoformat()
-    imported = 0
-    duplicates = 0
+    ids = []
 
     try:
         for wf in workflows_data:
-            try:
-                cursor = conn.execute("""
-                    INSERT INTO workflows (name, description, nodes, categories, node_count,
-                        trigger_type, source_url, source_repo, json_content, json_hash, added_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (wf["name"], wf["description"],
-                      json.dumps(wf["nodes"]), json.dumps(wf["categories"]),
-                      wf["node_count"], wf["trigger_type"],
-                      wf.get("source_url", ""), wf.get("source_repo", ""),
-                      wf["json_content"], wf["json_hash"], now, now))
-                wf_id = cursor.lastrowid
-
-                for node in wf["nodes"]:
-                    conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node))
-                for cat in wf["categories"]:
-                    conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat))
-
-                imported += 1
-            except sqlite3.IntegrityError:
-                duplicates += 1
+            ids.append(_insert_parsed(conn, wf, now))
 
         conn.commit()
     except Exception:
         conn.rollback()
         raise
 
-    return imported, duplicates
+    if return_ids:
+        return ids
+    imported = sum(1 for i in ids if i is not None)
+    return imported, len(ids) - imported
 
 
-def import_hub_records(records):
+@_invalidates
+@_writes
+def upsert_workflows_batch(conn, workflows_data):
+    """Reconcile parsed workflows with existing rows by source_url, in one transaction.
+    New source_urls are inserted. Changed content updates the existing row in place; the AI
+    analysis is reset only if the structure (nodes, categories, node count, trigger) changed.
+    Older rows left behind for the same source_url by previous imports are deleted.
+    Returns {"added", "updated", "unchanged", "duplicates", "reset", "removed"}.
+    """
+    now = datetime.utcnow().isoformat()
+    counts = dict.fromkeys(("added", "updated", "unchanged", "duplicates", "reset", "removed"), 0)
+
+    try:
+        for wf in workflows_data:
+            url = wf.get("source_url", "")
+            rows = conn.execute(f"""
+                SELECT id, json_hash, {", ".join(_STRUCTURE_FIELDS)} FROM workflows
+                WHERE source_url = ? ORDER BY id DESC
+            """, (url,)).fetchall() if url else []
+
+            if not rows:
+                counts["added" if _insert_parsed(conn, wf, now) else "duplicates"] += 1
+                continue
+
+            row, stale = rows[0], rows[1:]
+            if stale:
+                conn.executemany("DELETE FROM workflows WHERE id = ?", [(r["id"],) for r in stale])
+                counts["removed"] += len(stale)
+            if row["json_hash"] == wf["json_hash"]:
+                counts["unchanged"] += 1
+                continue
+
+            structural = (json.loads(row["nodes"] or "[]") != wf["nodes"]
+                          or json.loads(row["categories"] or "[]") != wf["categories"]
+                          or row["node_count"] != wf["node_count"]
+                          or row["trigger_type"] != wf["trigger_type"])
+            blob_hash, blob, size = wf.get("blob") or pack_blob(wf["json_content"])
+            cursor = conn.execute(f"""
+                UPDATE OR IGNORE workflows SET name = ?, description = ?, nodes = ?, categories = ?,
+                    node_count = ?, trigger_type = ?, source_repo = ?, json_content = '',
+                    blob_hash = ?, json_hash = ?, updated_at = ?{", " + _AI_RESET if structural else ""}
+                WHERE id = ?
+            """, (wf["name"], wf["description"], json.dumps(wf["nodes"]), json.dumps(wf["categories"]),
+                  wf["node_count"], wf["trigger_type"], wf.get("source_repo", ""),
+                  blob_hash, wf["json_hash"], now, row["id"]))
+            if not cursor.rowcount:
+                # The new content already exists under another source_url
+                counts["duplicates"] += 1
+                continue
+            _store_blob(conn, blob_hash, blob, size)
+            if structural:
+                _set_lookup_rows(conn, row["id"], wf["nodes"], wf["categories"], replace=True)
+                counts["reset"] += 1
+            _assign_cluster(conn, row["id"], *_fingerprint_of(wf))
+            counts["updated"] += 1
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return counts
+
+
+@_reads
+def get_json_hashes(conn):
+    """Every stored json_hash (read from its UNIQUE index), for dropping known files before parsing."""
+    return {r[0] for r in conn.execute("SELECT json_hash FROM workflows")}
+
+
+@_reads
+def get_source_urls(conn, source_repo):
+    """All source_urls currently stored for a repo."""
+    rows = conn.execute("SELECT source_url FROM workflows WHERE source_repo = ?", (source_repo,))
+    return {r[0] for r in rows}
+
+
+@_invalidates
+@_writes
+def delete_workflows_by_source(conn, source_urls):
+    """Delete every workflow whose source_url is in source_urls. Returns the number of rows removed."""
+    removed = 0
+    for url in source_urls:
+        removed += conn.execute("DELETE FROM workflows WHERE source_url = ?", (url,)).rowcount
+    conn.commit()
+    return removed
+
+
+@_invalidates
+@_writes
+def import_hub_records(conn, records):
     """
     Import fully-formed Hub records (backups).
     records: list of dictionaries representing 'workflows' table rows.
     """
-    conn = get_db()
     imported = 0
     duplicates = 0
 
@@ -301,7 +1063,7 @@ def import_hub_records(records):
         "added_at", "updated_at", "ai_usefulness", "ai_universality", "ai_complexity",
         "ai_scalability", "ai_summary", "ai_tags", "ai_use_cases", "ai_target_audience",
         "ai_integrations_summary", "ai_summary_en", "ai_use_cases_en", "ai_target_audience_en",
-        "ai_integrations_summary_en", "ai_difficulty_level", "ai_analyzed_at"
+        "ai_integrations_summary_en", "ai_difficulty_level", "ai_analyzed_at", "blob_hash"
     ]
 
     placeholders = ", ".join(["?"] * len(columns))
@@ -313,36 +1075,46 @@ def import_hub_records(records):
             for col in columns:
                 val = rec.get(col, "")
                 if col == "json_hash" and not val:
-                    import hashlib
                     json_str = rec.get("json_content", "")
+                    if isinstance(json_str, (list, dict)):
+                        json_str = json.dumps(json_str)
                     val = hashlib.sha256(json_str.encode()).hexdigest()[:16]
                 if col in ["nodes", "categories", "json_content", "ai_tags", "ai_use_cases", "ai_use_cases_en"]:
                     if isinstance(val, (list, dict)):
                         val = json.dumps(val)
                 vals.append(val)
 
-            try:
-                cursor = conn.execute(f"INSERT INTO workflows ({col_str}) VALUES ({placeholders})", vals)
-                wf_id = cursor.lastrowid
-
-                # Update helper tables
-                n_list = rec.get("nodes", [])
-                if isinstance(n_list, str):
-                    try: n_list = json.loads(n_list)
-                    except: n_list = []
-                for node_type in n_list:
-                    conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node_type))
-
-                c_list = rec.get("categories", [])
-                if isinstance(c_list, str):
-                    try: c_list = json.loads(c_list)
-                    except: c_list = []
-                for cat_name in c_list:
-                    conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat_name))
-
-                imported += 1
-            except sqlite3.IntegrityError:
+            # The body lives in workflow_blobs; the row only keeps its hash
+            body = vals[columns.index("json_content")]
+            blob_hash, blob, size = pack_blob(body)
+            vals[columns.index("json_content")] = ""
+            vals[columns.index("blob_hash")] = blob_hash
+
+            cursor = conn.execute(f"INSERT OR IGNORE INTO workflows ({col_str}) VALUES ({placeholders})", vals)
+            if not cursor.rowcount:
                 duplicates += 1
+                continue
+            wf_id = cursor.lastrowid
+            _store_blob(conn, blob_hash, blob, size)
+
+            # Update helper tables
+            n_list = rec.get("nodes", [])
+            if isinstance(n_list, str):
+                try: n_list = json.loads(n_list)
+                except: n_list = []
+            for node_type in n_list:
+                conn.execute("INSERT OR IGNORE INTO workflow_nodes VALUES (?, ?)", (wf_id, node_type))
+
+            c_list = rec.get("categories", [])
+            if isinstance(c_list, str):
+                try: c_list = json.loads(c_list)
+                except: c_list = []
+            for cat_name in c_list:
+                conn.execute("INSERT OR IGNORE INTO workflow_categories VALUES (?, ?)", (wf_id, cat_name))
+            _assign_cluster(conn, wf_id, *_fingerprint_of({"json_content": body,
+                                                           "json_hash": vals[columns.index("json_hash")]}))
+
+            imported += 1
 
         conn.commit()
     except Exception:
@@ -352,15 +1124,160 @@ def import_hub_records(records):
     return imported, duplicates
 
 
+# Column order of workflows_fts; bm25() takes one weight per column in this order
+FTS_COLUMNS = [
+    "name", "description", "nodes", "categories",
+    "ai_summary", "ai_tags", "ai_use_cases", "ai_target_audience", "ai_integrations_summary",
+    "ai_summary_en", "ai_use_cases_en", "ai_target_audience_en", "ai_integrations_summary_en",
+]
+
+BM25_WEIGHTS = {
+    "name": 10.0, "description": 2.0, "nodes": 4.0, "categories": 2.0,
+    "ai_summary": 5.0, "ai_tags": 8.0, "ai_use_cases": 2.0, "ai_target_audience": 1.0,
+    "ai_integrations_summary": 2.0,
+    "ai_summary_en": 5.0, "ai_use_cases_en": 2.0, "ai_target_audience_en": 1.0,
+    "ai_integrations_summary_en": 2.0,
+}
+
+
+def _parse_weights(spec):
+    """Parse 'name=10,ai_tags=8' into a weights dict (unknown columns are ignored)."""
+    weights = {}
+    for part in (spec or "").split(","):
+        col, _, val = part.partition("=")
+        col = col.strip()
+        if col in BM25_WEIGHTS and val.strip():
+            try:
+                weights[col] = float(val)
+            except ValueError:
+                print(f"[DB] Ignoring invalid BM25 weight: {part}")
+    return weights
+
+
+BM25_WEIGHTS.update(_parse_weights(os.environ.get("SEARCH_BM25_WEIGHTS", "")))
+# Relevance is multiplied by (1 + boost * ai_usefulness / 10); 0 disables the blend
+SEARCH_USEFULNESS_BOOST = float(os.environ.get("SEARCH_USEFULNESS_BOOST", "0.2"))
+# count="capped" stops counting after this many matches and reports e.g. "1000+"
+SEARCH_COUNT_CAP = int(os.environ.get("SEARCH_COUNT_CAP", "1000"))
+
+# Sort name -> [(expression, direction)]; w.id DESC is always appended as the unique tie-breaker
+SORT_KEYS = {
+    "recent": [("w.added_at", "DESC")],
+    "usefulness": [("w.ai_usefulness", "DESC"), ("w.added_at", "DESC")],
+    "complexity_asc": [("w.ai_complexity", "ASC"), ("w.added_at", "DESC")],
+    "complexity_desc": [("w.ai_complexity", "DESC"), ("w.added_at", "DESC")],
+    "nodes": [("w.node_count", "DESC"), ("w.added_at", "DESC")],
+}
+
+
+def encode_cursor(sort, values):
+    """Opaque cursor: the sort name plus the sort-key values of the last row seen."""
+    raw = json.dumps({"s": sort, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        values = data["k"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if data.get("s") != sort:
+        raise ValueError("Cursor does not match sort order")
+    return values
+
+
+def _keyset_condition(keys, values):
+    """Build "row comes after (values)" for a mixed-direction ORDER BY.
+    keys: [(expr, direction, params)]. Returns (sql, params).
+    """
+    clauses = []
+    params = []
+    for i, (expr, direction, expr_params) in enumerate(keys):
+        parts = []
+        for j in range(i):
+            prev_expr, _, prev_params = keys[j]
+            parts.append(f"{prev_expr} = ?")
+            params += prev_params + [values[j]]
+        parts.append(f"{expr} {'<' if direction == 'DESC' else '>'} ?")
+        params += expr_params + [values[i]]
+        clauses.append("(" + " AND ".join(parts) + ")")
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def _resolve_sort(query, sort):
+    if not sort:
+        sort = "relevance" if query.strip() else "recent"
+    if sort in ("relevance", "semantic") and not query.strip():
+        sort = "recent"
+    if sort not in ("relevance", "semantic") and sort not in SORT_KEYS:
+        sort = "recent"
+    return sort
+
+
 def search_workflows(query="", category="", node="", page=1, per_page=24,
-                     sort="recent", min_score=0):
-    conn = get_db()
+                     sort="", min_score=0, weights=None, usefulness_boost=None,
+                     cursor=None, count=None, facets=False, collapse=False):
+    """Cached front for _search_workflows (same arguments and result)."""
+    sort = _resolve_sort(query, sort)
+    if count is None:
+        count = "none" if cursor else "exact"
+    seq = _current_change_seq()
+    key = (_generation, seq, " ".join(query.lower().split()), category, node,
+           None if cursor else page, per_page, sort, min_score,
+           tuple(sorted((weights or {}).items())), usefulness_boost, cursor, count, bool(facets), bool(collapse))
+    found, result = _search_cache.get(key)
+    if not found:
+        result = _search_workflows(query=query, category=category, node=node, page=page,
+                                   per_page=per_page, sort=sort, min_score=min_score,
+                                   weights=weights, usefulness_boost=usefulness_boost,
+                                   cursor=cursor, count=count, facets=facets, collapse=collapse)
+        # Facets may come from an index up to FACET_MAX_STALENESS behind the change log:
+        # serve such a result once, but don't keep it for the whole TTL
+        if not facets or _facet_index.seq == seq:
+            _search_cache.set(key, result)
+    return result
+
+
+@_reads
+def _search_workflows(conn, query="", category="", node="", page=1, per_page=24,
+                      sort="", min_score=0, weights=None, usefulness_boost=None,
+                      cursor=None, count=None, facets=False, collapse=False):
+    """Search workflows. sort="" means relevance when a query is given, else recent.
+    weights overrides BM25_WEIGHTS per FTS column for sort=relevance.
+    sort=semantic ranks by vector similarity to the query instead of word matches
+    (see vectors.py), over the SEMANTIC_CANDIDATES closest workflows.
+
+    Paging: pass `cursor` (the previous response's next_cursor) for keyset paging,
+    otherwise page/offset is used. count is "exact", "capped" or "none"; it defaults
+    to "exact" for page/offset requests and "none" for cursor requests.
+    facets=True adds category/node/trigger_type/difficulty counts for the whole
+    filtered result set (not just the page).
+    collapse=True returns one workflow per near-duplicate cluster with at least one match —
+    its best-ranked matching member (the representative when nothing is filtered) — and
+    the number of matching members in cluster_size. total counts clusters; facets still
+    count every matching workflow.
+    """
     conditions = []
     params = []
+    join = ""
 
-    if query:
+    sort = _resolve_sort(query, sort)
+    if count is None:
+        count = "none" if cursor else "exact"
+
+    join_params = []
+    if query.strip() and sort == "semantic":
+        join = "JOIN json_each(?) AS sem ON CAST(sem.key AS INTEGER) = w.id"
+        join_params.append(json.dumps(_semantic_hits(conn, query)))
+    elif query.strip():
         fts_query = " OR ".join(f'"{w}"*' for w in query.strip().split())
-        conditions.append("w.id IN (SELECT rowid FROM workflows_fts WHERE workflows_fts MATCH ?)")
+        if sort == "relevance":
+            join = "JOIN workflows_fts ON workflows_fts.rowid = w.id"
+            conditions.append("workflows_fts MATCH ?")
+        else:
+            conditions.append("w.id IN (SELECT rowid FROM workflows_fts WHERE workflows_fts MATCH ?)")
         params.append(fts_query)
 
     if category:
@@ -375,53 +1292,218 @@ def search_workflows(query="", category="", node="", page=1, per_page=24,
         conditions.append("w.ai_usefulness >= ?")
         params.append(min_score)
 
-    where = "WHERE " + " AND ".join(conditions) if conditions else ""
-    offset = (page - 1) * per_page
-
-    # Sort options
-    sort_map = {
-        "recent": "w.added_at DESC",
-        "usefulness": "w.ai_usefulness DESC, w.added_at DESC",
-        "complexity_asc": "w.ai_complexity ASC, w.added_at DESC",
-        "complexity_desc": "w.ai_complexity DESC, w.added_at DESC",
-        "nodes": "w.node_count DESC, w.added_at DESC",
-    }
-    order_by = sort_map.get(sort, "w.added_at DESC")
-
-    count = conn.execute(f"SELECT COUNT(*) FROM workflows w {where}", params).fetchone()[0]
+    # Sort keys as (expression, direction, expression params)
+    if sort == "relevance":
+        # bm25() is negative (lower is better), so scaling it up by usefulness pulls good workflows forward
+        w = {**BM25_WEIGHTS, **(weights or {})}
+        boost = SEARCH_USEFULNESS_BOOST if usefulness_boost is None else usefulness_boost
+        rank_expr = (f"(bm25(workflows_fts, {', '.join('?' * len(FTS_COLUMNS))}) "
+                     f"* (1.0 + ? * w.ai_usefulness / 10.0))")
+        rank_params = [float(w[c]) for c in FTS_COLUMNS] + [float(boost)]
+        keys = [(rank_expr, "ASC", rank_params), ("w.ai_usefulness", "DESC", [])]
+    elif sort == "semantic":
+        keys = [("sem.value", "DESC", [])]
+    else:
+        keys = [(expr, direction, []) for expr, direction in SORT_KEYS[sort]]
+    keys.append(("w.id", "DESC", []))
+
+    filter_where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    filter_params = join_params + params
+
+    values = None
+    if cursor:
+        values = decode_cursor(cursor, sort)
+        if len(values) != len(keys):
+            raise ValueError("Invalid cursor")
+        offset = 0
+    else:
+        page = max(1, page)
+        offset = (page - 1) * per_page
 
-    rows = conn.execute(f"""
-        SELECT w.id, w.name, w.description, w.nodes, w.categories, w.node_count,
+    select_keys = ", ".join(f"{expr} AS _k{i}" for i, (expr, _, _) in enumerate(keys))
+    key_params = [p for _, _, expr_params in keys for p in expr_params]
+    order_by = ", ".join(f"_k{i} {direction}" for i, (_, direction, _) in enumerate(keys))
+    columns = """w.id, w.name, w.description, w.nodes, w.categories, w.node_count,
                w.trigger_type, w.source_url, w.source_repo, w.added_at,
                w.ai_usefulness, w.ai_complexity, w.ai_summary,
                w.ai_use_cases, w.ai_target_audience, w.ai_integrations_summary, w.ai_difficulty_level,
-               w.ai_summary_en, w.ai_use_cases_en, w.ai_target_audience_en, w.ai_integrations_summary_en
-        FROM workflows w {where}
-        ORDER BY {order_by}
-        LIMIT ? OFFSET ?
-    """, params + [per_page, offset]).fetchall()
-
-    return {
-        "total": count,
-        "page": page,
+               w.ai_summary_en, w.ai_use_cases_en, w.ai_target_audience_en, w.ai_integrations_summary_en,
+               w.cluster_id"""
+    # Filtered and collapsed: any member may be the one that matches, so pick the
+    # best-ranked matching member of each cluster after filtering
+    ranked_collapse = collapse and bool(conditions or join)
+
+    # One extra row tells us whether another page exists without counting
+    if ranked_collapse:
+        outer_where = "WHERE _rn = 1"
+        cond_params = []
+        if values is not None:
+            cond, cond_params = _keyset_condition([(f"_k{i}", d, []) for i, (_, d, _) in enumerate(keys)], values)
+            outer_where += f" AND {cond}"
+        # Rank ids and sort keys only; the page's rows are joined back for their columns
+        rows = conn.execute(f"""
+            SELECT {columns}, p.* FROM (
+                SELECT * FROM (
+                    SELECT m.*, ROW_NUMBER() OVER (PARTITION BY m._cluster ORDER BY {order_by}) AS _rn,
+                           COUNT(*) OVER (PARTITION BY m._cluster) AS cluster_size
+                    FROM (SELECT w.id AS _id, COALESCE(w.cluster_id, w.id) AS _cluster, {select_keys}
+                          FROM workflows w {join} {filter_where}) m
+                ) {outer_where}
+                ORDER BY {order_by}
+                LIMIT ? OFFSET ?
+            ) p JOIN workflows w ON w.id = p._id
+            ORDER BY {order_by}
+        """, key_params + filter_params + cond_params + [per_page + 1, offset]).fetchall()
+    else:
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if collapse:
+            # Nothing filtered: every member matches, so the representative stands for its cluster
+            page_conditions.append("COALESCE(w.cluster_id, w.id) = w.id")
+        if values is not None:
+            cond, cond_params = _keyset_condition(keys, values)
+            page_conditions.append(cond)
+            page_params += cond_params
+        where = "WHERE " + " AND ".join(page_conditions) if page_conditions else ""
+        rows = conn.execute(f"""
+            SELECT {columns}, {select_keys}
+            FROM workflows w {join} {where}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+        """, key_params + join_params + page_params + [per_page + 1, offset]).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    workflows = []
+    for r in rows:
+        wf = dict(r)
+        for i in range(len(keys)):
+            wf.pop(f"_k{i}")
+        for internal in ("_id", "_cluster", "_rn"):
+            wf.pop(internal, None)
+        workflows.append(_parse_json_fields(wf))
+    if collapse and workflows and not ranked_collapse:
+        ids = [wf["id"] for wf in workflows]
+        sizes = dict(conn.execute(f"""
+            SELECT cluster_id, COUNT(*) FROM workflows WHERE cluster_id IN ({", ".join("?" * len(ids))})
+            GROUP BY cluster_id
+        """, ids).fetchall())
+        for wf in workflows:
+            wf["cluster_size"] = sizes.get(wf["id"], 1)
+
+    result = {
+        "page": page if not cursor else None,
         "per_page": per_page,
-        "pages": (count + per_page - 1) // per_page,
-        "workflows": [_parse_json_fields(dict(r)) for r in rows]
+        "sort": sort,
+        "has_more": has_more,
+        "next_cursor": encode_cursor(sort, [rows[-1][f"_k{i}"] for i in range(len(keys))]) if has_more else None,
+        "workflows": workflows,
     }
 
+    counted = "DISTINCT COALESCE(w.cluster_id, w.id)" if collapse else "1"
+    if count == "exact":
+        total = conn.execute(f"SELECT COUNT(*) FROM (SELECT {counted} FROM workflows w {join} {filter_where})",
+                             filter_params).fetchone()[0]
+        result.update(total=total, total_capped=False, total_display=str(total))
+    elif count == "capped":
+        total = conn.execute(f"""SELECT COUNT(*) FROM (SELECT {counted} FROM workflows w {join} {filter_where}
+                                 LIMIT ?)""", filter_params + [SEARCH_COUNT_CAP + 1]).fetchone()[0]
+        capped = total > SEARCH_COUNT_CAP
+        total = min(total, SEARCH_COUNT_CAP)
+        result.update(total=total, total_capped=capped,
+                      total_display=f"{total}+" if capped else str(total))
+    if "total" in result:
+        result["pages"] = (result["total"] + per_page - 1) // per_page
+
+    if facets:
+        result["facets"] = _facet_counts(conn, join, filter_where, filter_params)
+
+    return result
+
+
+_facet_index = FacetIndex(max_staleness=float(os.environ.get("FACET_MAX_STALENESS", "5")))
+
+
+_vector_index = VectorIndex(VECTOR_INDEX_DIR)
+SEMANTIC_CANDIDATES = int(os.environ.get("SEMANTIC_CANDIDATES", "500"))
+SEMANTIC_MIN_SCORE = float(os.environ.get("SEMANTIC_MIN_SCORE", "0.2"))
+
+
+def _semantic_hits(conn, query):
+    """{workflow id: cosine similarity} of the workflows closest to the query text."""
+    _vector_index.ensure_fresh(conn, _change_seq(conn))
+    if _vector_index.claim_refit():
+        threading.Thread(target=_refit_vectors, name="vector-refit", daemon=True).start()
+    return dict(_vector_index.search(query, SEMANTIC_CANDIDATES, SEMANTIC_MIN_SCORE))
+
+
+@_reads
+def _refit_vectors(conn):
+    print("[DB] Refitting the semantic vector index...")
+    _vector_index.refit(conn)
+    print(f"[DB] Vector index refitted: {_vector_index.stats()}")
+
+
+@_reads
+def warm_vector_index(conn):
+    """Load (or fit) the vector index ahead of the first semantic search."""
+    _vector_index.ensure_fresh(conn, _change_seq(conn))
+    return _vector_index.stats()
+
+
+def _facet_counts(conn, join, where, params):
+    """Facet counts over the matching id set using the bitmap index."""
+    _facet_index.ensure_fresh(conn, _change_seq(conn))
+    if not where and not join:
+        return _facet_index.counts()
+    ids = [r[0] for r in conn.execute(f"SELECT w.id FROM workflows w {join} {where}", params)]
+    return _facet_index.counts(ids)
+
 
 def get_workflow(wf_id):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM workflows WHERE id = ?", (wf_id,)).fetchone()
+    """Cached front for _get_workflow."""
+    key = (_generation, _current_change_seq(), wf_id)
+    found, wf = _workflow_cache.get(key)
+    if not found:
+        wf = _get_workflow(wf_id)
+        _workflow_cache.set(key, wf)
+    return wf
+
+
+@_reads
+def _get_workflow(conn, wf_id):
+    row = conn.execute("""
+        SELECT w.*, b.data AS _blob FROM workflows w
+        LEFT JOIN workflow_blobs b ON b.hash = w.blob_hash
+        WHERE w.id = ?
+    """, (wf_id,)).fetchone()
     if not row: return None
-    return _parse_json_fields(dict(row))
+    wf = _parse_json_fields(_inflate(dict(row)))
+    wf["variants"] = [dict(r) for r in conn.execute("""
+        SELECT id, name, source_repo, structure_hash = ? AS exact FROM workflows
+        WHERE cluster_id = ? AND id != ? ORDER BY id LIMIT 50
+    """, (wf["structure_hash"], wf["cluster_id"], wf_id))] if wf.get("cluster_id") else []
+    return wf
 
 
-def get_all_workflows_full():
+@_reads
+def get_all_workflows_full(conn):
     """Fetch every record with every column for full export."""
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM workflows ORDER BY added_at DESC").fetchall()
-    return [_parse_json_fields(dict(r)) for r in rows]
+    rows = conn.execute("""
+        SELECT w.*, b.data AS _blob FROM workflows w
+        LEFT JOIN workflow_blobs b ON b.hash = w.blob_hash
+        ORDER BY w.added_at DESC
+    """).fetchall()
+    return [_parse_json_fields(_inflate(dict(r))) for r in rows]
+
+
+def _inflate(d):
+    """Put the decompressed blob back into json_content (legacy rows keep the inline text)."""
+    blob = d.pop("_blob", None)
+    d.pop("blob_hash", None)
+    if blob is not None and not d.get("json_content"):
+        d["json_content"] = zlib.decompress(blob).decode("utf-8")
+    return d
 
 
 def _parse_json_fields(d):
@@ -441,86 +1523,138 @@ def _parse_json_fields(d):
     return d
 
 
-def delete_workflow(wf_id):
-    conn = get_db()
+@_invalidates
+@_writes
+def delete_workflow(conn, wf_id):
     conn.execute("DELETE FROM workflows WHERE id = ?", (wf_id,))
     conn.commit()
 
 
-def get_all_nodes():
-    conn = get_db()
+@_invalidates
+@_writes
+def rename_workflow(conn, wf_id, name):
+    conn.execute("UPDATE workflows SET name = ? WHERE id = ?", (name, wf_id))
+    conn.commit()
+
+
+@_reads
+def get_all_nodes(conn):
     rows = conn.execute("SELECT DISTINCT node_name FROM workflow_nodes ORDER BY node_name").fetchall()
     return [r["node_name"] for r in rows]
 
 
-def get_all_categories():
-    conn = get_db()
+@_reads
+def get_all_categories(conn):
     rows = conn.execute("SELECT DISTINCT category_name FROM workflow_categories ORDER BY category_name").fetchall()
     return [r["category_name"] for r in rows]
 
 
-def get_stats():
-    conn = get_db()
-    total = conn.execute("SELECT COUNT(*) FROM workflows").fetchone()[0]
-    repos = conn.execute("SELECT COUNT(*) FROM github_repos").fetchone()[0]
-    unique_nodes = conn.execute("SELECT COUNT(DISTINCT node_name) FROM workflow_nodes").fetchone()[0]
+@_reads
+def get_stats(conn):
+    # O(1): counters are maintained by triggers (see _migrate_stats)
+    row = conn.execute("SELECT * FROM workflow_stats WHERE id = 1").fetchone()
+    if not row:
+        return {"total_workflows": 0, "total_repos": 0, "unique_nodes": 0,
+                "analyzed_count": 0, "avg_usefulness": 0}
     # Fully analyzed means having a score AND an English summary
-    analyzed = conn.execute("""
-        SELECT COUNT(*) FROM workflows 
-        WHERE ai_analyzed_at != '' AND ai_analyzed_at IS NOT NULL 
-        AND ai_usefulness > 0 AND ai_summary_en != '' AND ai_summary_en IS NOT NULL
-    """).fetchone()[0]
-    avg_usefulness = conn.execute("SELECT COALESCE(AVG(ai_usefulness), 0) FROM workflows WHERE ai_analyzed_at != '' AND ai_usefulness > 0").fetchone()[0]
+    avg_usefulness = row["usefulness_sum"] / row["usefulness_n"] if row["usefulness_n"] else 0
     return {
-        "total_workflows": total, "total_repos": repos, "unique_nodes": unique_nodes,
-        "analyzed_count": analyzed, "avg_usefulness": round(avg_usefulness, 1)
+        "total_workflows": row["total_workflows"], "total_repos": row["total_repos"],
+        "unique_nodes": row["unique_nodes"], "analyzed_count": row["analyzed_count"],
+        "avg_usefulness": round(avg_usefulness, 1)
     }
 
 
-def update_workflow_ai(wf_id, usefulness, universality, complexity, scalability, summary, tags, 
+_AI_UPDATE = """
+    UPDATE workflows SET
+        ai_usefulness = ?, ai_universality = ?, ai_complexity = ?,
+        ai_scalability = ?, ai_summary = ?, ai_tags = ?,
+        ai_use_cases = ?, ai_target_audience = ?, ai_integrations_summary = ?, 
+        ai_summary_en = ?, ai_use_cases_en = ?, ai_target_audience_en = ?, 
+        ai_integrations_summary_en = ?,
+        ai_difficulty_level = ?, ai_analyzed_at = ?
+    WHERE id = ?
+"""
+
+
+def _ai_params(wf_id, usefulness, universality, complexity, scalability, summary, tags,
+               use_cases=None, target_audience=None, integrations_summary=None,
+               difficulty_level=None, result_en=None, analyzed_at=None):
+    result_en = result_en or {}
+    return (usefulness, universality, complexity, scalability, summary,
+            json.dumps(tags, ensure_ascii=False), 
+            json.dumps(use_cases or [], ensure_ascii=False),
+            target_audience or "",
+            integrations_summary or "",
+            result_en.get("summary", ""),
+            json.dumps(result_en.get("use_cases", []), ensure_ascii=False),
+            result_en.get("target_audience", ""),
+            result_en.get("integrations_summary", ""),
+            difficulty_level or "",
+            analyzed_at or datetime.utcnow().isoformat(), wf_id)
+
+
+@_invalidates
+@_writes
+def update_workflow_ai(conn, wf_id, usefulness, universality, complexity, scalability, summary, tags, 
                        use_cases=None, target_audience=None, integrations_summary=None, 
                        difficulty_level=None, result_en=None):
     """Update AI analysis scores for a workflow."""
-    conn = get_db()
-    result_en = result_en or {}
-    conn.execute("""
-        UPDATE workflows SET
-            ai_usefulness = ?, ai_universality = ?, ai_complexity = ?,
-            ai_scalability = ?, ai_summary = ?, ai_tags = ?,
-            ai_use_cases = ?, ai_target_audience = ?, ai_integrations_summary = ?, 
-            ai_summary_en = ?, ai_use_cases_en = ?, ai_target_audience_en = ?, 
-            ai_integrations_summary_en = ?,
-            ai_difficulty_level = ?, ai_analyzed_at = ?
-        WHERE id = ?
-    """, (usefulness, universality, complexity, scalability, summary,
-          json.dumps(tags, ensure_ascii=False), 
-          json.dumps(use_cases or [], ensure_ascii=False),
-          target_audience or "",
-          integrations_summary or "",
-          result_en.get("summary", ""),
-          json.dumps(result_en.get("use_cases", []), ensure_ascii=False),
-          result_en.get("target_audience", ""),
-          result_en.get("integrations_summary", ""),
-          difficulty_level or "",
-          datetime.utcnow().isoformat(), wf_id))
-    conn.commit()
-
-
-def get_unanalyzed_workflows(limit=50):
-    """Get workflows that haven't been analyzed by AI yet, or where analysis failed (no scores)."""
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT id, name, description, nodes, categories, node_count, trigger_type, json_content
-        FROM workflows 
-        WHERE ai_analyzed_at = '' OR ai_analyzed_at IS NULL OR ai_usefulness = 0 OR ai_summary_en = '' OR ai_summary_en IS NULL
+    conn.execute(_AI_UPDATE, _ai_params(wf_id, usefulness, universality, complexity, scalability, summary, tags,
+                                        use_cases, target_audience, integrations_summary,
+                                        difficulty_level, result_en))
+    conn.commit()
+
+
+@_invalidates
+@_writes
+def update_workflows_ai_batch(conn, items, owner=None, cache=None, from_cache=False):
+    """Save many analyses in one transaction: items are (wf_id, update_workflow_ai keyword arguments).
+    With owner, also close the analysis_queue entries that owner leased. Returns how many it closed.
+
+    cache maps wf_id to its analysis cache key: the results are stored under those keys,
+    or, with from_cache, they came from there and count as cache hits.
+    """
+    now = datetime.utcnow().isoformat()
+    conn.executemany(_AI_UPDATE, [_ai_params(wf_id, **fields, analyzed_at=now) for wf_id, fields in items])
+    if cache and from_cache:
+        conn.executemany("UPDATE analysis_cache SET hits = hits + 1, last_hit_at = ? WHERE input_hash = ?",
+                         [(now, cache[wf_id]) for wf_id, _ in items if wf_id in cache])
+    elif cache:
+        conn.executemany("""
+            INSERT INTO analysis_cache (input_hash, result, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(input_hash) DO UPDATE SET result = excluded.result, created_at = excluded.created_at
+        """, [(cache[wf_id], json.dumps(fields, ensure_ascii=False), now) for wf_id, fields in items if wf_id in cache])
+    completed = 0
+    if owner is not None:
+        completed = conn.execute("""
+            UPDATE analysis_queue SET state = 'done', lease_owner = '', lease_until = '', last_error = '',
+                                      finished_at = ?
+            WHERE workflow_id IN (SELECT value FROM json_each(?)) AND state = 'running' AND lease_owner = ?
+        """, (now, json.dumps([wf_id for wf_id, _ in items]), owner)).rowcount
+    conn.commit()
+    return completed
+
+
+@_reads
+def get_unanalyzed_workflows(conn, limit=50):
+    """Get workflows that haven't been analyzed by AI yet, or where analysis failed (no scores).
+    Only the oldest unanalyzed member of each near-duplicate cluster is returned (passing over
+    dead-lettered ones); the rest get its result through copy_cluster_analysis().
+    """
+    rows = conn.execute(f"""
+        SELECT id, name, description, nodes, categories, node_count, trigger_type
+        FROM workflows w
+        WHERE {_ANALYZED.format(r="w")} = 0
+          AND {_CLUSTER_HEAD}
         LIMIT ?
     """, (limit,)).fetchall()
     return [dict(r) for r in rows]
 
 
 # GitHub repos management
-def add_github_repo(repo_url):
-    conn = get_db()
+@_writes
+def add_github_repo(conn, repo_url):
     try:
         conn.execute("INSERT INTO github_repos (repo_url) VALUES (?)", (repo_url,))
         conn.commit()
@@ -529,36 +1663,71 @@ def add_github_repo(repo_url):
         return False
 
 
-def get_github_repos():
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM github_repos ORDER BY id").fetchall()
+@_reads
+def get_github_repos(conn, enabled_only=False):
+    where = "WHERE enabled = 1" if enabled_only else ""
+    rows = conn.execute(f"SELECT * FROM github_repos {where} ORDER BY id").fetchall()
     return [dict(r) for r in rows]
 
 
-def update_repo_sync(repo_url, count):
-    conn = get_db()
-    conn.execute("UPDATE github_repos SET last_synced = ?, workflow_count = ? WHERE repo_url = ?",
-                 (datetime.utcnow().isoformat(), count, repo_url))
+@_reads
+def get_github_repo(conn, repo_url):
+    row = conn.execute("SELECT * FROM github_repos WHERE repo_url = ?", (repo_url,)).fetchone()
+    return dict(row) if row else None
+
+
+@_writes
+def update_repo_sync(conn, repo_url, count=None, commit_sha=None, branch=None):
+    """Record a finished sync. count=None recounts the repo's workflows in the DB."""
+    if count is None:
+        count = conn.execute("SELECT COUNT(*) FROM workflows WHERE source_repo = ?", (repo_url,)).fetchone()[0]
+    conn.execute("""UPDATE github_repos SET last_synced = ?, workflow_count = ?,
+                        last_commit_sha = COALESCE(?, last_commit_sha), branch = COALESCE(?, branch)
+                    WHERE repo_url = ?""",
+                 (datetime.utcnow().isoformat(), count, commit_sha, branch, repo_url))
     conn.commit()
 
 
-def delete_github_repo(repo_id):
-    conn = get_db()
+@_reads
+def get_repo_manifest(conn, repo_url):
+    """{path: blob_sha} for the files seen at the repo's last synced commit."""
+    rows = conn.execute("SELECT path, blob_sha FROM github_repo_files WHERE repo_url = ?", (repo_url,))
+    return {r[0]: r[1] for r in rows}
+
+
+@_writes
+def update_repo_manifest(conn, repo_url, files, removed=(), replace=False):
+    """Upsert {path: blob_sha} entries and drop removed paths (replace=True rewrites the whole manifest)."""
+    if replace:
+        conn.execute("DELETE FROM github_repo_files WHERE repo_url = ?", (repo_url,))
+    conn.executemany("DELETE FROM github_repo_files WHERE repo_url = ? AND path = ?",
+                     [(repo_url, p) for p in removed])
+    conn.executemany("INSERT OR REPLACE INTO github_repo_files (repo_url, path, blob_sha) VALUES (?, ?, ?)",
+                     [(repo_url, p, sha) for p, sha in files.items()])
+    conn.commit()
+
+
+@_invalidates
+@_writes
+def delete_github_repo(conn, repo_id):
     repo = conn.execute("SELECT repo_url FROM github_repos WHERE id = ?", (repo_id,)).fetchone()
     if repo:
         conn.execute("DELETE FROM workflows WHERE source_repo = ?", (repo["repo_url"],))
+        conn.execute("DELETE FROM github_repo_files WHERE repo_url = ?", (repo["repo_url"],))
         conn.execute("DELETE FROM github_repos WHERE id = ?", (repo_id,))
         conn.commit()
 
 
-def clear_all_workflows():
+@_invalidates
+@_writes
+def clear_all_workflows(conn):
     """Wipe all workflows from the database."""
-    conn = get_db()
     conn.execute("DELETE FROM workflows")
     conn.commit()
-def _migrate_user_tables():
+
+
+def _migrate_user_tables(conn):
     """Ensure user tables exist and usage records exist for all users."""
-    conn = get_db()
     # Force creation of tables (safeguard)
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS users (
@@ -603,9 +1772,9 @@ def _migrate_user_tables():
     conn.commit()
 
 
-def upsert_user(email, name, picture):
+@_writes
+def upsert_user(conn, email, name, picture):
     """Insert or update user from OAuth data."""
-    conn = get_db()
     now = datetime.utcnow().isoformat()
     cursor = conn.execute("SELECT id FROM users WHERE email = ?", (email,))
     row = cursor.fetchone()
@@ -626,9 +1795,9 @@ def upsert_user(email, name, picture):
     conn.commit()
     return user_id
 
-def update_subscription(user_id, payment_customer_id, payment_sub_id, status, expires_at=None):
+@_writes
+def update_subscription(conn, user_id, payment_customer_id, payment_sub_id, status, expires_at=None):
     """Update user subscription status."""
-    conn = get_db()
     conn.execute("""
         INSERT INTO subscriptions (user_id, payment_customer_id, payment_sub_id, status, expires_at)
         VALUES (?, ?, ?, ?, ?)
@@ -640,39 +1809,39 @@ def update_subscription(user_id, payment_customer_id, payment_sub_id, status, ex
     """, (user_id, payment_customer_id, payment_sub_id, status, expires_at))
     conn.commit()
 
-def add_payment_record(user_id, payment_order_id, amount, currency, status):
+@_writes
+def add_payment_record(conn, user_id, payment_order_id, amount, currency, status):
     """Log a payment transaction."""
-    conn = get_db()
     conn.execute("""
         INSERT INTO payment_history (user_id, payment_order_id, amount, currency, status, created_at)
         VALUES (?, ?, ?, ?, ?, ?)
     """, (user_id, payment_order_id, amount, currency, status, datetime.utcnow().isoformat()))
     conn.commit()
 
-def get_payment_history(user_id):
+@_reads
+def get_payment_history(conn, user_id):
     """Retrieve payment history for a user."""
-    conn = get_db()
     cursor = conn.execute("""
         SELECT * FROM payment_history WHERE user_id = ? ORDER BY created_at DESC
     """, (user_id,))
     return [dict(row) for row in cursor.fetchall()]
 
-def get_user_by_payment_customer(payment_customer_id):
+@_reads
+def get_user_by_payment_customer(conn, payment_customer_id):
     """Find user by payment customer ID."""
-    conn = get_db()
     cursor = conn.execute("SELECT user_id FROM subscriptions WHERE payment_customer_id = ?", (payment_customer_id,))
     row = cursor.fetchone()
     return row["user_id"] if row else None
 
 
-def get_user_by_email(email):
-    conn = get_db()
+@_reads
+def get_user_by_email(conn, email):
     row = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
     return dict(row) if row else None
 
 
-def get_user_usage(user_id):
-    conn = get_db()
+@_reads
+def get_user_usage(conn, user_id):
     row = conn.execute("""
         SELECT u.ai_chat_count, s.status as sub_status, s.expires_at
         FROM user_usage u
@@ -684,15 +1853,15 @@ def get_user_usage(user_id):
     return {"ai_chat_count": 0, "sub_status": "inactive", "expires_at": None}
 
 
-def increment_user_usage(user_id):
-    conn = get_db()
+@_writes
+def increment_user_usage(conn, user_id):
     conn.execute("UPDATE user_usage SET ai_chat_count = ai_chat_count + 1 WHERE user_id = ?", (user_id,))
     conn.commit()
 
 
-def get_admin_users_report():
+@_reads
+def get_admin_users_report(conn):
     """Retrieve all users with subscription and usage stats for admin."""
-    conn = get_db()
     cursor = conn.execute("""
         SELECT 
             u.id, u.email, u.name, u.picture, u.created_at,
@@ -704,3 +1873,434 @@ def get_admin_users_report():
         ORDER BY u.created_at DESC
     """)
     return [dict(row) for row in cursor.fetchall()]
+
+
+# ==================== Import jobs ====================
+# Long imports run as background jobs; their state lives here so the UI can poll
+# progress and interrupted jobs can be picked up again after a restart.
+
+_JOB_JSON_FIELDS = ("params", "timings", "result")
+_JOB_FIELDS = {"state", "stage", "processed", "total", "timings", "result", "error",
+               "attempts", "started_at", "finished_at"}
+
+
+def _migrate_import_jobs(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS import_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        state TEXT NOT NULL DEFAULT 'queued',
+        stage TEXT DEFAULT '',
+        processed INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        timings TEXT DEFAULT '{}',
+        result TEXT DEFAULT '',
+        error TEXT DEFAULT '',
+        attempts INTEGER DEFAULT 0,
+        created_at TEXT NOT NULL,
+        started_at TEXT DEFAULT '',
+        finished_at TEXT DEFAULT '',
+        updated_at TEXT NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_state ON import_jobs(state)")
+    conn.commit()
+
+
+def _job_dict(row):
+    d = dict(row)
+    for f in _JOB_JSON_FIELDS:
+        d[f] = json.loads(d[f]) if d[f] else None
+    return d
+
+
+@_writes
+def create_import_job(conn, kind, params):
+    now = datetime.utcnow().isoformat()
+    cursor = conn.execute("INSERT INTO import_jobs (kind, params, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                          (kind, json.dumps(params, ensure_ascii=False), now, now))
+    conn.commit()
+    return cursor.lastrowid
+
+
+@_writes
+def update_import_job(conn, job_id, **fields):
+    """Set any of state/stage/processed/total/timings/result/error/attempts/started_at/finished_at."""
+    unknown = set(fields) - _JOB_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown import job fields: {sorted(unknown)}")
+    for f in _JOB_JSON_FIELDS:
+        if f in fields:
+            fields[f] = json.dumps(fields[f], ensure_ascii=False)
+    fields["updated_at"] = datetime.utcnow().isoformat()
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    conn.execute(f"UPDATE import_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    conn.commit()
+
+
+@_reads
+def get_import_job(conn, job_id):
+    row = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+
+@_reads
+def get_import_jobs(conn, limit=20, states=None):
+    """Most recent jobs first; states limits the result to e.g. ("queued", "running")."""
+    if states:
+        rows = conn.execute(f"""SELECT * FROM import_jobs WHERE state IN ({",".join("?" * len(states))})
+                                ORDER BY id DESC LIMIT ?""", (*states, limit)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM import_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [_job_dict(r) for r in rows]
+
+
+# ==================== Analysis queue ====================
+# One row per workflow waiting for (or done with) AI analysis:
+# pending -> running (leased by a worker) -> done | pending again with a backoff | dead.
+# Workers in any process claim rows atomically, so several uvicorn workers share the
+# queue, and a lease left behind by a crashed or redeployed worker simply expires.
+
+def _migrate_analysis_queue(conn):
+    statements = [
+        """CREATE TABLE IF NOT EXISTS analysis_queue (
+            workflow_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            lease_owner TEXT DEFAULT '',
+            lease_until TEXT DEFAULT '',
+            last_error TEXT DEFAULT '',
+            enqueued_at TEXT NOT NULL,
+            finished_at TEXT DEFAULT ''
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_analysis_queue_ready ON analysis_queue(state, next_attempt_at)",
+        """CREATE TRIGGER IF NOT EXISTS analysis_queue_wf_ad AFTER DELETE ON workflows BEGIN
+            DELETE FROM analysis_queue WHERE workflow_id = old.id;
+        END""",
+    ]
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+
+@_writes
+def enqueue_analysis(conn, workflow_ids=None):
+    """Queue unanalyzed workflows (all of them, or just workflow_ids) — one per near-duplicate
+    cluster, like get_unanalyzed_workflows(). Finished entries whose workflow lost its analysis
+    are queued again; dead ones stay dead until retry_dead_analysis(). Returns the number queued.
+    """
+    now = datetime.utcnow().isoformat()
+    only = ""
+    params = [now, now]
+    if workflow_ids is not None:
+        workflow_ids = list(workflow_ids)
+        if not workflow_ids:
+            return 0
+        only = "AND w.id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(workflow_ids))
+    cursor = conn.execute(f"""
+        INSERT INTO analysis_queue (workflow_id, next_attempt_at, enqueued_at)
+        SELECT w.id, ?, ? FROM workflows w
+        WHERE {_ANALYZED.format(r="w")} = 0 {only}
+          AND {_CLUSTER_HEAD}
+        ON CONFLICT (workflow_id) DO UPDATE SET
+            state = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at,
+            last_error = '', enqueued_at = excluded.enqueued_at, finished_at = ''
+        WHERE analysis_queue.state = 'done'
+    """, params)
+    conn.commit()
+    return cursor.rowcount
+
+
+@_writes
+def claim_analysis(conn, owner, limit=1, lease_seconds=300, max_attempts=5):
+    """Lease up to `limit` due entries to `owner` and return their workflows (with "attempts").
+
+    Due means pending with next_attempt_at in the past, or running with an expired lease
+    held by someone else (its worker died); an expired lease that already used max_attempts
+    goes dead instead. Expired leases of `owner` itself are left alone: it is still alive
+    and working on them, just late to renew_analysis_leases().
+    Entries whose workflow got analyzed meanwhile (e.g. copied from its cluster) are closed
+    without being returned.
+    """
+    now = datetime.utcnow()
+    now_s = now.isoformat()
+    conn.execute("""
+        UPDATE analysis_queue SET state = 'dead', last_error = 'Lease expired', finished_at = ?
+        WHERE state = 'running' AND lease_until < ? AND lease_owner != ? AND attempts >= ?
+    """, (now_s, now_s, owner, max_attempts))
+    claimed = {r[0]: r[1] for r in conn.execute("""
+        UPDATE analysis_queue SET state = 'running', attempts = attempts + 1, lease_owner = ?, lease_until = ?
+        WHERE workflow_id IN (
+            SELECT workflow_id FROM analysis_queue
+            WHERE (state = 'pending' AND next_attempt_at <= ?)
+               OR (state = 'running' AND lease_until < ? AND lease_owner != ?)
+            ORDER BY next_attempt_at, workflow_id LIMIT ?
+        )
+        RETURNING workflow_id, attempts
+    """, (owner, (now + timedelta(seconds=lease_seconds)).isoformat(), now_s, now_s, owner, limit)).fetchall()}
+    if not claimed:
+        conn.commit()
+        return []
+
+    rows = conn.execute(f"""
+        SELECT id, name, description, nodes, categories, node_count, trigger_type,
+               {_ANALYZED.format(r="w")} AS analyzed
+        FROM workflows w WHERE id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(claimed)),)).fetchall()
+    result, closed = [], []
+    for r in rows:
+        if r["analyzed"]:
+            closed.append(r["id"])
+            continue
+        wf = dict(r)
+        del wf["analyzed"]
+        wf["attempts"] = claimed[r["id"]]
+        result.append(wf)
+    if closed:
+        conn.execute("""UPDATE analysis_queue SET state = 'done', lease_owner = '', lease_until = '', finished_at = ?
+                        WHERE workflow_id IN (SELECT value FROM json_each(?))""", (now_s, json.dumps(closed)))
+    conn.commit()
+    return result
+
+
+def _fail_entries(conn, failures, owner):
+    now = datetime.utcnow().isoformat()
+    params = []
+    for wf_id, error, retry_at in failures:
+        if retry_at is None:
+            state, next_attempt, finished = "dead", now, now
+        else:
+            state, next_attempt, finished = "pending", retry_at.isoformat(), ""
+        params.append((state, next_attempt, finished, str(error)[:500], wf_id, owner))
+    before = conn.total_changes
+    conn.executemany("""
+        UPDATE analysis_queue SET state = ?, next_attempt_at = ?, finished_at = ?, last_error = ?,
+                                  lease_owner = '', lease_until = ''
+        WHERE workflow_id = ? AND state = 'running' AND lease_owner = ?
+    """, params)
+    conn.commit()
+    return conn.total_changes - before
+
+
+@_writes
+def fail_analysis(conn, wf_id, owner, error, retry_at=None):
+    """Record a failed attempt: back to pending until retry_at (a datetime), or dead if retry_at is None."""
+    return _fail_entries(conn, [(wf_id, error, retry_at)], owner) > 0
+
+
+@_writes
+def fail_analyses(conn, failures, owner):
+    """fail_analysis() for many entries in one transaction: failures are (wf_id, error, retry_at).
+    Returns how many entries were still held by owner.
+    """
+    return _fail_entries(conn, failures, owner)
+
+
+@_writes
+def renew_analysis_leases(conn, owner, lease_seconds=300):
+    """Heartbeat: push out the lease of everything `owner` holds by lease_seconds from now.
+    Returns the number of entries renewed."""
+    cursor = conn.execute("""
+        UPDATE analysis_queue SET lease_until = ?
+        WHERE state = 'running' AND lease_owner = ?
+    """, ((datetime.utcnow() + timedelta(seconds=lease_seconds)).isoformat(), owner))
+    conn.commit()
+    return cursor.rowcount
+
+
+@_writes
+def release_analysis(conn, owner):
+    """Hand back everything `owner` holds (graceful shutdown) without counting it as an attempt."""
+    cursor = conn.execute("""
+        UPDATE analysis_queue SET state = 'pending', attempts = MAX(attempts - 1, 0),
+                                  lease_owner = '', lease_until = ''
+        WHERE state = 'running' AND lease_owner = ?
+    """, (owner,))
+    conn.commit()
+    return cursor.rowcount
+
+
+@_writes
+def retry_dead_analysis(conn):
+    """Give dead-lettered entries a fresh set of attempts. Returns how many were requeued."""
+    now = datetime.utcnow().isoformat()
+    cursor = conn.execute("""
+        UPDATE analysis_queue SET state = 'pending', attempts = 0, next_attempt_at = ?, enqueued_at = ?,
+                                  finished_at = ''
+        WHERE state = 'dead'
+    """, (now, now))
+    conn.commit()
+    return cursor.rowcount
+
+
+def _next_due(conn):
+    return conn.execute("""
+        SELECT MIN(t) FROM (
+            SELECT MIN(next_attempt_at) AS t FROM analysis_queue WHERE state = 'pending'
+            UNION ALL SELECT MIN(lease_until) FROM analysis_queue WHERE state = 'running'
+        )
+    """).fetchone()[0]
+
+
+@_reads
+def next_analysis_due(conn):
+    """Earliest next_attempt_at among pending entries or lease expiry among running ones (None if empty)."""
+    return _next_due(conn)
+
+
+@_reads
+def get_analysis_queue_status(conn, dead_limit=20):
+    """Queue counters for the admin status endpoint.
+
+    The current run is everything enqueued since the oldest entry still pending or running,
+    so total/analyzed/errors describe the backlog being worked on, across restarts.
+    """
+    now = datetime.utcnow().isoformat()
+    counts = dict.fromkeys(("pending", "running", "done", "dead"), 0)
+    counts.update(conn.execute("SELECT state, COUNT(*) FROM analysis_queue GROUP BY state").fetchall())
+    retrying = conn.execute("SELECT COUNT(*) FROM analysis_queue WHERE state = 'pending' AND attempts > 0"
+                            ).fetchone()[0]
+    run_start = conn.execute("SELECT MIN(enqueued_at) FROM analysis_queue WHERE state IN ('pending', 'running')"
+                             ).fetchone()[0]
+    run = {"total": 0, "analyzed": 0, "errors": 0}
+    if run_start:
+        row = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(state = 'done'), 0), COALESCE(SUM(state = 'dead'), 0)
+            FROM analysis_queue WHERE enqueued_at >= ?
+        """, (run_start,)).fetchone()
+        run = {"total": row[0], "analyzed": row[1], "errors": row[2]}
+    dead = conn.execute("""
+        SELECT q.workflow_id AS id, w.name, q.attempts, q.last_error, q.finished_at
+        FROM analysis_queue q JOIN workflows w ON w.id = q.workflow_id
+        WHERE q.state = 'dead' ORDER BY q.finished_at DESC LIMIT ?
+    """, (dead_limit,)).fetchall()
+    cache = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM analysis_cache").fetchone()
+    return {
+        "status": "running" if counts["pending"] or counts["running"] else "idle",
+        **run,
+        "start_time": run_start,
+        "queue": {**counts, "retrying": retrying},
+        "next_attempt_at": _next_due(conn) if counts["pending"] or counts["running"] else None,
+        "done_last_hour": conn.execute("SELECT COUNT(*) FROM analysis_queue WHERE state = 'done' AND finished_at >= ?",
+                                       ((datetime.utcnow() - timedelta(hours=1)).isoformat(),)).fetchone()[0],
+        "dead_items": [dict(r) for r in dead],
+        # Analyses served from the cache instead of an LLM call, all time
+        "cache": {"entries": cache[0], "hits": cache[1]},
+        "now": now,
+    }
+
+
+# ==================== Analysis batches ====================
+# Catalog-wide backfills can go through the provider's Batch API instead of the
+# interactive worker (see batch_analysis.py). A batch leases its workflows in
+# analysis_queue as "batch:<id>"; this table tracks the remote batch until its
+# results are applied.
+
+_BATCH_FIELDS = {"remote_id", "state", "provider_state", "total", "completed", "failed", "applied",
+                 "error", "submitted_at", "finished_at"}
+
+
+def _migrate_analysis_batches(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        provider TEXT NOT NULL,
+        remote_id TEXT DEFAULT '',
+        state TEXT NOT NULL DEFAULT 'building',
+        provider_state TEXT DEFAULT '',
+        total INTEGER DEFAULT 0,
+        completed INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        applied INTEGER DEFAULT 0,
+        error TEXT DEFAULT '',
+        created_at TEXT NOT NULL,
+        submitted_at TEXT DEFAULT '',
+        finished_at TEXT DEFAULT '',
+        updated_at TEXT NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_batches_state ON analysis_batches(state)")
+    conn.commit()
+
+
+@_writes
+def create_analysis_batch(conn, provider):
+    now = datetime.utcnow().isoformat()
+    cursor = conn.execute("INSERT INTO analysis_batches (provider, created_at, updated_at) VALUES (?, ?, ?)",
+                          (provider, now, now))
+    conn.commit()
+    return cursor.lastrowid
+
+
+@_writes
+def update_analysis_batch(conn, batch_id, expect_state=None, **fields):
+    """Set any of remote_id/state/provider_state/total/completed/failed/applied/error/submitted_at/finished_at.
+    With expect_state, only if the batch is still in that state. Returns whether the row was updated.
+    """
+    unknown = set(fields) - _BATCH_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown analysis batch fields: {sorted(unknown)}")
+    fields["updated_at"] = datetime.utcnow().isoformat()
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    params = [*fields.values(), batch_id]
+    where = "id = ?"
+    if expect_state is not None:
+        where += " AND state = ?"
+        params.append(expect_state)
+    cursor = conn.execute(f"UPDATE analysis_batches SET {assignments} WHERE {where}", params)
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+@_reads
+def get_analysis_batches(conn, limit=20, states=None):
+    """Most recent batches first; states limits the result to e.g. ("submitted",)."""
+    if states:
+        rows = conn.execute(f"""SELECT * FROM analysis_batches WHERE state IN ({",".join("?" * len(states))})
+                                ORDER BY id DESC LIMIT ?""", (*states, limit)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM analysis_batches ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+@_reads
+def get_analysis_batch(conn, batch_id):
+    row = conn.execute("SELECT * FROM analysis_batches WHERE id = ?", (batch_id,)).fetchone()
+    return dict(row) if row else None
+
+
+@_reads
+def get_leased_workflows(conn, owner):
+    """Workflows whose analysis_queue entries `owner` holds (prompt columns and attempt counts)."""
+    rows = conn.execute("""
+        SELECT w.id, w.name, w.description, w.nodes, w.categories, w.node_count, w.trigger_type, q.attempts
+        FROM analysis_queue q JOIN workflows w ON w.id = q.workflow_id
+        WHERE q.state = 'running' AND q.lease_owner = ?
+    """, (owner,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+# ==================== Analysis cache ====================
+# Copies of one template arrive from many repos under different hashes (and often
+# outside its near-duplicate cluster). Results are cached under a hash of the exact
+# prompt inputs (analyzer.analysis_key), so a copy is analyzed without an LLM call.
+
+def _migrate_analysis_cache(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_cache (
+        input_hash TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        last_hit_at TEXT DEFAULT ''
+    )""")
+    conn.commit()
+
+
+@_reads
+def get_cached_analyses(conn, keys):
+    """Cached update_workflow_ai keyword arguments for the given cache keys: {key: fields}."""
+    if not keys:
+        return {}
+    rows = conn.execute("""SELECT input_hash, result FROM analysis_cache
+                           WHERE input_hash IN (SELECT value FROM json_each(?))""",
+                        (json.dumps(list(set(keys))),)).fetchall()
+    return {r["input_hash"]: json.loads(r["result"]) for r in rows}
@@ -0,0 +1,83 @@
+"""
+Bitmap facet index — facet counts for an arbitrary matching id set in one pass.
+
+Every facet value (category, node, trigger type, difficulty) keeps a bitmap of
+the workflow ids that carry it, stored as a Python int. Counting a facet for
+the current result set is then `(value_bits & match_bits).bit_count()`, which
+costs microseconds per value even at 100k+ workflows.
+"""
+
+import time
+import threading
+
+FACETS = ("category", "node", "trigger_type", "difficulty")
+
+
+def ids_to_bits(ids):
+    """Pack integer ids into a bitmap int (bit N set <=> id N present)."""
+    if not ids:
+        return 0
+    buf = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+class FacetIndex:
+    def __init__(self, max_staleness=5.0):
+        self.max_staleness = max_staleness
+        self.seq = None  # workflow_changes position the bitmaps were built at
+        self.built_at = 0.0
+        self.bitmaps = {facet: {} for facet in FACETS}
+        self.totals = {facet: {} for facet in FACETS}
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self, conn, seq):
+        """Rebuild from the DB if the change log moved past `seq` of the last build (in any
+        process), at most once per max_staleness seconds."""
+        if self.seq == seq:
+            return
+        if self.seq is not None and time.monotonic() - self.built_at < self.max_staleness:
+            return
+        with self._lock:
+            if self.seq != seq:
+                self._build(conn)
+                self.seq = seq
+                self.built_at = time.monotonic()
+
+    def _build(self, conn):
+        postings = {facet: {} for facet in FACETS}
+        for r in conn.execute("SELECT id, trigger_type, ai_difficulty_level FROM workflows"):
+            if r[1]:
+                postings["trigger_type"].setdefault(r[1], []).append(r[0])
+            if r[2]:
+                postings["difficulty"].setdefault(r[2], []).append(r[0])
+        for wf_id, name in conn.execute("SELECT workflow_id, category_name FROM workflow_categories"):
+            postings["category"].setdefault(name, []).append(wf_id)
+        for wf_id, name in conn.execute("SELECT workflow_id, node_name FROM workflow_nodes"):
+            postings["node"].setdefault(name, []).append(wf_id)
+
+        self.bitmaps = {facet: {v: ids_to_bits(ids) for v, ids in values.items()}
+                        for facet, values in postings.items()}
+        self.totals = {facet: {v: len(ids) for v, ids in values.items()}
+                       for facet, values in postings.items()}
+
+    def counts(self, match_ids=None):
+        """Facet counts for the given ids (None = every workflow), sorted by count desc."""
+        bitmaps = self.bitmaps
+        result = {}
+        if match_ids is None:
+            for facet in FACETS:
+                counts = self.totals[facet].items()
+                result[facet] = _sorted_counts(counts)
+            return result
+
+        match = ids_to_bits(match_ids)
+        for facet in FACETS:
+            counts = ((v, (bits & match).bit_count()) for v, bits in bitmaps[facet].items())
+            result[facet] = _sorted_counts(counts)
+        return result
+
+
+def _sorted_counts(pairs):
+    return [{"value": v, "count": c} for v, c in sorted(pairs, key=lambda p: (-p[1], p[0])) if c > 0]
@@ -0,0 +1,167 @@
+"""
+Structural workflow fingerprints — exact and near-duplicate detection.
+
+structure_hash identifies a workflow by what it does rather than by its bytes:
+node types, parameters and connections, with names, ids, positions, credentials
+and key order stripped. Two exports of the same workflow get the
+same hash even when json_hash differs.
+
+For near-duplicates every workflow also gets a (one-permutation) MinHash
+signature over its structural features (node types, typed edges, parameter values). Signatures are
+split into LSH bands; workflows that share a band bucket are candidates, and a
+candidate whose estimated Jaccard similarity reaches NEAR_DUP_THRESHOLD joins
+the same cluster (see database._assign_cluster).
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 bands x 4 rows: ~100% recall at 0.8 similarity, ~64% candidates at 0.5
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.8"))
+
+# Per-node keys that change between exports/instances without changing behaviour
+_VOLATILE_NODE_KEYS = {"id", "name", "type", "position", "webhookId", "credentials", "notes", "notesInFlow",
+                       "color", "alwaysOutputData", "executeOnce", "retryOnFail", "onError"}
+_MAX_VALUE_LEN = 200
+
+_SIG_FORMAT = f"<{MINHASH_PERMUTATIONS}I"
+_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+_DENSIFY_STEP = 0x9E3779B1  # odd constant, keeps borrowed bins distinct from their source
+
+
+# Reused encoder: json.dumps() builds a new one per call when options are passed
+_dump = json.JSONEncoder(sort_keys=True, separators=(",", ":")).encode
+
+
+def _node_items(node):
+    """Sorted (key, canonical JSON value) pairs of a node with `parameters` expanded one level.
+    Each value is dumped once and shared by the structure hash and the MinHash features.
+    """
+    items = []
+    for k, v in node.items():
+        if k in _VOLATILE_NODE_KEYS:
+            continue
+        if k == "parameters" and isinstance(v, dict):
+            items.extend((f"parameters.{pk}", _dump(pv)) for pk, pv in v.items())
+        else:
+            items.append((k, _dump(v)))
+    items.sort()
+    return tuple(items)
+
+
+def _nodes_and_edges(data):
+    """Canonical nodes as (type, items) and edges between their indexes."""
+    nodes = []
+    for node in data.get("nodes") or []:
+        if isinstance(node, dict):
+            nodes.append((str(node.get("type", "")), _node_items(node), node.get("name", "")))
+    # Order nodes by content, not by their position in the file or their display names
+    nodes.sort(key=lambda n: (n[0], n[1]))
+    index = {}
+    for i, node in enumerate(nodes):
+        index.setdefault(node[2], i)
+
+    edges = []
+    connections = data.get("connections") or {}
+    if isinstance(connections, dict):
+        for src, outputs in connections.items():
+            if src not in index or not isinstance(outputs, dict):
+                continue
+            for out_type, branches in outputs.items():
+                for out_idx, targets in enumerate(branches or []):
+                    for t in targets or []:
+                        if isinstance(t, dict) and t.get("node") in index:
+                            edges.append((index[src], out_type, out_idx, index[t["node"]],
+                                          t.get("type", out_type), t.get("index", 0)))
+    edges.sort()
+    return [n[:2] for n in nodes], edges
+
+
+def canonical_structure(data):
+    """JSON-serializable canonical form of a workflow dict (what structure_hash is taken over)."""
+    nodes, edges = _nodes_and_edges(data)
+    return {"nodes": [[t, [list(item) for item in items]] for t, items in nodes], "edges": [list(e) for e in edges]}
+
+
+def features(nodes, edges):
+    """Feature set for MinHash: node types, typed edges and top-level parameter values.
+    Repeated features are numbered so multiplicity counts (two HTTP nodes != one).
+    """
+    raw = []
+    for ntype, items in nodes:
+        raw.append(f"n:{ntype}")
+        raw.extend(f"p:{ntype}:{k}={v[:_MAX_VALUE_LEN]}" for k, v in items)
+    for src, out_type, _, dst, _, _ in edges:
+        raw.append(f"e:{nodes[src][0]}>{out_type}>{nodes[dst][0]}")
+    seen = {}
+    result = set()
+    for f in raw:
+        k = seen.get(f, 0)
+        seen[f] = k + 1
+        result.add(f"{f}#{k}")
+    return result
+
+
+def minhash(feature_set):
+    """MinHash signature as bytes, by one-permutation hashing: each feature is hashed once,
+    the low bits pick one of MINHASH_PERMUTATIONS bins and the bin keeps the minimum of the
+    high 32 bits. An empty bin takes the value of the next non-empty bin to its right, offset
+    by the distance (rotation densification), so small workflows still get comparable bins.
+    """
+    if not feature_set:
+        return b""
+    bins = [None] * MINHASH_PERMUTATIONS
+    for f in feature_set:
+        h = int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "little")
+        b, v = h % MINHASH_PERMUTATIONS, h >> 32
+        if bins[b] is None or v < bins[b]:
+            bins[b] = v
+    signature = []
+    for i in range(MINHASH_PERMUTATIONS):
+        j = 0
+        while bins[(i + j) % MINHASH_PERMUTATIONS] is None:
+            j += 1
+        signature.append((bins[(i + j) % MINHASH_PERMUTATIONS] + j * _DENSIFY_STEP) & 0xFFFFFFFF)
+    return struct.pack(_SIG_FORMAT, *signature)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of the feature sets behind two signatures."""
+    if not sig_a or not sig_b:
+        return 0.0
+    a, b = struct.unpack(_SIG_FORMAT, sig_a), struct.unpack(_SIG_FORMAT, sig_b)
+    return sum(x == y for x, y in zip(a, b)) / MINHASH_PERMUTATIONS
+
+
+def lsh_buckets(signature):
+    """One signed 64-bit bucket key per LSH band (band number is mixed in, so keys never collide across bands)."""
+    if not signature:
+        return []
+    step = _ROWS * 4
+    return [int.from_bytes(hashlib.blake2b(bytes([band]) + signature[band * step:(band + 1) * step],
+                                           digest_size=8).digest(), "big", signed=True)
+            for band in range(LSH_BANDS)]
+
+
+def fingerprint(data):
+    """(structure_hash, minhash signature) for a parsed workflow dict."""
+    nodes, edges = _nodes_and_edges(data)
+    canonical = _dump({"nodes": nodes, "edges": edges})
+    structure_hash = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+    return structure_hash, minhash(features(nodes, edges))
+
+
+def fingerprint_json(json_str):
+    """fingerprint() for a raw JSON body; ("", b"") if it isn't a workflow object."""
+    try:
+        data = json.loads(json_str) if isinstance(json_str, str) else json_str
+    except ValueError:
+        return "", b""
+    if isinstance(data, list):
+        data = data[0] if data and isinstance(data[0], dict) else {}
+    if not isinstance(data, dict):
+        return "", b""
+    return fingerprint(data)
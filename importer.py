@@ -5,17 +5,45 @@ import re
 import asyncio
 import logging
 import zipfile
-import io
+import time
+import shutil
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
 import httpx
 
-from database import insert_workflow, insert_workflows_batch, add_github_repo, update_repo_sync, get_db
+import async_db as db
+from database import pack_blob
+from fingerprint import fingerprint
 
 logger = logging.getLogger(__name__)
 
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN", "")
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", "0")) or (os.cpu_count() or 1)
+IMPORT_CHUNK_SIZE = 64   # files per process-pool task
+IMPORT_BATCH_SIZE = 500  # workflows per insert_workflows_batch call
+ZIP_SPOOL_MAX_BYTES = int(os.environ.get("ZIP_SPOOL_MAX_MB", "16")) * 1024 * 1024
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Overridable so sync can be exercised against a local fake GitHub server
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_RAW_URL = os.environ.get("GITHUB_RAW_URL", "https://raw.githubusercontent.com").rstrip("/")
+GITHUB_WEB_URL = os.environ.get("GITHUB_WEB_URL", "https://github.com").rstrip("/")
+SYNC_FETCH_CONCURRENCY = 8
+SYNC_CONCURRENCY = int(os.environ.get("SYNC_CONCURRENCY", "4"))  # repos synced at once
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+GITHUB_RATE_LIMIT_RESERVE = 5   # pause API calls once this few requests remain
+GITHUB_MAX_BACKOFF = 300        # never sleep longer than this (s) for a rate limit; fail instead
+GITHUB_MAX_RETRIES = 3
+GITHUB_DEFAULT_BACKOFF = 60     # s, when a rate-limit response carries no usable hint
+
+_http = None            # shared httpx.AsyncClient, see _client()
+_rate_reset_at = 0.0    # epoch seconds until which GitHub API calls wait
 
 # Node type -> category mapping
 NODE_CATEGORIES = {
@@ -95,6 +123,125 @@ def _github_headers():
     return headers
 
 
+def _client() -> httpx.AsyncClient:
+    """The shared pooled client (opened lazily for scripts that skip the app lifespan)."""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60, connect=15),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+    return _http
+
+
+async def start_http():
+    """Open the shared HTTP client (app lifespan startup)."""
+    _client()
+
+
+async def close_http():
+    """Close the shared HTTP client (app lifespan shutdown)."""
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+def _rate_limit_delay(resp: httpx.Response):
+    """Seconds to wait before retrying a rate-limited response (None if it isn't one).
+    Also arms the shared pause when the primary limit is nearly used up.
+    """
+    global _rate_reset_at
+    remaining = _header_number(resp, "X-RateLimit-Remaining")
+    reset = _header_number(resp, "X-RateLimit-Reset")
+    if remaining is not None and reset and remaining <= GITHUB_RATE_LIMIT_RESERVE:
+        _rate_reset_at = max(_rate_reset_at, reset)
+
+    if resp.status_code not in (403, 429):
+        return None
+    if resp.headers.get("Retry-After"):
+        delay = _retry_after(resp.headers["Retry-After"])
+        return max(1.0, GITHUB_DEFAULT_BACKOFF if delay is None else delay)
+    if remaining == 0:
+        return max(1.0, reset - time.time()) if reset else GITHUB_DEFAULT_BACKOFF
+    return None
+
+
+def _header_number(resp: httpx.Response, name: str):
+    """A numeric header value, or None if it is missing or malformed."""
+    try:
+        return float(resp.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry_after(value: str):
+    """Seconds to wait from a Retry-After value — delay-seconds or an HTTP-date (RFC 9110) — or None."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp() - time.time()
+
+
+async def _github_get(url: str, **kwargs) -> httpx.Response:
+    """GET via the shared client with GitHub auth, honouring rate-limit headers."""
+    for attempt in range(GITHUB_MAX_RETRIES + 1):
+        wait = _rate_reset_at - time.time()
+        if wait > 0:
+            logger.warning(f"GitHub rate limit nearly exhausted, pausing {min(wait, GITHUB_MAX_BACKOFF):.0f}s")
+            await asyncio.sleep(min(wait, GITHUB_MAX_BACKOFF))
+        resp = await _client().get(url, headers=_github_headers(), **kwargs)
+        delay = _rate_limit_delay(resp)
+        if delay is None or attempt == GITHUB_MAX_RETRIES or delay > GITHUB_MAX_BACKOFF:
+            return resp
+        logger.warning(f"GitHub rate limited (HTTP {resp.status_code}) on {url}, retrying in {delay:.0f}s")
+        await asyncio.sleep(delay)
+    return resp
+
+
+class ImportProgress:
+    """Live progress of one import: processed/total items and seconds spent per stage
+    (download, extract, parse, insert). Importers update it in place; jobs.py persists it.
+    """
+
+    def __init__(self):
+        self.stage_name = ""
+        self.processed = 0
+        self.total = 0
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        self.stage_name = name
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - t0
+
+    def snapshot(self):
+        return {"stage": self.stage_name, "processed": self.processed, "total": self.total,
+                "timings": {k: round(v, 3) for k, v in self.timings.items()}}
+
+
+def git_blob_sha(data: bytes) -> str:
+    """The SHA-1 git assigns to file contents (same as the trees API `sha`)."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def workflow_hash(json_str: str) -> str:
+    """The json_hash stored for a workflow body (its UNIQUE dedup key)."""
+    return hashlib.sha256(json_str.encode()).hexdigest()[:16]
+
+
 def parse_workflow_json(json_str: str) -> dict:
     """Parse n8n workflow JSON and extract metadata."""
     if not json_str or len(json_str) < 50:
@@ -156,7 +303,8 @@ def parse_workflow_json(json_str: str) -> dict:
             if len(node_names) > 10:
                 description += f" (+{len(node_names) - 10})"
 
-    json_hash = hashlib.sha256(json_str.encode()).hexdigest()[:16]
+    json_hash = workflow_hash(json_str)
+    structure_hash, signature = fingerprint(data)
 
     return {
         "name": name,
@@ -167,29 +315,49 @@ def parse_workflow_json(json_str: str) -> dict:
         "trigger_type": trigger_type,
         "json_content": json_str,
         "json_hash": json_hash,
+        "structure_hash": structure_hash,
+        "minhash": signature,
+        "blob": pack_blob(json_str),  # compressed here so the DB writer doesn't have to
     }
 
 
+def _hub_record_hash(rec: dict) -> str:
+    """json_hash of a Hub record: the one it carries, else its body's (as import_hub_records stores it)."""
+    if rec.get("json_hash"):
+        return rec["json_hash"]
+    body = rec.get("json_content", "")
+    if isinstance(body, (list, dict)):
+        body = json.dumps(body)
+    return workflow_hash(body)
+
+
+def _is_hub_export(data) -> bool:
+    """Hub Export / backup: a list of workflow rows that carry AI fields."""
+    return isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict) and "ai_summary" in data[0]
+
+
 async def import_from_json(json_str: str, source_url: str = "", source_repo: str = "", analyze: bool = False) -> dict:
     """Import a single workflow or a batch of Hub records (backup)."""
     try:
         data = json.loads(json_str)
-        # Check if it's a Hub Export (list of dicts with ai fields)
-        if isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict) and "ai_summary" in data[0]:
-            from database import import_hub_records
-            imported, duplicates = import_hub_records(data)
+        if _is_hub_export(data):
+            known = await db.get_json_hashes()
+            fresh = [rec for rec in data if not _is_known_hash(_hub_record_hash(rec), known)]
+            imported, duplicates = await db.import_hub_records(fresh) if fresh else (0, 0)
+            skipped = len(data) - len(fresh)
             return {
                 "status": "ok",
                 "batch": True,
                 "imported": imported,
-                "duplicates": duplicates,
+                "duplicates": duplicates + skipped,
+                "skipped_early": skipped,
                 "name": f"Backup ({len(data)} items)"
             }
     except Exception as e:
         logger.warning(f"Failed to check for hub-export format: {e}")
 
     parsed = parse_workflow_json(json_str)
-    wf_id = insert_workflow(
+    wf_id = await db.insert_workflow(
         name=parsed["name"],
         description=parsed["description"],
         nodes=parsed["nodes"],
@@ -200,6 +368,8 @@ async def import_from_json(json_str: str, source_url: str = "", source_repo: str
         source_repo=source_repo,
         json_content=parsed["json_content"],
         json_hash=parsed["json_hash"],
+        structure_hash=parsed["structure_hash"],
+        minhash=parsed["minhash"],
     )
     if wf_id:
         return {"status": "ok", "id": wf_id, "name": parsed["name"]}
@@ -207,24 +377,62 @@ async def import_from_json(json_str: str, source_url: str = "", source_repo: str
         return {"status": "duplicate", "name": parsed["name"]}
 
 
-async def import_from_directory(dir_path: str, source_repo: str = "", analyze: bool = False) -> dict:
-    """Import all JSON workflow files from a local directory (batch mode)."""
-    p = Path(dir_path)
-    if not p.is_dir():
-        return {"status": "error", "message": f"Папку не знайдено: {dir_path}"}
+# json_hash values already in the DB, handed to each process-pool worker by _init_parse_worker
+_worker_hashes = None
 
-    json_files = sorted(p.glob("*.json"))
-    if not json_files:
-        return {"status": "error", "message": "JSON файлів не знайдено"}
 
-    logger.info(f"Found {len(json_files)} JSON files in {dir_path}")
+def _init_parse_worker(known):
+    global _worker_hashes
+    _worker_hashes = known
+
+
+@contextmanager
+def _parse_pool(workers, known):
+    """A process pool for one import, its workers seeded with the `known` hash set.
+
+    On exit — including an insert error or a cancelled request/job — queued chunks are
+    dropped and the pool is shut down without waiting, so the event loop never blocks
+    on the remaining parse work. (The pool is per import because `known` is shipped
+    once through the initializer instead of with every chunk.)
+    """
+    # spawn: the parent runs DB/executor threads, which fork() would copy in a broken state
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_parse_worker, initargs=(known,))
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _is_known(content, known):
+    """True if this exact body is already stored (or was seen earlier in this import).
+    Checked before parse_workflow_json, so duplicates skip parsing, compression and SQLite.
+    """
+    if known is None:
+        return False
+    return _is_known_hash(workflow_hash(content), known)
 
-    # Parse all files first, then batch insert
+
+def _is_known_hash(h, known):
+    """_is_known() for an already computed json_hash."""
+    if h in known:
+        return True
+    known.add(h)
+    return False
+
+
+def _parse_files(json_files, source_repo="", known=None):
+    """Read and parse workflow files, skipping bodies whose hash is in `known`.
+    Returns (parsed_list, error_count, skipped_count).
+    """
     batch = []
-    errors = 0
+    errors = skipped = 0
     for f in json_files:
         try:
             content = f.read_text(encoding="utf-8")
+            if _is_known(content, known):
+                skipped += 1
+                continue
             parsed = parse_workflow_json(content)
             parsed["source_url"] = f"file://{f.name}"
             parsed["source_repo"] = source_repo
@@ -235,23 +443,211 @@ async def import_from_directory(dir_path: str, source_repo: str = "", analyze: b
 
         if len(batch) % 500 == 0 and len(batch) > 0:
             logger.info(f"Parsed {len(batch) + errors}/{len(json_files)} files...")
+    return batch, errors, skipped
 
-    logger.info(f"Parsed {len(batch)} workflows, {errors} errors. Inserting into DB...")
 
-    imported, duplicates = insert_workflows_batch(batch)
+def _parse_chunk(paths, source_repo=""):
+    """Process-pool task: read, decode, parse and hash a chunk of files.
+    json_content is dropped from the results (the compressed blob carries the body)
+    to halve the data pickled back to the parent.
+    """
+    batch, errors, skipped = _parse_files([Path(p) for p in paths], source_repo, _worker_hashes)
+    for parsed in batch:
+        parsed["json_content"] = ""
+    return batch, errors, skipped
 
-    logger.info(f"Import complete: {imported} new, {duplicates} duplicates, {errors} errors")
+
+async def import_from_directory(dir_path: str, source_repo: str = "", analyze: bool = False,
+                                workers: int = None, progress: ImportProgress = None) -> dict:
+    """Import all JSON workflow files from a local directory (batch mode).
+    workers > 1 spreads parsing over a process pool and streams parsed batches into
+    the DB while later chunks are still being parsed; workers=1 parses serially.
+    """
+    p = Path(dir_path)
+    if not p.is_dir():
+        return {"status": "error", "message": f"Папку не знайдено: {dir_path}"}
+
+    json_files = sorted(p.glob("*.json"))
+    if not json_files:
+        return {"status": "error", "message": "JSON файлів не знайдено"}
+
+    workers = workers or IMPORT_WORKERS
+    progress = progress or ImportProgress()
+    progress.total = len(json_files)
+    logger.info(f"Found {len(json_files)} JSON files in {dir_path}")
+    started = time.perf_counter()
+    known = await db.get_json_hashes()
+
+    if workers <= 1 or len(json_files) <= IMPORT_CHUNK_SIZE:
+        workers = 1
+        # Parse all files first (off the event loop), then batch insert
+        with progress.stage("parse"):
+            batch, errors, skipped = await asyncio.to_thread(_parse_files, json_files, source_repo, known)
+        logger.info(f"Parsed {len(batch)} workflows, {skipped} already known, {errors} errors. Inserting into DB...")
+        imported = duplicates = 0
+        progress.processed = errors + skipped
+        for i in range(0, len(batch), IMPORT_BATCH_SIZE):
+            with progress.stage("insert"):
+                new, dups = await db.insert_workflows_batch(batch[i:i + IMPORT_BATCH_SIZE])
+            imported += new
+            duplicates += dups
+            progress.processed += len(batch[i:i + IMPORT_BATCH_SIZE])
+    else:
+        imported, duplicates, errors, skipped = await _import_files_parallel(
+            json_files, source_repo, workers, progress, known)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Import complete: {imported} new, {duplicates + skipped} duplicates ({skipped} skipped early), "
+                f"{errors} errors in {elapsed:.2f}s ({len(json_files) / elapsed:.0f} files/s, {workers} workers)")
 
     return {
         "status": "ok",
         "imported": imported,
-        "duplicates": duplicates,
+        "duplicates": duplicates + skipped,
+        "skipped_early": skipped,
         "errors": errors,
         "total_files": len(json_files),
+        "workers": workers,
+        "elapsed_sec": round(elapsed, 3),
+        "files_per_sec": round(len(json_files) / elapsed, 1) if elapsed else None,
     }
 
 
-async def import_from_url(url: str, analyze: bool = False) -> dict:
+async def _import_files_parallel(json_files, source_repo, workers, progress, known=None):
+    """Parse file chunks on a process pool; insert each full batch as soon as it is ready.
+    Each worker gets its own copy of `known`, so a body repeated across chunks is only
+    caught by the INSERT OR IGNORE.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = [[str(f) for f in json_files[i:i + IMPORT_CHUNK_SIZE]]
+              for i in range(0, len(json_files), IMPORT_CHUNK_SIZE)]
+    imported = duplicates = errors = skipped = done = 0
+    pending = []
+    parsed_files = 0
+
+    with _parse_pool(workers, known) as pool:
+        futures = [loop.run_in_executor(pool, _parse_chunk, chunk, source_repo) for chunk in chunks]
+        for fut in asyncio.as_completed(futures):
+            with progress.stage("parse"):
+                parsed, errs, skips = await fut
+            pending.extend(parsed)
+            errors += errs
+            skipped += skips
+            parsed_files += len(parsed) + errs + skips
+            done += 1
+            if len(pending) >= IMPORT_BATCH_SIZE or done == len(chunks):
+                with progress.stage("insert"):
+                    new, dups = await db.insert_workflows_batch(pending)
+                imported += new
+                duplicates += dups
+                pending = []
+                progress.processed = parsed_files
+                logger.info(f"Import progress: {done}/{len(chunks)} chunks "
+                            f"(+{imported} new, {duplicates + skipped} dup, {errors} err)")
+    return imported, duplicates, errors, skipped
+
+
+def _spool_uploads(uploads, tmp_dir):
+    """Copy uploads to tmp_dir in chunks, expanding ZIP archives into their .json members.
+    Returns [(display_name, path)] in upload order.
+    """
+    entries = []
+    for n, (name, fileobj) in enumerate(uploads):
+        path = os.path.join(tmp_dir, f"{n}.upload")
+        with open(path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, ZIP_CHUNK_SIZE)
+        if not zipfile.is_zipfile(path):
+            entries.append((name, path))
+            continue
+        with zipfile.ZipFile(path) as zf:
+            for m, zi in enumerate(zf.infolist()):
+                if zi.is_dir() or not zi.filename.lower().endswith(".json") or zi.filename.startswith("__MACOSX/"):
+                    continue
+                member_path = os.path.join(tmp_dir, f"{n}-{m}.json")
+                with zf.open(zi) as src, open(member_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+                entries.append((f"{name}/{zi.filename}", member_path))
+        os.remove(path)
+    return entries
+
+
+def _parse_upload_chunk(entries, known=None):
+    """Process-pool task for uploads: [(name, path)] -> [(name, parsed or None, status, message)].
+    status is "ok", "duplicate" (hash already known), "error" or "hub" (a Hub backup, imported separately).
+    """
+    known = _worker_hashes if known is None else known
+    out = []
+    for name, path in entries:
+        try:
+            content = Path(path).read_text(encoding="utf-8-sig")  # tolerate a BOM
+            if content.lstrip().startswith("["):
+                try:
+                    if _is_hub_export(json.loads(content)):
+                        out.append((name, None, "hub", ""))
+                        continue
+                except ValueError:
+                    pass
+            if _is_known(content, known):
+                out.append((name, None, "duplicate", ""))
+                continue
+            parsed = parse_workflow_json(content)
+            parsed["json_content"] = ""  # the blob carries the body
+            parsed["source_url"] = f"upload:{name}"
+            out.append((name, parsed, "ok", ""))
+        except Exception as e:
+            out.append((name, None, "error", str(e)))
+    return out
+
+
+async def import_uploads(uploads, workers: int = None) -> list:
+    """Import uploaded files given as (filename, binary file object) pairs; ZIPs are expanded.
+    Files are spooled to disk, parsed in parallel and inserted in batches.
+    Returns one {"name", "status": ok|duplicate|error, ...} entry per workflow file.
+    """
+    workers = workers or IMPORT_WORKERS
+    known = await db.get_json_hashes()
+    with tempfile.TemporaryDirectory(prefix="n8nhub-upload-") as tmp:
+        entries = await asyncio.to_thread(_spool_uploads, uploads, tmp)
+        if workers <= 1 or len(entries) <= IMPORT_CHUNK_SIZE * 2:
+            parsed = await asyncio.to_thread(_parse_upload_chunk, entries, known)
+        else:
+            loop = asyncio.get_running_loop()
+            chunks = [entries[i:i + IMPORT_CHUNK_SIZE] for i in range(0, len(entries), IMPORT_CHUNK_SIZE)]
+            with _parse_pool(workers, known) as pool:
+                done = await asyncio.gather(*(loop.run_in_executor(pool, _parse_upload_chunk, c) for c in chunks))
+            parsed = [item for chunk in done for item in chunk]
+
+        results = [None] * len(parsed)
+        for idx, (name, _, status, message) in enumerate(parsed):
+            if status == "error":
+                results[idx] = {"name": name, "status": "error", "message": message}
+            elif status == "duplicate":
+                results[idx] = {"name": name, "status": "duplicate"}
+            elif status == "hub":
+                try:
+                    content = Path(entries[idx][1]).read_text(encoding="utf-8-sig")
+                    res = await import_from_json(content, source_url=f"upload:{name}")
+                    results[idx] = {"name": name, "status": res["status"],
+                                    "message": f"+{res.get('imported', 0)}, {res.get('duplicates', 0)} dup"}
+                except Exception as e:
+                    results[idx] = {"name": name, "status": "error", "message": str(e)}
+
+    pending = [(idx, p) for idx, (_, p, status, _) in enumerate(parsed) if status == "ok"]
+    for i in range(0, len(pending), IMPORT_BATCH_SIZE):
+        group = pending[i:i + IMPORT_BATCH_SIZE]
+        ids = await db.insert_workflows_batch([p for _, p in group], return_ids=True)
+        for (idx, p), wf_id in zip(group, ids):
+            name = parsed[idx][0]
+            results[idx] = ({"name": name, "status": "ok", "id": wf_id} if wf_id
+                            else {"name": name, "status": "duplicate"})
+
+    skipped = sum(status == "duplicate" for _, _, status, _ in parsed)
+    logger.info(f"Upload import: {sum(r['status'] == 'ok' for r in results)} new out of {len(results)} files "
+                f"({skipped} known duplicates skipped before parsing)")
+    return results
+
+
+async def import_from_url(url: str, analyze: bool = False, progress: ImportProgress = None) -> dict:
     """Import workflow(s) from a URL - GitHub file, GitHub repo dir, or n8n.io."""
     url = url.strip()
 
@@ -266,11 +662,11 @@ async def import_from_url(url: str, analyze: bool = False) -> dict:
 
     # GitHub repo or directory
     if "github.com" in url and "/tree/" in url:
-        return await _import_github_dir(url, analyze=analyze)
+        return await _import_github_dir(url, analyze=analyze, progress=progress)
 
     # GitHub repo root (no /tree/)
     if re.match(r"https?://github\.com/[\w.\-]+/[\w.\-]+/?$", url):
-        return await _import_github_dir(url, analyze=analyze)
+        return await _import_github_dir(url, analyze=analyze, progress=progress)
 
     # n8n.io workflow URL
     if "n8n.io/workflows/" in url:
@@ -285,20 +681,16 @@ async def import_from_url(url: str, analyze: bool = False) -> dict:
 
 async def _import_github_raw(raw_url: str, analyze: bool = False) -> dict:
     """Import a single JSON file from GitHub raw URL."""
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.get(raw_url, headers=_github_headers())
-        if resp.status_code != 200:
-            return {"status": "error", "message": f"HTTP {resp.status_code}"}
-        return await import_from_json(resp.text, source_url=raw_url, analyze=analyze)
+    resp = await _github_get(raw_url, timeout=30)
+    if resp.status_code != 200:
+        return {"status": "error", "message": f"HTTP {resp.status_code}"}
+    return await import_from_json(resp.text, source_url=raw_url, analyze=analyze)
 
 
-async def _get_default_branch(client: httpx.AsyncClient, owner: str, repo: str) -> str:
+async def _get_default_branch(owner: str, repo: str) -> str:
     """Discover the default branch of a GitHub repo."""
     try:
-        resp = await client.get(
-            f"https://api.github.com/repos/{owner}/{repo}",
-            headers=_github_headers()
-        )
+        resp = await _github_get(f"{GITHUB_API_URL}/repos/{owner}/{repo}")
         if resp.status_code == 200:
             return resp.json().get("default_branch", "main")
     except Exception:
@@ -306,7 +698,31 @@ async def _get_default_branch(client: httpx.AsyncClient, owner: str, repo: str)
     return "main"
 
 
-async def _import_github_dir(url: str, analyze: bool = False) -> dict:
+async def _get_branch_head(owner: str, repo: str, branch: str) -> str:
+    """Commit SHA the branch currently points at ('' if it can't be determined)."""
+    try:
+        resp = await _github_get(f"{GITHUB_API_URL}/repos/{owner}/{repo}/branches/{branch}")
+        if resp.status_code == 200:
+            return resp.json()["commit"]["sha"]
+    except Exception as e:
+        logger.warning(f"Branch head lookup failed for {owner}/{repo}@{branch}: {e}")
+    return ""
+
+
+async def _get_json_tree(owner: str, repo: str, commit_sha: str):
+    """{path: blob_sha} of every .json file at the commit, or None if the tree is unavailable/truncated."""
+    resp = await _github_get(f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/{commit_sha}",
+                             params={"recursive": "1"})
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    if data.get("truncated"):
+        return None
+    return {e["path"]: e["sha"] for e in data.get("tree", [])
+            if e.get("type") == "blob" and e["path"].endswith(".json")}
+
+
+async def _import_github_dir(url: str, analyze: bool = False, progress: ImportProgress = None) -> dict:
     """Import all JSON files from a GitHub repo by downloading ZIP archive.
     This avoids git/trees truncation and Contents API limits for large repos.
     """
@@ -315,87 +731,170 @@ async def _import_github_dir(url: str, analyze: bool = False) -> dict:
         return {"status": "error", "message": "Невірний GitHub URL"}
 
     owner, repo_name, tree_part = match.groups()
-    repo_url = f"https://github.com/{owner}/{repo_name}"
 
     # Determine branch and path filter
-    async with httpx.AsyncClient(timeout=60) as client:
-        if tree_part:
-            parts = tree_part.split("/")
-            branch = parts[0]
-            path_filter = "/".join(parts[1:]) if len(parts) > 1 else ""
-        else:
-            branch = await _get_default_branch(client, owner, repo_name)
-            path_filter = ""
+    if tree_part:
+        parts = tree_part.split("/")
+        branch = parts[0]
+        path_filter = "/".join(parts[1:]) if len(parts) > 1 else ""
+    else:
+        branch = await _get_default_branch(owner, repo_name)
+        path_filter = ""
+    head = await _get_branch_head(owner, repo_name, branch)
 
-    # Download ZIP archive (single request, no truncation)
-    zip_url = f"https://github.com/{owner}/{repo_name}/archive/refs/heads/{branch}.zip"
-    logger.info(f"Downloading ZIP archive from {zip_url}...")
+    return await _import_github_zip(owner, repo_name, branch, path_filter, head, progress)
 
-    async with httpx.AsyncClient(timeout=300, follow_redirects=True) as client:
-        resp = await client.get(zip_url)
-        if resp.status_code != 200:
-            return {"status": "error", "message": f"ZIP download failed: HTTP {resp.status_code}"}
 
-    logger.info(f"ZIP downloaded: {len(resp.content) / 1024 / 1024:.1f} MB. Extracting JSON files...")
+async def _import_github_zip(owner: str, repo_name: str, branch: str, path_filter: str = "",
+                             head: str = "", progress: ImportProgress = None) -> dict:
+    """Full import from the repo archive; also records the commit and file manifest for incremental sync."""
+    repo_url = f"https://github.com/{owner}/{repo_name}"
+    progress = progress or ImportProgress()
 
-    # Extract JSON files from ZIP
-    imported = 0
-    duplicates = 0
+    # Download ZIP archive (single request, no truncation), streamed to a spooled temp file.
+    # Pinning it to the head commit keeps the archive and the recorded SHA consistent.
+    ref = head or f"refs/heads/{branch}"
+    zip_url = f"{GITHUB_WEB_URL}/{owner}/{repo_name}/archive/{ref}.zip"
+    logger.info(f"Downloading ZIP archive from {zip_url}...")
+
+    counts = _new_counts()
     errors = 0
-    batch = []
-    BATCH_SIZE = 500
     total_json = 0
+    manifest = {}
+
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES) as spool:
+        size = 0
+        with progress.stage("download"):
+            async with _client().stream("GET", zip_url, timeout=300) as resp:
+                if resp.status_code != 200:
+                    return {"status": "error", "message": f"ZIP download failed: HTTP {resp.status_code}"}
+                async for chunk in resp.aiter_bytes(ZIP_CHUNK_SIZE):
+                    spool.write(chunk)
+                    size += len(chunk)
+        spool.seek(0)
+
+        logger.info(f"ZIP downloaded: {size / 1024 / 1024:.1f} MB. Extracting JSON files...")
+
+        with zipfile.ZipFile(spool) as zf:
+            entries = zf.infolist()
+            if not entries:
+                return {"status": "error", "message": "Порожній ZIP архів"}
+            # GitHub puts the commit SHA in the archive comment
+            if not head and re.fullmatch(rb"[0-9a-f]{40}", zf.comment or b""):
+                head = zf.comment.decode()
+            # ZIP root folder is "repo_name-branch/" with '/' in the branch name replaced,
+            # so take it from the archive itself
+            zip_prefix = entries[0].filename.split("/", 1)[0] + "/"
+            target_prefix = zip_prefix + (path_filter + "/" if path_filter else "")
+
+            # Filter on the central directory only; member data is read lazily below
+            json_infos = [zi for zi in entries
+                          if not zi.is_dir() and zi.filename.endswith(".json")
+                          and zi.filename.startswith(target_prefix)]
+            total_json = len(json_infos)
+            progress.total = total_json
+            logger.info(f"Found {total_json} JSON files in ZIP archive")
+
+            raw_base = f"{GITHUB_RAW_URL}/{owner}/{repo_name}/{branch}/"
+            # Drop rows whose files are gone from the imported scope before upserting, so a
+            # file moved to a new path isn't rejected as a duplicate of its old row
+            seen = {raw_base + zi.filename[len(zip_prefix):] for zi in json_infos}
+            gone = {u for u in await db.get_source_urls(repo_url) if u} - seen
+            if path_filter:
+                gone = {u for u in gone if u.startswith(raw_base + path_filter + "/")}
+            counts["removed"] += await db.delete_workflows_by_source(gone)
+            # Loaded after the prune, so a moved file's old row doesn't mask it
+            known = await db.get_json_hashes()
+
+            for i in range(0, total_json, IMPORT_BATCH_SIZE):
+                batch, errs, shas, skipped = await asyncio.to_thread(
+                    _parse_zip_members, zf, json_infos[i:i + IMPORT_BATCH_SIZE], zip_prefix, raw_base, repo_url,
+                    progress, known)
+                errors += errs
+                counts["skipped_early"] += skipped
+                manifest.update(shas)
+                with progress.stage("insert"):
+                    _add_counts(counts, await db.upsert_workflows_batch(batch))
+                progress.processed = len(manifest)
+                logger.info(f"Import progress: {min(i + IMPORT_BATCH_SIZE, total_json)}/{total_json} "
+                            f"(+{counts['added']} new, {counts['updated']} upd, "
+                            f"{counts['duplicates']} dup, {counts['skipped_early']} known, {errors} err)")
+
+    logger.info(f"GitHub import complete: {counts['added']} new, {counts['updated']} upd, "
+                f"{counts['removed']} removed, {counts['duplicates']} dup, {counts['skipped_early']} known, "
+                f"{errors} err out of {total_json}")
 
-    # ZIP root folder is typically "repo_name-branch/"
-    zip_prefix = f"{repo_name}-{branch}/"
-    target_prefix = zip_prefix + (path_filter + "/" if path_filter else "")
+    # Register repo for sync
+    await db.add_github_repo(repo_url)
+    await db.update_repo_manifest(repo_url, manifest, replace=True)
+    await db.update_repo_sync(repo_url, commit_sha=head or None, branch=branch)
 
-    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
-        json_names = [n for n in zf.namelist() if n.endswith(".json") and n.startswith(target_prefix)]
-        total_json = len(json_names)
-        logger.info(f"Found {total_json} JSON files in ZIP archive")
+    return _sync_result("full", counts, errors, total_json, head)
 
-        for i, name in enumerate(json_names):
-            try:
-                content = zf.read(name).decode("utf-8")
-                parsed = parse_workflow_json(content)
-                # Build a raw URL for reference
-                rel_path = name[len(zip_prefix):]
-                parsed["source_url"] = f"https://raw.githubusercontent.com/{owner}/{repo_name}/{branch}/{rel_path}"
-                parsed["source_repo"] = repo_url
-                batch.append(parsed)
-            except Exception as e:
-                logger.warning(f"Error parsing {name}: {e}")
-                errors += 1
 
-            if len(batch) >= BATCH_SIZE:
-                new, dups = insert_workflows_batch(batch)
-                imported += new
-                duplicates += dups
-                batch = []
-                logger.info(f"Import progress: {i + 1}/{total_json} "
-                            f"(+{imported} new, {duplicates} dup, {errors} err)")
+def _new_counts():
+    return dict.fromkeys(("added", "updated", "unchanged", "duplicates", "reset", "removed", "skipped_early"), 0)
 
-    if batch:
-        new, dups = insert_workflows_batch(batch)
-        imported += new
-        duplicates += dups
-    
-    logger.info(f"GitHub import complete: {imported} new, {duplicates} dup, {errors} err out of {total_json}")
 
-    # Register repo for sync
-    add_github_repo(repo_url)
-    update_repo_sync(repo_url, imported)
+def _add_counts(total, counts):
+    for k, v in counts.items():
+        total[k] += v
+
 
+def _sync_result(mode, counts, errors, total_files, head):
     return {
         "status": "ok",
-        "imported": imported,
-        "duplicates": duplicates,
+        "mode": mode,
+        "imported": counts["added"],
+        "updated": counts["updated"],
+        "removed": counts["removed"],
+        "unchanged": counts["unchanged"],
+        "duplicates": counts["duplicates"],
+        "skipped_early": counts["skipped_early"],
+        "reanalyze": counts["reset"],
         "errors": errors,
-        "total_files": total_json,
+        "total_files": total_files,
+        "commit": head,
     }
 
 
+def _parse_repo_files(items, raw_base, repo_url, known=None):
+    """Parse (path, bytes) pairs from one repo. Returns (batch, errors, {path: blob_sha}, skipped).
+    Bodies whose hash is in `known` are left out of the batch: the DB already has them, so the
+    upsert would only count them as unchanged or duplicate.
+    """
+    batch = []
+    errors = skipped = 0
+    shas = {}
+    for path, data in items:
+        shas[path] = git_blob_sha(data)
+        try:
+            content = data.decode("utf-8")
+            if _is_known(content, known):
+                skipped += 1
+                continue
+            parsed = parse_workflow_json(content)
+            # Build a raw URL for reference
+            parsed["source_url"] = raw_base + path
+            parsed["source_repo"] = repo_url
+            batch.append(parsed)
+        except Exception as e:
+            logger.warning(f"Error parsing {path}: {e}")
+            errors += 1
+    return batch, errors, shas, skipped
+
+
+def _parse_zip_members(zf, infos, zip_prefix, raw_base, repo_url, progress, known=None):
+    """Read and parse one slice of ZIP members; only this slice is held in memory."""
+    items = []
+    with progress.stage("extract"):
+        for zi in infos:
+            with zf.open(zi) as f:
+                items.append((zi.filename[len(zip_prefix):], f.read()))
+    with progress.stage("parse"):
+        return _parse_repo_files(items, raw_base, repo_url, known)
+
+
 async def _import_n8n_io(url: str, analyze: bool = False) -> dict:
     """Import from n8n.io/workflows/ URL."""
     match = re.search(r"/workflows/(\d+)", url)
@@ -405,15 +904,14 @@ async def _import_n8n_io(url: str, analyze: bool = False) -> dict:
     wf_id = match.group(1)
     api_url = f"https://api.n8n.io/api/workflows/templates/{wf_id}"
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.get(api_url)
-        if resp.status_code != 200:
-            return {"status": "error", "message": f"n8n.io API: {resp.status_code}"}
+    resp = await _client().get(api_url, timeout=30)
+    if resp.status_code != 200:
+        return {"status": "error", "message": f"n8n.io API: {resp.status_code}"}
 
-        data = resp.json()
-        workflow = data.get("workflow", data)
-        json_str = json.dumps(workflow, ensure_ascii=False)
-        return await import_from_json(json_str, source_url=url, analyze=analyze)
+    data = resp.json()
+    workflow = data.get("workflow", data)
+    json_str = json.dumps(workflow, ensure_ascii=False)
+    return await import_from_json(json_str, source_url=url, analyze=analyze)
 
 
 async def _import_google_drive(url: str, analyze: bool = False) -> dict:
@@ -449,45 +947,105 @@ async def _import_google_drive(url: str, analyze: bool = False) -> dict:
     download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
     logger.info(f"Downloading from Google Drive: {download_url}")
 
-    async with httpx.AsyncClient(timeout=60, follow_redirects=True) as client:
-        resp = await client.get(download_url)
-        if resp.status_code != 200:
-            if "virus" in resp.text.lower():
-                return {"status": "error", "message": "Файл занадто великий для Google Drive scan, або потребує підтвердження. Спробуйте інший метод."}
-            return {"status": "error", "message": f"Google Drive error: HTTP {resp.status_code}"}
-        
-        try:
-            return await import_from_json(resp.text, source_url=url, analyze=analyze)
-        except Exception as e:
-            return {"status": "error", "message": f"Помилка парсингу Google Drive файлу: {str(e)}"}
+    resp = await _client().get(download_url)
+    if resp.status_code != 200:
+        if "virus" in resp.text.lower():
+            return {"status": "error", "message": "Файл занадто великий для Google Drive scan, або потребує підтвердження. Спробуйте інший метод."}
+        return {"status": "error", "message": f"Google Drive error: HTTP {resp.status_code}"}
 
+    try:
+        return await import_from_json(resp.text, source_url=url, analyze=analyze)
+    except Exception as e:
+        return {"status": "error", "message": f"Помилка парсингу Google Drive файлу: {str(e)}"}
 
-async def sync_github_repo(repo_url: str) -> dict:
-    """Re-sync a GitHub repo (auto-detect default branch)."""
+
+async def sync_github_repo(repo_url: str, full: bool = False) -> dict:
+    """Re-sync a GitHub repo.
+    If the branch head hasn't moved since the last sync nothing is downloaded; otherwise
+    the commit tree is diffed against the stored path->blob manifest and only added or
+    modified JSON files are fetched. Falls back to a full ZIP import when there is no
+    previous state or the tree is truncated.
+    """
     match = re.match(r"https?://github\.com/([\w.\-]+)/([\w.\-]+)", repo_url)
     if not match:
         return {"status": "error", "message": "Невірний URL"}
 
     owner, repo_name = match.groups()
+    repo_url = f"https://github.com/{owner}/{repo_name}"
+    repo = await db.get_github_repo(repo_url) or {}
+
+    branch = repo.get("branch") or await _get_default_branch(owner, repo_name)
+    head = await _get_branch_head(owner, repo_name, branch)
+    last_sha = repo.get("last_commit_sha") or ""
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        branch = await _get_default_branch(client, owner, repo_name)
+    if full or not head or not last_sha:
+        return await _import_github_zip(owner, repo_name, branch, head=head)
 
-    url = f"https://github.com/{owner}/{repo_name}/tree/{branch}"
-    return await _import_github_dir(url)
+    if head == last_sha:
+        await db.update_repo_sync(repo_url, branch=branch)
+        logger.info(f"{repo_url}@{branch} unchanged at {head[:7]}")
+        return _sync_result("unchanged", _new_counts(), 0, 0, head)
+
+    files = await _get_json_tree(owner, repo_name, head)
+    if files is None:
+        return await _import_github_zip(owner, repo_name, branch, head=head)
+
+    manifest = await db.get_repo_manifest(repo_url)
+    changed = [p for p, sha in files.items() if manifest.get(p) != sha]
+    removed = [p for p in manifest if p not in files]
+    logger.info(f"{repo_url}: {last_sha[:7]}..{head[:7]} - {len(changed)} changed, {len(removed)} removed")
+
+    sem = asyncio.Semaphore(SYNC_FETCH_CONCURRENCY)
+
+    async def fetch(path):
+        async with sem:
+            try:
+                resp = await _github_get(f"{GITHUB_RAW_URL}/{owner}/{repo_name}/{head}/{path}")
+                if resp.status_code == 200:
+                    return path, resp.content
+                logger.warning(f"Fetch {path}: HTTP {resp.status_code}")
+            except httpx.HTTPError as e:
+                logger.warning(f"Fetch {path}: {e}")
+            return path, None
+
+    fetched = await asyncio.gather(*(fetch(p) for p in changed))
+
+    items = [(p, data) for p, data in fetched if data is not None]
+    failed = len(fetched) - len(items)
+    raw_base = f"{GITHUB_RAW_URL}/{owner}/{repo_name}/{branch}/"
+    counts = _new_counts()
+    # Prune first so the hashes of removed files don't hide the same content at a new path
+    counts["removed"] += await db.delete_workflows_by_source([raw_base + p for p in removed])
+    known = await db.get_json_hashes()
+    batch, errors, shas, counts["skipped_early"] = await asyncio.to_thread(
+        _parse_repo_files, items, raw_base, repo_url, known)
+
+    for i in range(0, len(batch), IMPORT_BATCH_SIZE):
+        _add_counts(counts, await db.upsert_workflows_batch(batch[i:i + IMPORT_BATCH_SIZE]))
+
+    await db.update_repo_manifest(repo_url, shas, removed)
+    # Files that failed to download are not in the manifest; keep the old SHA so the
+    # next sync doesn't short-circuit as "unchanged" and retries them.
+    await db.update_repo_sync(repo_url, commit_sha=None if failed else head, branch=branch)
+
+    return _sync_result("incremental", counts, errors + failed, len(changed), head)
 
 
 async def sync_all_repos():
-    """Sync all registered GitHub repos."""
-    conn = get_db()
-    rows = conn.execute("SELECT repo_url FROM github_repos WHERE enabled = 1").fetchall()
+    """Sync all registered GitHub repos, SYNC_CONCURRENCY at a time.
+    Downloads and parsing of different repos overlap; DB writes still funnel through
+    the single writer thread.
+    """
+    rows = await db.get_github_repos(enabled_only=True)
+    sem = asyncio.Semaphore(SYNC_CONCURRENCY)
 
-    results = []
-    for row in rows:
-        try:
-            result = await sync_github_repo(row["repo_url"])
-            results.append({"repo": row["repo_url"], **result})
-        except Exception as e:
-            logger.error(f"Sync failed for {row['repo_url']}: {e}")
-            results.append({"repo": row["repo_url"], "status": "error", "message": str(e)})
-    return results
+    async def sync_one(row):
+        async with sem:
+            try:
+                result = await sync_github_repo(row["repo_url"])
+                return {"repo": row["repo_url"], **result}
+            except Exception as e:
+                logger.error(f"Sync failed for {row['repo_url']}: {e}")
+                return {"repo": row["repo_url"], "status": "error", "message": str(e)}
+
+    return await asyncio.gather(*(sync_one(row) for row in rows))
@@ -0,0 +1,107 @@
+"""
+Background import jobs.
+
+URL and local-directory imports run as jobs instead of inside the HTTP request.
+Every job is a row in import_jobs (queued -> running -> done | failed) with
+processed/total counts and per-stage timings that are flushed while it runs,
+so the UI can poll /api/import/jobs/{id}. Jobs left unfinished by a restart are
+run again on startup (imports are idempotent) until they use up their attempts.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+
+import async_db as db
+from importer import ImportProgress, import_from_url, import_from_directory
+from analyzer import request_analysis
+
+logger = logging.getLogger(__name__)
+
+IMPORT_JOB_CONCURRENCY = int(os.environ.get("IMPORT_JOB_CONCURRENCY", "2"))
+JOB_MAX_ATTEMPTS = 2         # runs per job, including resumes after a restart
+JOB_PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+
+_RUNNERS = {
+    "url": lambda params, progress: import_from_url(params["url"], progress=progress),
+    "local": lambda params, progress: import_from_directory(params["directory"], progress=progress),
+}
+
+_slots = asyncio.Semaphore(IMPORT_JOB_CONCURRENCY)
+_tasks = set()
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def submit(kind: str, params: dict) -> int:
+    """Persist a queued job and start it in the background. Returns the job id."""
+    if kind not in _RUNNERS:
+        raise ValueError(f"Невідомий тип імпорту: {kind}")
+    job_id = await db.create_import_job(kind, params)
+    _spawn(_run(job_id, kind, params, attempts=0))
+    return job_id
+
+
+async def _flush_progress(job_id, progress):
+    while True:
+        await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+        await db.update_import_job(job_id, **progress.snapshot())
+
+
+async def _run(job_id, kind, params, attempts):
+    async with _slots:
+        progress = ImportProgress()
+        await db.update_import_job(job_id, state="running", attempts=attempts + 1, started_at=_now(), error="")
+        logger.info(f"Import job {job_id} started: {kind} {params}")
+        flusher = asyncio.create_task(_flush_progress(job_id, progress))
+        try:
+            result = await _RUNNERS[kind](params, progress)
+        except asyncio.CancelledError:
+            # Shutdown: the row stays 'running' and resume_jobs() picks it up on the next start
+            raise
+        except Exception as e:
+            logger.exception(f"Import job {job_id} failed")
+            await db.update_import_job(job_id, state="failed", error=str(e), finished_at=_now(),
+                                       **progress.snapshot())
+            return
+        finally:
+            flusher.cancel()
+
+        failed = result.get("status") == "error"
+        if not progress.total:
+            progress.total = progress.processed = 1
+        await db.update_import_job(job_id, state="failed" if failed else "done", result=result,
+                                   error=result.get("message", "") if failed else "", finished_at=_now(),
+                                   **progress.snapshot())
+        logger.info(f"Import job {job_id} finished: {result}")
+
+        if result.get("status") == "ok" and (result.get("imported", 1) or result.get("reanalyze")):
+            _spawn(request_analysis())
+
+
+async def resume_jobs():
+    """Re-run jobs interrupted by a restart; fail the ones that already used their attempts."""
+    for job in reversed(await db.get_import_jobs(limit=1000, states=("queued", "running"))):
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            await db.update_import_job(job["id"], state="failed", finished_at=_now(),
+                                       error="Імпорт перервано перезапуском сервера")
+            continue
+        logger.info(f"Resuming import job {job['id']} ({job['kind']}, attempt {job['attempts'] + 1})")
+        _spawn(_run(job["id"], job["kind"], job["params"], job["attempts"]))
+
+
+async def shutdown():
+    """Cancel running jobs; they stay 'running' in the DB and resume on the next start."""
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
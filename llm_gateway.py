@@ -0,0 +1,186 @@
+"""
+Shared async LLM gateway.
+
+Every LLM call in the process goes through one AsyncOpenAI client with its own
+pooled connections (opened in the app lifespan, lazily for scripts), so no call
+pins an executor thread. Calls name a purpose — "chat" for interactive AI search,
+"analysis" for the background worker — and each purpose has its own concurrency
+limit and timeout, so a long analysis backlog can't starve chat requests.
+
+A circuit breaker stops calls after LLM_BREAKER_FAILURES consecutive provider
+failures (timeouts, connection errors, 5xx) for LLM_BREAKER_COOLDOWN seconds,
+then lets one probe through. Chat fails fast while it is open; analysis waits.
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, InternalServerError
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "32"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+# Per-purpose limits: concurrent requests and seconds per request
+PURPOSES = {
+    "chat": {"concurrency": int(os.environ.get("LLM_CHAT_CONCURRENCY", "4")),
+             "timeout": float(os.environ.get("LLM_CHAT_TIMEOUT", "30"))},
+    "analysis": {"concurrency": int(os.environ.get("ANALYSIS_CONCURRENCY", "8")),
+                 "timeout": float(os.environ.get("LLM_ANALYSIS_TIMEOUT", "120"))},
+}
+
+# Errors that mean the provider is unreachable or failing, not that the request was bad
+_PROVIDER_ERRORS = (APIConnectionError, InternalServerError)
+
+
+class LLMUnavailable(Exception):
+    """No API key, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures, cooldown):
+        self.threshold, self.cooldown = failures, cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def retry_in(self):
+        """Seconds until a call may be attempted (0 when it may go now)."""
+        if self.opened_at is None:
+            return 0.0
+        wait = self.cooldown - (time.monotonic() - self.opened_at)
+        return max(wait, 0.0) if not self.probing else max(wait, 1.0)
+
+    def allow(self):
+        """Whether a call may go now; in half-open state only one probe at a time."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def success(self):
+        if self.opened_at is not None:
+            logger.info("LLM circuit closed")
+        self.failures, self.opened_at, self.probing = 0, None, False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+                logger.warning(f"LLM circuit open after {self.failures} failures, cooling down {self.cooldown:.0f}s")
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """A probe ended without a verdict (e.g. a 4xx or a cancel): let the next one try."""
+        self.probing = False
+
+
+_client = None
+_semaphores = {purpose: asyncio.Semaphore(spec["concurrency"]) for purpose, spec in PURPOSES.items()}
+_in_flight = dict.fromkeys(PURPOSES, 0)
+breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+
+
+def available() -> bool:
+    return bool(OPENAI_API_KEY)
+
+
+def client() -> AsyncOpenAI:
+    """The shared client (opened lazily for scripts that skip the app lifespan)."""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            # No SDK retries: callers decide (the analysis queue has its own backoff, chat falls back)
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            ),
+        )
+    return _client
+
+
+async def start():
+    """Open the shared client (app lifespan startup)."""
+    if available():
+        client()
+
+
+async def close():
+    """Close the shared client (app lifespan shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def chat_body(messages, temperature=0.3):
+    """Request body of a JSON-mode chat completion (also the body of a Batch API line)."""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+        "temperature": temperature,
+    }
+
+
+async def complete(purpose, messages, temperature=0.3, wait=False):
+    """One JSON-mode chat completion for `purpose`.
+
+    Returns (content, total tokens used or None, response headers). Raises LLMUnavailable
+    without a key or, unless `wait`, while the circuit is open; with `wait` it sleeps until
+    the circuit lets a call through. API errors propagate as the openai exceptions.
+    """
+    if not available():
+        raise LLMUnavailable("OPENAI_API_KEY not configured")
+    spec = PURPOSES[purpose]
+    async with _semaphores[purpose]:
+        while not breaker.allow():
+            if not wait:
+                raise LLMUnavailable(f"LLM circuit open, retry in {breaker.retry_in():.0f}s")
+            await asyncio.sleep(breaker.retry_in())
+        _in_flight[purpose] += 1
+        try:
+            raw = await client().chat.completions.with_raw_response.create(
+                **chat_body(messages, temperature), timeout=spec["timeout"])
+        except _PROVIDER_ERRORS:
+            breaker.failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        finally:
+            _in_flight[purpose] -= 1
+        breaker.success()
+    response = raw.parse()
+    usage = response.usage.total_tokens if response.usage else None
+    return response.choices[0].message.content, usage, raw.headers
+
+
+def stats():
+    return {
+        "model": OPENAI_MODEL,
+        "circuit": breaker.state,
+        "circuit_trips": breaker.trips,
+        **{f"{p}_in_flight": f"{_in_flight[p]}/{spec['concurrency']}" for p, spec in PURPOSES.items()},
+    }
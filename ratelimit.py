@@ -0,0 +1,160 @@
+"""
+Adaptive rate limiter for LLM calls.
+
+Two token buckets — requests and tokens per minute — refill continuously from the
+configured limits, and a call waits until both hold enough for it. The limiter
+also learns from the provider:
+
+- a 429 pauses every caller for the retry-after interval and cuts both rates,
+  which then recover additively with each successful call (AIMD);
+- x-ratelimit-remaining-* headers pull a bucket down when the provider has less
+  left than we think (another process or app sharing the key), and a remaining
+  count of 0 pauses callers until the matching x-ratelimit-reset-*.
+"""
+
+import re
+import time
+import asyncio
+
+BURST_SECONDS = 1      # bucket capacity, in seconds of the per-minute rate (providers enforce short windows)
+MIN_RATE_FRACTION = 0.05  # rates never drop below this share of the limit
+RECOVERY_STEP = 0.05   # share of the limit regained per successful call
+BACKOFF_FACTOR = 0.7   # rate multiplier on a 429
+DEFAULT_RETRY_AFTER = 5.0  # seconds, when a 429 carries no hint
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Seconds in an OpenAI-style duration ("20ms", "1s", "6m0s", "1h2m3.5s"), or None."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(str(value))
+    return sum(float(n) * _UNITS[u] for n, u in parts) if parts else None
+
+
+def retry_after(headers):
+    """Seconds the provider asks us to wait before retrying, from 429 response headers (or None)."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    hint = parse_duration(headers.get("retry-after"))
+    if hint is not None:
+        return hint
+    resets = [parse_duration(headers.get(f"x-ratelimit-reset-{k}")) for k in ("requests", "tokens")]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.limit = float(per_minute)
+        self.rate = self.limit  # current, per minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate * BURST_SECONDS / 60)
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be taken; a request larger than the whole bucket only needs it full."""
+        need = min(amount, self.capacity) - self.level
+        return max(0.0, need * 60 / self.rate)
+
+    def scale(self, factor):
+        self.rate = min(self.limit, max(self.limit * MIN_RATE_FRACTION, self.rate * factor))
+        self.level = min(self.level, self.capacity)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by all callers in this process.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm, tpm=0):
+        self._buckets = {"requests": _Bucket(rpm) if rpm else None, "tokens": _Bucket(tpm) if tpm else None}
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()  # callers are served in arrival order
+        self.rate_limited = 0  # 429s seen
+
+    async def acquire(self, tokens=0):
+        """Wait until one request of ~`tokens` tokens fits both budgets, then take it."""
+        want = {"requests": 1, "tokens": tokens}
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    for bucket in self._buckets.values():
+                        if bucket:
+                            bucket.refill(now)
+                    wait = max([b.wait_time(want[k]) for k, b in self._buckets.items() if b], default=0.0)
+                    if wait <= 0:
+                        for k, bucket in self._buckets.items():
+                            if bucket:
+                                bucket.level -= want[k]
+                        return
+                await asyncio.sleep(wait)
+
+    def settle(self, estimated, actual):
+        """Correct the token bucket once the real usage of a call is known."""
+        bucket = self._buckets["tokens"]
+        if bucket and actual is not None:
+            bucket.level = min(bucket.capacity, bucket.level + estimated - actual)
+
+    def on_success(self, headers=None):
+        for bucket in self._buckets.values():
+            if bucket:
+                bucket.rate = min(bucket.limit, bucket.rate + bucket.limit * RECOVERY_STEP)
+        if headers:
+            self._observe(headers)
+
+    def on_rate_limited(self, headers=None):
+        """A 429: stop everyone for the hinted interval and back off both rates."""
+        self.rate_limited += 1
+        delay = retry_after(headers)
+        self._pause(DEFAULT_RETRY_AFTER if delay is None else delay)
+        for bucket in self._buckets.values():
+            if bucket:
+                bucket.scale(BACKOFF_FACTOR)
+                bucket.level = 0.0
+
+    def _observe(self, headers):
+        now = time.monotonic()
+        for kind, bucket in self._buckets.items():
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if bucket is None or remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            bucket.refill(now)
+            bucket.level = min(bucket.level, remaining)
+            if remaining <= 0:
+                self._pause(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or DEFAULT_RETRY_AFTER)
+
+    def _pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        return {
+            **{f"{k}_per_minute": round(b.rate) for k, b in self._buckets.items() if b},
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,170 @@
+"""
+Inverted index for "similar workflows" — top-k by IDF-weighted Jaccard in milliseconds.
+
+Each workflow is a set of features: its node types and its AI tags. The index
+keeps feature -> workflow ids postings and workflow -> features in memory.
+A query walks the postings of its rarest features first and stops as soon as no
+workflow it hasn't reached could still make the top k (or at a scan budget, so
+common nodes like Set or HTTP Request never expand into a full scan), then
+rescores the best candidates exactly:
+
+    sim(A, B) = sum(w(f) for f in A & B) / sum(w(f) for f in A | B),  w(f) = log(1 + N / df(f))
+
+The index is built once from the DB and then kept current incrementally from
+workflow_changes, a log the workflows triggers append to on insert, delete and
+node/tag updates (see database._migrate_similarity).
+"""
+
+import json
+import math
+import heapq
+import threading
+
+SCAN_BUDGET = 20000       # postings visited per query after the rarest feature
+RESCORE_CANDIDATES = 200  # candidates scored exactly
+
+
+def workflow_features(nodes, tags):
+    """Feature strings for a workflow from its nodes and ai_tags (lists or JSON text)."""
+    try:
+        if isinstance(nodes, str):
+            nodes = json.loads(nodes or "[]")
+        if isinstance(tags, str):
+            tags = json.loads(tags or "[]")
+    except ValueError:
+        return set()
+    feats = {f"n:{n}" for n in nodes if isinstance(n, str) and n} if isinstance(nodes, list) else set()
+    if isinstance(tags, list):
+        feats.update(f"t:{t.strip().lower()}" for t in tags if isinstance(t, str) and t.strip())
+    return feats
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self.seq = None  # last workflow_changes.seq applied
+        self.features = {}  # workflow id -> tuple of feature ids
+        self.postings = {}  # feature id -> set of workflow ids
+        self._feature_ids = {}
+        self._feature_names = []
+        self._weights = {}  # feature id -> IDF weight, per refresh
+        self._totals = {}  # workflow id -> total feature weight, per refresh
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self, conn, seq):
+        """Build the index on first use, then apply logged changes once the change log (its
+        MAX(seq), which writes from any process move) is past what the index has applied."""
+        if self.seq is not None and self.seq >= seq:
+            return
+        with self._lock:
+            if self.seq is not None and self.seq >= seq:
+                return
+            if self.seq is None:
+                self._build(conn)
+            else:
+                self._apply_changes(conn)
+            self._weights.clear()
+            self._totals.clear()
+
+    def _build(self, conn):
+        # Read the log position first: changes made during the scan are re-applied on the next refresh
+        self.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM workflow_changes").fetchone()[0]
+        self.features.clear()
+        self.postings.clear()
+        for wf_id, nodes, tags in conn.execute("SELECT id, nodes, ai_tags FROM workflows"):
+            self._set(wf_id, workflow_features(nodes, tags))
+
+    def _apply_changes(self, conn):
+        rows = conn.execute("SELECT workflow_id, seq FROM workflow_changes WHERE seq > ?", (self.seq,)).fetchall()
+        if not rows:
+            return
+        ids = [r[0] for r in rows]
+        found = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for wf_id, nodes, tags in conn.execute(
+                    f"SELECT id, nodes, ai_tags FROM workflows WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                found[wf_id] = workflow_features(nodes, tags)
+        for wf_id in ids:
+            self._set(wf_id, found.get(wf_id))
+        self.seq = max(r[1] for r in rows)
+
+    def _set(self, wf_id, feats):
+        """Replace a workflow's features (None or empty removes it)."""
+        for fid in self.features.pop(wf_id, ()):
+            posting = self.postings[fid]
+            posting.discard(wf_id)
+            if not posting:
+                del self.postings[fid]
+        if not feats:
+            return
+        fids = []
+        for f in feats:
+            fid = self._feature_ids.get(f)
+            if fid is None:
+                fid = self._feature_ids[f] = len(self._feature_names)
+                self._feature_names.append(f)
+            fids.append(fid)
+            self.postings.setdefault(fid, set()).add(wf_id)
+        self.features[wf_id] = tuple(fids)
+
+    def _weight(self, fid):
+        w = self._weights.get(fid)
+        if w is None:
+            w = self._weights[fid] = math.log(1.0 + len(self.features) / len(self.postings[fid]))
+        return w
+
+    def _total(self, wf_id):
+        t = self._totals.get(wf_id)
+        if t is None:
+            t = self._totals[wf_id] = sum(self._weight(f) for f in self.features[wf_id])
+        return t
+
+    def similar(self, wf_id, k=10):
+        """[(workflow id, similarity, shared feature names)] for the k most similar workflows."""
+        with self._lock:
+            query = self.features.get(wf_id)
+            if not query:
+                return []
+            q_total = self._total(wf_id)
+
+            # Candidates from the rarest features first; partial[c] is c's shared weight over the
+            # features scanned so far. A workflow first reached after them can share at most the
+            # weight left, so its similarity is at most remaining / q_total: once k candidates
+            # already score that much, nothing unseen can enter the top k. SCAN_BUDGET caps the
+            # work when that point comes late (queries made only of very common features).
+            partial = {}
+            scanned = 0
+            remaining = q_total
+            for i, fid in enumerate(sorted(query, key=lambda f: len(self.postings[f]))):
+                posting = self.postings[fid]
+                if i and scanned + len(posting) > SCAN_BUDGET:
+                    break
+                # Checking costs a pass over the candidates, so only do it when it can save more
+                if len(posting) > len(partial) >= k and \
+                        heapq.nlargest(k, self._estimates(partial, q_total))[-1][0] >= remaining / q_total:
+                    break
+                scanned += len(posting)
+                w = self._weight(fid)
+                remaining -= w
+                for other in posting:
+                    partial[other] = partial.get(other, 0.0) + w
+                partial.pop(wf_id, None)
+
+            # Rank by similarity over the scanned features, then rescore the best exactly
+            results = []
+            for _, other in heapq.nlargest(RESCORE_CANDIDATES, self._estimates(partial, q_total)):
+                shared = [f for f in self.features[other] if f in query]
+                inter = sum(self._weight(f) for f in shared)
+                results.append((other, inter / (q_total + self._total(other) - inter), shared))
+            results = heapq.nlargest(k, results, key=lambda r: (r[1], -r[0]))
+            return [(other, round(score, 4), sorted(self._feature_names[f] for f in shared))
+                    for other, score, shared in results]
+
+    def _estimates(self, partial, q_total):
+        """[(similarity over the scanned features, workflow id)] — a lower bound, since partial
+        shared weights only undercount."""
+        totals, total = self._totals, self._total
+        return [(v / (q_total + (totals.get(c) or total(c)) - v), c) for c, v in partial.items()]
+
+    def stats(self):
+        return {"workflows": len(self.features), "features": len(self.postings), "seq": self.seq}
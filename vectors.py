@@ -0,0 +1,395 @@
+"""
+Local vector index for semantic search (sort=semantic) — NumPy only, no network.
+
+Each workflow's text (name, ai_summary, ai_summary_en, ai_tags and node types)
+becomes a hashed TF-IDF vector that LSA projects down to VECTOR_DIM dimensions.
+The projection is a truncated SVD of the whole corpus, so words that occur in the
+same kinds of workflows ("invoice", "stripe", "payment") land close together and
+a query matches a summary it shares no word with.
+
+Document vectors are unit-length float16 rows, saved to VECTOR_INDEX_DIR and
+memory-mapped from there on startup; a query is one matrix-vector product and
+an argpartition.
+Workflows changed after the last save (new summaries from
+update_workflow_ai, imports, deletes — read from the workflow_changes log) are
+folded into the current model and kept in a small in-memory delta, which is
+merged into a new save once it grows. The model itself is refitted from scratch
+(in a background thread, see database._refit_vectors) once the corpus has
+changed by more than VECTOR_REFIT_RATIO since the last fit.
+"""
+
+import os
+import re
+import json
+import zlib
+import time
+import uuid
+import threading
+
+import numpy as np
+
+VECTOR_DIM = int(os.environ.get("VECTOR_DIM", "128"))
+VECTOR_REFIT_RATIO = float(os.environ.get("VECTOR_REFIT_RATIO", "0.5"))
+HASH_BUCKETS = 1 << 18     # hashed vocabulary; buckets seen in fewer than MIN_DF documents are dropped
+MIN_DF = 2
+COMPACT_THRESHOLD = 2000   # changed/removed rows kept in memory before vectors.npy is rewritten
+REFIT_MIN_DOCS = 100       # small corpora refit after VECTOR_REFIT_RATIO * this many changes
+_SCORE_CHUNK = 16384       # matrix rows converted to float32 at a time when scoring
+_OLD_SET_SECONDS = 600     # age after which files of superseded saves are deleted
+
+_OVERSAMPLE = 16
+_TERMS_PER_DIM = 8
+_POWER_ITERATIONS = 2
+_NNZ_CHUNK = 1 << 16       # non-zeros per step of a sparse product (bounds the temporary)
+
+_WORD = re.compile(r"[^\W\d_]{2,}")
+_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+_TEXT_COLUMNS = "id, name, ai_summary, ai_summary_en, ai_tags, nodes"
+
+
+def workflow_text(name, summary, summary_en, tags, nodes):
+    """The text a workflow is embedded from; tags/nodes may be lists or JSON text."""
+    parts = [name or "", summary or "", summary_en or ""]
+    for value in (tags, nodes):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value or "[]")
+            except ValueError:
+                value = []
+        if isinstance(value, list):
+            # Node types: "n8n-nodes-base.googleSheets" -> "google Sheets"
+            parts += [_CAMEL.sub(" ", v.rsplit(".", 1)[-1]) for v in value if isinstance(v, str)]
+    return " ".join(parts)
+
+
+def terms(text):
+    """Lowercased words plus a 6-letter prefix of long ones, so inflections share a term."""
+    words = [w.lower() for w in _WORD.findall(_CAMEL.sub(" ", text))]
+    return words + [w[:6] for w in words if len(w) > 7]
+
+
+def _bucket_counts(text):
+    """(sorted unique hash buckets, sublinear term frequencies) of a text."""
+    buckets = np.fromiter((zlib.crc32(t.encode()) for t in terms(text)), dtype=np.int64)
+    buckets &= HASH_BUCKETS - 1
+    buckets, counts = np.unique(buckets, return_counts=True)
+    return buckets, 1.0 + np.log(counts.astype(np.float32))
+
+
+def _segment_matmul(ptr, idx, data, dense):
+    """Sparse (segments given by ptr/idx/data, CSR or CSC) @ dense, one output row per segment."""
+    out = np.zeros((len(ptr) - 1, dense.shape[1]), dtype=np.float32)
+    nonempty = np.flatnonzero(np.diff(ptr))
+    starts = ptr[nonempty]
+    i = 0
+    while i < len(nonempty):
+        j = max(i + 1, int(np.searchsorted(starts, starts[i] + _NNZ_CHUNK)))
+        seg = nonempty[i:j]
+        lo, hi = ptr[seg[0]], ptr[seg[-1] + 1]
+        out[seg] = np.add.reduceat(data[lo:hi, None] * dense[idx[lo:hi]], starts[i:j] - lo)
+        i = j
+    return out
+
+
+def _orthonormal(m):
+    return np.linalg.qr(m)[0].astype(np.float32)
+
+
+class _Model:
+    """Hashed TF-IDF weights and the LSA projection of the used buckets."""
+
+    def __init__(self, buckets, idf, projection):
+        self.buckets = buckets  # used bucket numbers, sorted
+        self.idf = idf
+        self.projection = projection  # len(buckets) x dim
+        self.columns = np.full(HASH_BUCKETS, -1, dtype=np.int32)
+        self.columns[buckets] = np.arange(len(buckets), dtype=np.int32)
+
+    @property
+    def dim(self):
+        return self.projection.shape[1]
+
+    def tfidf(self, counts):
+        """CSR (ptr, columns, unit-normalized weights) over the model's columns, from _bucket_counts() of each text."""
+        ptr, cols, data = [0], [], []
+        for buckets, tf in counts:
+            c = self.columns[buckets]
+            keep = c >= 0
+            c, w = c[keep], tf[keep] * self.idf[c[keep]]
+            norm = np.linalg.norm(w)
+            cols.append(c)
+            data.append(w / norm if norm else w)
+            ptr.append(ptr[-1] + len(c))
+        return (np.asarray(ptr, dtype=np.int64), np.concatenate(cols or [np.zeros(0, np.int32)]),
+                np.concatenate(data or [np.zeros(0, np.float32)]).astype(np.float32))
+
+    def embed(self, texts):
+        """Unit-length vectors (zero for texts with no known term), float32."""
+        return self.embed_counts([_bucket_counts(t) for t in texts])
+
+    def embed_counts(self, counts):
+        vectors = _segment_matmul(*self.tfidf(counts), self.projection)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    @classmethod
+    def fit(cls, per_doc, dim=VECTOR_DIM):
+        """Fit on the _bucket_counts() of a corpus; None if it's too small to have a vocabulary."""
+        if not per_doc:
+            return None
+        df = np.bincount(np.concatenate([b for b, _ in per_doc]), minlength=HASH_BUCKETS)
+        buckets = np.flatnonzero(df >= MIN_DF).astype(np.int32)
+        # Generalizing needs far fewer dimensions than terms: with dim >= vocabulary the
+        # projection is just a rotation and only exact words would match
+        dim = min(dim, len(buckets) // _TERMS_PER_DIM)
+        rank = min(dim + _OVERSAMPLE, len(buckets), len(per_doc))
+        if dim < 2 or rank < 2:
+            return None
+        n = len(per_doc)
+        idf = (np.log((1.0 + n) / (1.0 + df[buckets])) + 1.0).astype(np.float32)
+        model = cls(buckets, idf, np.zeros((len(buckets), 0), dtype=np.float32))
+
+        # Randomized SVD of the n x V TF-IDF matrix X (Halko et al.), using X as CSR and CSC
+        ptr, cols, data = model.tfidf(per_doc)
+        order = np.argsort(cols, kind="stable")
+        col_ptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=len(buckets)))))
+        rows = np.repeat(np.arange(n), np.diff(ptr))[order]
+        csc = (col_ptr, rows, data[order])
+
+        rng = np.random.default_rng(0)
+        q = _orthonormal(_segment_matmul(ptr, cols, data, rng.standard_normal((len(buckets), rank), dtype=np.float32)))
+        for _ in range(_POWER_ITERATIONS):
+            q = _orthonormal(_segment_matmul(ptr, cols, data, _orthonormal(_segment_matmul(*csc, q))))
+        bt = _segment_matmul(*csc, q)  # X^T Q, V x rank
+        _, _, vt = np.linalg.svd(bt.T, full_matrices=False)
+        model.projection = np.ascontiguousarray(vt[:dim].T, dtype=np.float32)
+        return model
+
+
+class VectorIndex:
+    def __init__(self, directory=""):
+        self.directory = directory  # "" keeps the index in memory only
+        self.seq = None  # last workflow_changes.seq applied
+        self.model = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, 0), dtype=np.float16)
+        self.rows = {}  # workflow id -> row in matrix
+        self.stale = np.zeros(0, dtype=bool)  # rows superseded by the delta or deleted
+        self.delta = {}  # workflow id -> float32 vector, changes not yet in matrix
+        self.fitted_docs = 0
+        self.changed_since_fit = 0
+        self.refitting = False
+        self._lock = threading.Lock()
+
+    # ---------- freshness ----------
+
+    def ensure_fresh(self, conn, seq):
+        """Load or fit on first use, then fold in logged changes once the change log (its
+        MAX(seq), which writes from any process move) is past what the index has applied."""
+        if self.seq is not None and self.seq >= seq:
+            return
+        with self._lock:
+            if self.seq is not None and self.seq >= seq:
+                return
+            if self.seq is None and not self._load(conn):
+                self._install(*self._fit(conn))
+            self._apply_changes(conn)
+            if self.model is None and self.changed_since_fit:
+                # Nothing to fold into yet; fitting a corpus this small is cheap
+                self._install(*self._fit(conn))
+
+    def claim_refit(self):
+        """True (once) if the corpus changed enough since the last fit to warrant a refit."""
+        with self._lock:
+            if self.refitting or self.changed_since_fit <= VECTOR_REFIT_RATIO * max(self.fitted_docs, REFIT_MIN_DOCS):
+                return False
+            self.refitting = True
+            return True
+
+    def refit(self, conn):
+        """Refit the model on the current corpus (after claim_refit(), off the request path);
+        changes made meanwhile are replayed by the next ensure_fresh().
+        """
+        try:
+            fitted = self._fit(conn)
+            with self._lock:
+                # Back to the fit's log position: the next ensure_fresh() replays what came after
+                self._install(*fitted)
+        finally:
+            self.refitting = False
+
+    def _fit(self, conn):
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM workflow_changes").fetchone()[0]
+        rows = conn.execute(f"SELECT {_TEXT_COLUMNS} FROM workflows").fetchall()
+        counts = [_bucket_counts(workflow_text(*r[1:])) for r in rows]
+        model = _Model.fit(counts)
+        if model is None:
+            return seq, None, np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float16)
+        vectors = model.embed_counts(counts)
+        keep = np.flatnonzero(vectors.any(axis=1))
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))[keep]
+        return seq, model, ids, vectors[keep].astype(np.float16)
+
+    def _install(self, seq, model, ids, matrix):
+        self.seq, self.model = seq, model
+        self.fitted_docs, self.changed_since_fit = len(ids), 0
+        self.delta = {}
+        self._set_matrix(ids, matrix)
+        self._save()
+
+    def _set_matrix(self, ids, matrix):
+        self.ids, self.matrix = ids, matrix
+        self.rows = {int(i): row for row, i in enumerate(ids)}
+        self.stale = np.zeros(len(ids), dtype=bool)
+
+    def _apply_changes(self, conn):
+        log = conn.execute("SELECT workflow_id, seq FROM workflow_changes WHERE seq > ?", (self.seq,)).fetchall()
+        if not log:
+            return
+        changed = [r[0] for r in log]
+        self.seq = max(r[1] for r in log)
+        found = {}
+        for i in range(0, len(changed), 500):
+            chunk = changed[i:i + 500]
+            for r in conn.execute(f"SELECT {_TEXT_COLUMNS} FROM workflows "
+                                  f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                found[r[0]] = workflow_text(*r[1:])
+        if self.model is None:
+            # Too little text for a model so far: the next refit starts from the whole corpus
+            self.changed_since_fit += len(changed)
+            return
+        vectors = dict(zip(found, self.model.embed(list(found.values())))) if found else {}
+        for wf_id in changed:
+            row = self.rows.get(wf_id)
+            if row is not None:
+                self.stale[row] = True
+            self.delta.pop(wf_id, None)
+            vec = vectors.get(wf_id)
+            if vec is not None and vec.any():
+                self.delta[wf_id] = vec
+        self.changed_since_fit += len(changed)
+        if len(self.delta) + int(self.stale.sum()) >= COMPACT_THRESHOLD:
+            self._compact()
+
+    def _compact(self):
+        """Merge the delta into the matrix and save it."""
+        keep = ~self.stale
+        ids = np.concatenate([self.ids[keep], np.fromiter(self.delta, dtype=np.int64, count=len(self.delta))])
+        parts = [np.asarray(self.matrix[keep], dtype=np.float16)]
+        if self.delta:
+            parts.append(np.stack(list(self.delta.values())).astype(np.float16))
+        self.delta = {}
+        self._set_matrix(ids, np.concatenate(parts) if len(ids) else np.zeros((0, self.model.dim), np.float16))
+        self._save()
+
+    # ---------- persistence ----------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save(self):
+        """Write the index as a new set of files and point meta.json at it.
+
+        Every save gets its own file names (pid + random token), so processes sharing
+        VECTOR_INDEX_DIR never write into each other's files, and meta.json — replaced
+        atomically, last — is what makes a set current. The ids are stored in the model
+        file together with the token, so _load() can tell they belong to that matrix.
+        The matrix that was just saved stays in memory rather than being mapped back in.
+        """
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        if self.model is not None:
+            with open(self._path(f"model-{token}.npz"), "wb") as f:
+                np.savez(f, buckets=self.model.buckets, idf=self.model.idf,
+                         projection=self.model.projection.astype(np.float16), ids=self.ids, token=token)
+            with open(self._path(f"vectors-{token}.npy"), "wb") as f:
+                np.save(f, np.asarray(self.matrix, dtype=np.float16))
+        meta = {"token": token, "seq": self.seq, "fitted_docs": self.fitted_docs, "rows": len(self.ids),
+                "model": self.model is not None}
+        tmp = self._path(f"meta.json.{token}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps(meta))
+        os.replace(tmp, self._path("meta.json"))
+        self._remove_old_sets(token)
+
+    def _remove_old_sets(self, token):
+        """Delete files of earlier saves. Ones younger than _OLD_SET_SECONDS are left alone:
+        another process may still be writing them or about to open them."""
+        cutoff = time.time() - _OLD_SET_SECONDS
+        for name in os.listdir(self.directory):
+            if token in name or name == "meta.json":
+                continue
+            path = self._path(name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass  # gone already, or still mapped by a reader (Windows)
+
+    def _load(self, conn):
+        """Load the saved index if it matches this database. Returns False if it must be fitted."""
+        if not self.directory:
+            return False
+        for attempt in range(2):
+            try:
+                with open(self._path("meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                if not meta.get("model") or "token" not in meta:
+                    return False
+                token = meta["token"]
+                with np.load(self._path(f"model-{token}.npz")) as z:
+                    model = _Model(z["buckets"], z["idf"], z["projection"].astype(np.float32))
+                    ids, saved_token = z["ids"], str(z["token"])
+                matrix = np.load(self._path(f"vectors-{token}.npy"), mmap_mode="r")
+                break
+            except FileNotFoundError:
+                if not os.path.exists(self._path("meta.json")):
+                    return False
+                if attempt:
+                    print(f"[DB] Vector index at {self.directory} is incomplete, rebuilding")
+                    return False
+                # A newer save replaced the set between reading meta.json and opening it: reread
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[DB] Vector index at {self.directory} is unreadable ({e}), rebuilding")
+                return False
+        current = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM workflow_changes").fetchone()[0]
+        if saved_token != token or len(ids) != meta["rows"] or matrix.shape != (len(ids), model.dim) \
+                or meta["seq"] > current:
+            # Files from another database or mixed up between saves
+            return False
+        self.seq, self.model = meta["seq"], model
+        self.fitted_docs, self.changed_since_fit = meta["fitted_docs"], 0
+        self._set_matrix(ids, matrix)
+        return True
+
+    # ---------- queries ----------
+
+    def search(self, text, k, min_score=0.0):
+        """[(workflow id, cosine similarity)] of the k workflows closest to the text, best first."""
+        with self._lock:
+            if self.model is None:
+                return []
+            q = self.model.embed([text])[0]
+            if not q.any():
+                return []
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), _SCORE_CHUNK):
+                scores[start:start + _SCORE_CHUNK] = self.matrix[start:start + _SCORE_CHUNK].astype(np.float32) @ q
+            scores[self.stale] = -np.inf
+            ids = self.ids
+            if self.delta:
+                ids = np.concatenate([ids, np.fromiter(self.delta, dtype=np.int64, count=len(self.delta))])
+                scores = np.concatenate([scores, np.stack(list(self.delta.values())) @ q])
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), round(float(scores[i]), 4)) for i in top if scores[i] >= min_score]
+
+    def stats(self):
+        return {"rows": len(self.ids), "delta": len(self.delta), "stale": int(self.stale.sum()),
+                "dim": self.model.dim if self.model else 0, "fitted_docs": self.fitted_docs,
+                "changed_since_fit": self.changed_since_fit, "seq": self.seq}